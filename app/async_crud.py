@@ -0,0 +1,298 @@
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+from . import models
+from .cache import balance_cache
+from .hashing import password_hasher, needs_rehash
+from .crud import (
+    TransferResult, TRANSFER_SQL, transfer_params, transfer_outcome,
+    TRANSACTION_PAGE_SIZE, transaction_page_query, transaction_page,
+    EXPORT_CHUNK_ROWS, TRANSACTION_EXPORT_STATEMENT, transaction_export_params,
+    TRANSFER_PROCEDURE_SQL, EQUB_DEPOSIT_PROCEDURE_SQL, EQUB_WITHDRAWAL_PROCEDURE_SQL,
+    map_transfer_procedure, map_equb_deposit_procedure, map_equb_withdrawal_procedure,
+    USER_STATEMENT, LEDGER_USER_STATEMENT, with_balance,
+    CONSOLIDATE_SHARDS_SQL, DEBIT_USER_SQL, CREDIT_USER_SQL, TRANSFER_ATTEMPTS, is_deadlock, deadlock_backoff,
+    LEDGER_TRANSFER_SQL, LEDGER_EQUB_DEPOSIT_SQL, LEDGER_EQUB_WITHDRAWAL_SQL
+)
+from .database import CRUD_MODE
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import Optional
+import asyncio
+import uuid
+
+# Async counterparts of the functions in crud.py. They keep the same return
+# conventions ((ok, result) tuples, None for missing users) so the endpoints in
+# async_routes.py map errors exactly like the sync handlers in main.py.
+
+async def get_user_by_phone(db: AsyncSession, phone_number: str):
+    statement = LEDGER_USER_STATEMENT if CRUD_MODE == "ledger" else USER_STATEMENT
+    result = await db.execute(statement.where(models.User.phone_number == phone_number))
+    return with_balance(result.first())
+
+async def create_user(db: AsyncSession, phone_number: str, username: str, password: str, initial_balance: float = 0.0):
+    try:
+        # bcrypt is CPU bound; it runs in the hashing process pool
+        hashed = await password_hasher.hash(password)
+        user = models.User(
+            phone_number=phone_number,
+            username=username,
+            password_hash=hashed,
+            balance=Decimal(str(initial_balance))
+        )
+        db.add(user)
+        await db.commit()
+        balance_cache.invalidate(phone_number)
+        return user
+    except Exception as e:
+        await db.rollback()
+        raise e
+
+async def authenticate_user(db: AsyncSession, phone_number: str, password: str):
+    user = await get_user_by_phone(db, phone_number)
+    if not user:
+        return None
+    if not await password_hasher.verify(password, user.password_hash):
+        return None
+    if needs_rehash(user.password_hash):
+        user.password_hash = await password_hasher.hash(password)
+        await db.commit()
+    return user
+
+
+async def transfer_money(db: AsyncSession, from_phone: str, to_phone: str, amount: float):
+    params = transfer_params(from_phone, to_phone, amount)
+    for attempt in range(1, TRANSFER_ATTEMPTS + 1):
+        try:
+            row = (await db.execute(TRANSFER_SQL, params)).one()
+            ok, result = transfer_outcome(row, from_phone, to_phone)
+            if not ok and result == "Insufficient balance":
+                await db.rollback()
+                moved = (await db.execute(CONSOLIDATE_SHARDS_SQL, {"phone": from_phone})).scalar()
+                await db.commit()
+                if moved:
+                    row = (await db.execute(TRANSFER_SQL, params)).one()
+                    ok, result = transfer_outcome(row, from_phone, to_phone)
+            if ok:
+                await db.commit()
+                balance_cache.invalidate(from_phone, to_phone)
+            else:
+                await db.rollback()
+            return ok, result
+
+        except Exception as e:
+            await db.rollback()
+            if attempt == TRANSFER_ATTEMPTS or not is_deadlock(e):
+                return False, str(e)
+            await asyncio.sleep(deadlock_backoff(attempt))
+
+
+async def debit_user(db: AsyncSession, phone_number: str, amount: Decimal) -> Optional[Decimal]:
+    params = {"phone": phone_number, "amount": amount}
+    new_balance = (await db.execute(DEBIT_USER_SQL, params)).scalar()
+    if new_balance is None and (await db.execute(CONSOLIDATE_SHARDS_SQL, {"phone": phone_number})).scalar():
+        new_balance = (await db.execute(DEBIT_USER_SQL, params)).scalar()
+    return new_balance
+
+
+async def create_equb_account(db: AsyncSession, phone_number: str, amount: float, duration_months: int):
+    if amount < 500:
+        return False, "Minimum deposit amount is 500 Birr"
+
+    user = await get_user_by_phone(db, phone_number)
+    if not user:
+        return False, "User not found"
+
+    if user.balance < Decimal(str(amount)):
+        return False, "Insufficient balance"
+
+    # For testing: make equb mature immediately (remove this in production)
+    maturity_date = datetime.utcnow() + timedelta(seconds=30)  # 30 seconds for testing
+
+    try:
+        if await debit_user(db, phone_number, Decimal(str(amount))) is None:
+            await db.rollback()
+            return False, "Insufficient balance"
+
+        equb_account = models.EqubAccount(
+            id=uuid.uuid4(),
+            phone_number=phone_number,
+            amount=Decimal(str(amount)),
+            deposit_date=datetime.utcnow(),
+            maturity_date=maturity_date,
+            can_withdraw=False,
+            is_active=True
+        )
+        db.add(equb_account)
+
+        tx = models.Transaction(
+            from_phone=phone_number,
+            to_phone=phone_number,
+            amount=Decimal(str(amount)),
+            transaction_type=models.TransactionType.EQUB_DEPOSIT,
+            status=models.TransactionStatus.COMPLETED,
+            created_at=datetime.utcnow()
+        )
+        db.add(tx)
+
+        await db.commit()
+        balance_cache.invalidate(phone_number)
+        return True, equb_account
+    except Exception as e:
+        await db.rollback()
+        return False, str(e)
+
+
+async def get_equb_accounts(db: AsyncSession, phone_number: str):
+    result = await db.execute(select(models.EqubAccount).where(
+        models.EqubAccount.phone_number == phone_number,
+        models.EqubAccount.is_active == True
+    ))
+    return result.scalars().all()
+
+
+async def withdraw_equb(db: AsyncSession, phone_number: str, equb_account_id: str):
+    user = await get_user_by_phone(db, phone_number)
+    if not user:
+        return False, "User not found"
+
+    try:
+        equb_uuid = uuid.UUID(equb_account_id)
+    except ValueError:
+        return False, "Invalid equb account ID"
+
+    # Locked for the same reason as in crud.withdraw_equb: no double payout
+    result = await db.execute(select(models.EqubAccount).where(
+        models.EqubAccount.id == equb_uuid,
+        models.EqubAccount.phone_number == phone_number,
+        models.EqubAccount.is_active == True
+    ).with_for_update())
+    equb_account = result.scalars().first()
+
+    if not equb_account:
+        await db.rollback()
+        return False, "Equb account not found"
+
+    if not equb_account.can_withdraw and equb_account.maturity_date > datetime.utcnow():
+        await db.rollback()
+        return False, "Equb account not mature for withdrawal"
+
+    try:
+        equb_account.can_withdraw = True
+        equb_account.is_active = False
+        new_balance = (await db.execute(CREDIT_USER_SQL, {"phone": phone_number, "amount": equb_account.amount})).scalar_one()
+
+        tx = models.Transaction(
+            id=uuid.uuid4(),
+            from_phone=phone_number,
+            to_phone=phone_number,
+            amount=equb_account.amount,
+            transaction_type=models.TransactionType.EQUB_WITHDRAWAL,
+            status=models.TransactionStatus.COMPLETED,
+            created_at=datetime.utcnow()
+        )
+        db.add(tx)
+
+        await db.commit()
+        balance_cache.invalidate(phone_number)
+        return True, TransferResult(tx.id, new_balance)
+    except Exception as e:
+        await db.rollback()
+        return False, str(e)
+
+
+async def get_user_transactions(db: AsyncSession, phone_number: str, cursor: Optional[str] = None, limit: int = TRANSACTION_PAGE_SIZE):
+    result = await db.execute(*transaction_page_query(phone_number, cursor, limit))
+    return transaction_page(result.scalars().all(), limit)
+
+
+async def stream_user_transactions(conn: AsyncConnection, phone_number: str, start: Optional[datetime] = None,
+                                   end: Optional[datetime] = None, chunk_rows: int = EXPORT_CHUNK_ROWS):
+    result = await conn.stream(TRANSACTION_EXPORT_STATEMENT, transaction_export_params(phone_number, start, end))
+    async for chunk in result.partitions(chunk_rows):
+        yield chunk
+
+
+async def _call_procedure(db: AsyncSession, statement, params: dict):
+    try:
+        raw = (await db.execute(statement, params)).scalar_one()
+        await db.commit()
+        return raw
+    except Exception:
+        await db.rollback()
+        raise
+
+
+async def db_transfer_money(db: AsyncSession, from_phone: str, to_phone: str, amount: float):
+    try:
+        raw = await _call_procedure(db, TRANSFER_PROCEDURE_SQL, {
+            "from_phone": from_phone, "to_phone": to_phone, "amount": Decimal(str(amount))
+        })
+    except Exception as e:
+        return False, str(e)
+    balance_cache.invalidate(from_phone, to_phone)
+    return map_transfer_procedure(raw)
+
+
+async def db_create_equb_account(db: AsyncSession, phone_number: str, amount: float, duration_months: int):
+    try:
+        raw = await _call_procedure(db, EQUB_DEPOSIT_PROCEDURE_SQL, {
+            "phone_number": phone_number, "amount": Decimal(str(amount)), "duration_months": duration_months
+        })
+    except Exception as e:
+        return False, str(e)
+    balance_cache.invalidate(phone_number)
+    return map_equb_deposit_procedure(raw, phone_number)
+
+
+async def db_withdraw_equb(db: AsyncSession, phone_number: str, equb_account_id: str):
+    try:
+        equb_uuid = uuid.UUID(equb_account_id)
+    except ValueError:
+        return False, "Invalid equb account ID"
+
+    try:
+        raw = await _call_procedure(db, EQUB_WITHDRAWAL_PROCEDURE_SQL, {
+            "phone_number": phone_number, "equb_account_id": str(equb_uuid)
+        })
+    except Exception as e:
+        return False, str(e)
+    balance_cache.invalidate(phone_number)
+    return map_equb_withdrawal_procedure(raw)
+
+
+async def ledger_transfer_money(db: AsyncSession, from_phone: str, to_phone: str, amount: float):
+    try:
+        raw = await _call_procedure(db, LEDGER_TRANSFER_SQL, {
+            "from_phone": from_phone, "to_phone": to_phone, "amount": Decimal(str(amount))
+        })
+    except Exception as e:
+        return False, str(e)
+    balance_cache.invalidate(from_phone, to_phone)
+    return map_transfer_procedure(raw)
+
+
+async def ledger_create_equb_account(db: AsyncSession, phone_number: str, amount: float, duration_months: int):
+    try:
+        raw = await _call_procedure(db, LEDGER_EQUB_DEPOSIT_SQL, {
+            "phone_number": phone_number, "amount": Decimal(str(amount)), "duration_months": duration_months
+        })
+    except Exception as e:
+        return False, str(e)
+    balance_cache.invalidate(phone_number)
+    return map_equb_deposit_procedure(raw, phone_number)
+
+
+async def ledger_withdraw_equb(db: AsyncSession, phone_number: str, equb_account_id: str):
+    try:
+        equb_uuid = uuid.UUID(equb_account_id)
+    except ValueError:
+        return False, "Invalid equb account ID"
+
+    try:
+        raw = await _call_procedure(db, LEDGER_EQUB_WITHDRAWAL_SQL, {
+            "phone_number": phone_number, "equb_account_id": str(equb_uuid)
+        })
+    except Exception as e:
+        return False, str(e)
+    balance_cache.invalidate(phone_number)
+    return map_equb_withdrawal_procedure(raw)
@@ -0,0 +1,188 @@
+import os
+from datetime import datetime
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import async_crud, crud, rate_limiter, responses, schemas
+from .cache import balance_cache
+from .events import event_stream_response
+from .transfer_pipeline import transfer_pipeline, TRANSFER_PIPELINE
+from .database import CRUD_MODE, async_export_engine, get_async_db
+
+# Async mirror of the endpoints in main.py, mounted instead of them when
+# DB_MODE=async. Error mapping and response shapes must stay identical.
+router = APIRouter()
+
+BATCH_TRANSFER_CHUNK_SIZE = int(os.getenv("BATCH_TRANSFER_CHUNK_SIZE", "1000"))
+
+if CRUD_MODE == "db":
+    transfer_money, create_equb_account, withdraw_equb = async_crud.db_transfer_money, async_crud.db_create_equb_account, async_crud.db_withdraw_equb
+elif CRUD_MODE == "ledger":
+    transfer_money, create_equb_account, withdraw_equb = async_crud.ledger_transfer_money, async_crud.ledger_create_equb_account, async_crud.ledger_withdraw_equb
+else:
+    transfer_money, create_equb_account, withdraw_equb = async_crud.transfer_money, async_crud.create_equb_account, async_crud.withdraw_equb
+    if TRANSFER_PIPELINE:
+        # Group commits run on the sync engine in the pipeline's thread
+        transfer_money = transfer_pipeline.transfer_async
+# Batches are bulk statements in python and db mode alike; the ledger appends entries instead
+batch_transfer_money = crud.ledger_batch_transfer_money if CRUD_MODE == "ledger" else crud.batch_transfer_money
+
+
+@router.post("/auth/signup", response_model=schemas.AuthResponse, dependencies=[Depends(rate_limiter.auth_rate_limit)])
+async def signup(payload: schemas.SignupRequest, db: AsyncSession = Depends(get_async_db)):
+    existing_user = await async_crud.get_user_by_phone(db, payload.phoneNumber)
+    if existing_user:
+        raise HTTPException(status_code=409, detail="Phone number already registered")
+
+    user = await async_crud.create_user(db, payload.phoneNumber, payload.username, payload.password, 1000.0)
+    if not user:
+        raise HTTPException(status_code=500, detail="Failed to create user")
+
+    return responses.json_response(responses.auth_response("Account created successfully", user))
+
+
+@router.post("/auth/login", response_model=schemas.AuthResponse, dependencies=[Depends(rate_limiter.auth_rate_limit)])
+async def login(payload: schemas.LoginRequest, db: AsyncSession = Depends(get_async_db)):
+    user = await async_crud.authenticate_user(db, payload.phoneNumber, payload.password)
+    if not user:
+        raise HTTPException(status_code=401, detail="Invalid phone number or password")
+
+    return responses.json_response(responses.auth_response("Login successful", user))
+
+
+@router.post("/transactions/send-money", response_model=schemas.TransactionResponse, dependencies=[Depends(rate_limiter.transaction_rate_limit)])
+async def send_money(payload: schemas.SendMoneyRequest, db: AsyncSession = Depends(get_async_db)):
+    sender_phone = payload.senderPhone
+
+    if sender_phone == payload.recipientPhone:
+        raise HTTPException(status_code=400, detail="Cannot send money to yourself")
+
+    ok, result = await transfer_money(db, sender_phone, payload.recipientPhone, float(payload.amount))
+    if not ok:
+        if "Insufficient balance" in result:
+            raise HTTPException(status_code=400, detail="Insufficient balance")
+        elif "not found" in result:
+            raise HTTPException(status_code=404, detail="Recipient not found")
+        else:
+            raise HTTPException(status_code=500, detail=result)
+
+    return responses.json_response(responses.transaction_response("Money sent successfully", result))
+
+
+@router.post("/transactions/batch-send", response_model=schemas.BatchTransferResponse, dependencies=[Depends(rate_limiter.transaction_rate_limit)])
+async def batch_send_money(payload: schemas.BatchTransferRequest, db: AsyncSession = Depends(get_async_db)):
+    transfers = [(item.recipientPhone, float(item.amount)) for item in payload.transfers]
+    # The batch is a handful of bulk statements; run the sync implementation on the async connection
+    ok, result = await db.run_sync(batch_transfer_money, payload.senderPhone, transfers, BATCH_TRANSFER_CHUNK_SIZE)
+    if not ok:
+        if "not found" in result:
+            raise HTTPException(status_code=404, detail="Sender not found")
+        raise HTTPException(status_code=500, detail=result)
+
+    return responses.json_response(responses.batch_transfer_response(result))
+
+
+@router.post("/equb/deposit", response_model=schemas.EqubDepositResponse, dependencies=[Depends(rate_limiter.transaction_rate_limit)])
+async def equb_deposit(payload: schemas.EqubDepositRequest, db: AsyncSession = Depends(get_async_db)):
+    ok, result = await create_equb_account(db, payload.phoneNumber, float(payload.amount), payload.durationMonths)
+    if not ok:
+        if "Minimum deposit" in result:
+            raise HTTPException(status_code=400, detail="Minimum deposit is 500 Birr")
+        elif "Insufficient balance" in result:
+            raise HTTPException(status_code=400, detail="Insufficient balance")
+        elif "not found" in result:
+            raise HTTPException(status_code=404, detail="User not found")
+        else:
+            raise HTTPException(status_code=500, detail=result)
+
+    return responses.json_response(responses.equb_deposit_response(result))
+
+
+@router.post("/equb/withdraw", response_model=schemas.EqubWithdrawResponse, dependencies=[Depends(rate_limiter.transaction_rate_limit)])
+async def equb_withdraw(payload: schemas.EqubWithdrawRequest, db: AsyncSession = Depends(get_async_db)):
+    ok, result = await withdraw_equb(db, payload.phoneNumber, payload.equbAccountId)
+    if not ok:
+        if "not found" in result:
+            raise HTTPException(status_code=404, detail="Equb account not found")
+        elif "not mature" in result:
+            raise HTTPException(status_code=400, detail="Equb not mature for withdrawal")
+        elif "Invalid" in result:
+            raise HTTPException(status_code=400, detail="Invalid equb account ID")
+        else:
+            raise HTTPException(status_code=500, detail=result)
+
+    return responses.json_response(responses.transaction_response("Equb withdrawal successful", result))
+
+
+@router.get("/user/transactions")
+async def get_transaction_history(request: Request, phoneNumber: str = Query(...), cursor: Optional[str] = Query(None),
+                                  limit: int = Query(crud.TRANSACTION_PAGE_SIZE, ge=1, le=crud.MAX_TRANSACTION_PAGE_SIZE), db: AsyncSession = Depends(get_async_db)):
+    # History only changes through writes that bump the user's version, so a
+    # poller holding the current tag is answered before any query; versions
+    # expire after BALANCE_CACHE_TTL, bounding what writes on other hosts miss
+    tag = responses.etag(balance_cache.version(phoneNumber))
+    if responses.etag_matches(request, tag):
+        return responses.not_modified(tag)
+
+    user = await async_crud.get_user_by_phone(db, phoneNumber)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    try:
+        page = await async_crud.get_user_transactions(db, phoneNumber, cursor, limit)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    return responses.json_response(responses.transaction_history_response(page), headers=responses.validator_headers(tag))
+
+
+@router.get("/user/transactions/export")
+async def export_transactions(phoneNumber: str = Query(...), start: Optional[datetime] = Query(None), end: Optional[datetime] = Query(None),
+                              fmt: str = Query("csv", alias="format", pattern="^(csv|ndjson)$"), db: AsyncSession = Depends(get_async_db)):
+    user = await async_crud.get_user_by_phone(db, phoneNumber)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    if start and end and start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    await db.close()  # release its connection; the export takes its own for as long as it streams
+
+    async def body():
+        yield responses.export_header(fmt)
+        async with async_export_engine.connect() as conn:
+            async for rows in async_crud.stream_user_transactions(conn, phoneNumber, start, end):
+                yield responses.export_chunk(rows, fmt)
+
+    return responses.transaction_export_response(body(), fmt, phoneNumber)
+
+
+@router.get("/user/check-phone")
+async def check_phone_number(phoneNumber: str = Query(...), db: AsyncSession = Depends(get_async_db)):
+    async def load():
+        user = await async_crud.get_user_by_phone(db, phoneNumber)
+        if not user:
+            raise HTTPException(status_code=404, detail="Phone number not found")
+        return responses.snapshot(responses.check_phone_response(user))
+
+    return responses.json_body((await balance_cache.read_through_async(phoneNumber, "check-phone", load)).body)
+
+
+@router.get("/user/events")
+async def user_events(phoneNumber: str = Query(...)):
+    return event_stream_response(phoneNumber)
+
+
+@router.get("/user/balance", response_model=schemas.BalanceResponse)
+async def get_balance(request: Request, phoneNumber: str = Query(...), db: AsyncSession = Depends(get_async_db)):
+    # Cache hits are answered without touching the database, with a 304 if the
+    # client's If-None-Match is current; every write in async_crud.py
+    # invalidates the users it changed
+    async def load():
+        user = await async_crud.get_user_by_phone(db, phoneNumber)
+        if not user:
+            raise HTTPException(status_code=404, detail="User not found")
+
+        # canWithdraw is derived from maturity_date; the maturity scheduler keeps the stored flag in step
+        equb_accounts = await async_crud.get_equb_accounts(db, phoneNumber)
+        return responses.balance_snapshot(user, equb_accounts)
+
+    return responses.conditional_json(request, await balance_cache.read_through_async(phoneNumber, "balance", load))
@@ -1,4 +1,10 @@
-from typing import Optional
+from typing import NamedTuple, Optional
+from collections import OrderedDict
+from functools import lru_cache
+import hashlib
+import logging
+import threading
+import time
 import jwt
 import requests
 from fastapi import Depends, HTTPException, status
@@ -12,50 +18,223 @@ import os
 NHOST_GRAPHQL_URL = os.getenv("NHOST_GRAPHQL_URL", "https://mctmbhyqosnmbqorlhna.nhost.run/v1/graphql")
 NHOST_HASURA_ADMIN_SECRET = os.getenv("NHOST_HASURA_ADMIN_SECRET", "d9e91e8f1e8c4e8b9e8c8e8c8e8c8e8c")
 NHOST_JWT_ALGORITHM = "RS256"
+NHOST_JWT_ISSUER = os.getenv("NHOST_JWT_ISSUER", "https://mctmbhyqosnmbqorlhna.nhost.run")
+NHOST_JWKS_URL = os.getenv("NHOST_JWKS_URL", NHOST_GRAPHQL_URL.replace('/graphql', '/.well-known/jwks.json'))
+
+# JWKS cache tuning (seconds)
+JWKS_TTL = float(os.getenv("JWKS_TTL", "3600"))
+JWKS_FETCH_TIMEOUT = float(os.getenv("JWKS_FETCH_TIMEOUT", "3"))
+JWKS_MIN_REFETCH_INTERVAL = float(os.getenv("JWKS_MIN_REFETCH_INTERVAL", "30"))
+JWKS_MAX_STALE = float(os.getenv("JWKS_MAX_STALE", "86400"))
+# Verified tokens kept per worker; 0 disables the cache
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+# Local user lookups cached per worker by sync_user_with_nhost
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "300"))
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "50000"))
+
+logger = logging.getLogger(__name__)
 
 security = HTTPBearer()
 
-# Cache for Nhost public key
-_nhost_public_key = None
 
-def get_nhost_public_key():
-    """Fetch Nhost's public key for JWT verification"""
-    global _nhost_public_key
-    if _nhost_public_key:
-        return _nhost_public_key
-    
-    try:
-        # Fetch JWKS from Nhost
-        jwks_url = NHOST_GRAPHQL_URL.replace('/graphql', '/.well-known/jwks.json')
-        response = requests.get(jwks_url)
+class JWKSKeyStore:
+    """Nhost signing keys indexed by kid.
+
+    A background thread refreshes the key set every `ttl` seconds, so token
+    verification only reads a dict. A token with an unknown kid (key rotation)
+    triggers one refetch shared by all concurrent callers, at most once per
+    `min_refetch_interval`. If a refresh fails the previous keys keep being
+    served for up to `max_stale` seconds past their TTL.
+    """
+
+    def __init__(self, url: str, ttl: float, timeout: float, min_refetch_interval: float, max_stale: float):
+        self.url = url
+        self.ttl = ttl
+        self.timeout = timeout
+        self.min_refetch_interval = min_refetch_interval
+        self.max_stale = max_stale
+        self.fetch_count = 0
+        self._keys = {}
+        self._fetched_at = None
+        self._last_attempt = None
+        self._lock = threading.Lock()
+        self._inflight = None
+        self._stop = threading.Event()
+        self._refresher = None
+
+    def _fetch(self) -> dict:
+        self.fetch_count += 1
+        response = requests.get(self.url, timeout=self.timeout)
         response.raise_for_status()
-        jwks = response.json()
-        
-        # Extract the first key (Nhost typically uses one key)
-        key_data = jwks['keys'][0]
-        _nhost_public_key = jwt.algorithms.RSAAlgorithm.from_jwk(key_data)
-        return _nhost_public_key
-    except Exception as e:
+        keys = {}
+        for key_data in response.json().get("keys", []):
+            if key_data.get("kty") == "RSA":
+                keys[key_data.get("kid")] = jwt.algorithms.RSAAlgorithm.from_jwk(key_data)
+        if not keys:
+            raise ValueError("JWKS contains no RSA keys")
+        return keys
+
+    def refresh(self) -> bool:
+        """Fetch the key set; concurrent callers wait for the same fetch"""
+        with self._lock:
+            event = self._inflight
+            leader = event is None
+            if leader:
+                event = self._inflight = threading.Event()
+                self._last_attempt = time.monotonic()
+        if not leader:
+            event.wait(self.timeout + 1)
+            return bool(self._keys)
+
+        try:
+            keys = self._fetch()
+            with self._lock:
+                self._keys = keys
+                self._fetched_at = time.monotonic()
+            return True
+        except Exception as e:
+            logger.warning("JWKS refresh from %s failed, serving cached keys: %s", self.url, e)
+            return False
+        finally:
+            with self._lock:
+                self._inflight = None
+            event.set()
+
+    def _usable_keys(self) -> dict:
+        if self._fetched_at is None or time.monotonic() - self._fetched_at > self.ttl + self.max_stale:
+            return {}
+        return self._keys
+
+    @staticmethod
+    def _select(keys: dict, kid: Optional[str]):
+        if kid is None:
+            # Tokens without a kid are only accepted while there is a single key
+            return next(iter(keys.values())) if len(keys) == 1 else None
+        return keys.get(kid)
+
+    def get_key(self, kid: Optional[str]):
+        key = self._select(self._usable_keys(), kid)
+        if key is not None:
+            return key
+
+        # Unknown kid: the signing key may have rotated. Rate limited so
+        # tokens with made-up kids cannot make us hammer the JWKS endpoint.
+        last_attempt = self._last_attempt
+        if last_attempt is None or time.monotonic() - last_attempt >= self.min_refetch_interval:
+            self.refresh()
+        return self._select(self._usable_keys(), kid)
+
+    def has_keys(self) -> bool:
+        return bool(self._usable_keys())
+
+    def _run(self):
+        while True:
+            # Retry failed refreshes sooner than a full TTL
+            interval = self.ttl if self.has_keys() else min(self.ttl, self.min_refetch_interval)
+            if self._stop.wait(interval):
+                return
+            self.refresh()
+
+    def start(self, prewarm: bool = True):
+        if prewarm:
+            self.refresh()
+        if self._refresher is None:
+            self._stop.clear()
+            self._refresher = threading.Thread(target=self._run, name="jwks-refresh", daemon=True)
+            self._refresher.start()
+
+    def stop(self):
+        self._stop.set()
+        self._refresher = None
+
+
+jwks_store = JWKSKeyStore(NHOST_JWKS_URL, JWKS_TTL, JWKS_FETCH_TIMEOUT, JWKS_MIN_REFETCH_INTERVAL, JWKS_MAX_STALE)
+
+
+def get_nhost_public_key(kid: Optional[str] = None):
+    """Return Nhost's public key for `kid` from the JWKS cache"""
+    public_key = jwks_store.get_key(kid)
+    if public_key is None:
+        if not jwks_store.has_keys():
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Could not fetch Nhost public keys"
+            )
         raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Could not fetch Nhost public key: {str(e)}"
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid token: unknown signing key"
         )
+    return public_key
+
+
+class TokenCache:
+    """Bounded LRU of verified token claims, keyed by the token's SHA-256.
+
+    Entries live until the token's `exp`, so the RSA signature check only
+    runs for the first request that presents a token. A key removed from
+    the JWKS does not evict tokens already cached.
+    """
 
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
 
+    @staticmethod
+    def _digest(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token: str) -> Optional[dict]:
+        if self.max_size <= 0:
+            return None
+        digest = self._digest(token)
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is not None and entry[0] > time.time():
+                self._entries.move_to_end(digest)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[digest]
+            self.misses += 1
+            return None
+
+    def put(self, token: str, payload: dict):
+        expires_at = payload.get("exp")
+        if self.max_size <= 0 or not isinstance(expires_at, (int, float)):
+            return
+        digest = self._digest(token)
+        with self._lock:
+            self._entries[digest] = (expires_at, payload)
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"size": len(self._entries), "maxSize": self.max_size, "hits": self.hits, "misses": self.misses}
+
+
+token_cache = TokenCache(TOKEN_CACHE_SIZE)
 
 
 def verify_token_only(credentials: HTTPAuthorizationCredentials = Depends(security)):
     """Verify JWT token issued by Nhost"""
     token = credentials.credentials
     try:
-        public_key = get_nhost_public_key()
-        payload = jwt.decode(
-            token, 
-            public_key, 
-            algorithms=[NHOST_JWT_ALGORITHM],
-            audience=["authenticated"],
-            issuer="https://mctmbhyqosnmbqorlhna.nhost.run"
-        )
+        payload = token_cache.get(token)
+        if payload is None:
+            public_key = get_nhost_public_key(jwt.get_unverified_header(token).get("kid"))
+            payload = jwt.decode(
+                token, 
+                public_key, 
+                algorithms=[NHOST_JWT_ALGORITHM],
+                audience=["authenticated"],
+                issuer=NHOST_JWT_ISSUER
+            )
+            token_cache.put(token, payload)
         
         # Extract user information from Nhost token
         user_metadata = payload.get("https://hasura.io/jwt/claims", {})
@@ -67,6 +246,8 @@ def verify_token_only(credentials: HTTPAuthorizationCredentials = Depends(securi
                 detail="Invalid token payload - no user ID found"
             )
         return phone_number
+    except HTTPException:
+        raise
     except jwt.ExpiredSignatureError:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED, 
@@ -105,24 +286,98 @@ def get_current_user():
     return dependency
 
 
-def sync_user_with_nhost(phone_number: str, db: Session):
-    """Sync user from Nhost to local database"""
+class ResolvedUser(NamedTuple):
+    """Identity of a local user; balances are always read from the database"""
+    phone_number: str
+    username: str
+    is_active: bool
+
+
+class _Flight:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class UserResolver:
+    """Per-worker phone -> local user cache used by sync_user_with_nhost.
+
+    Known users resolve without a query until `ttl` expires. Nothing the
+    API writes changes the cached fields (balances are not cached), so
+    entries only age out. Concurrent misses for the same phone wait for a
+    single lookup/insert instead of racing to create the user.
+    """
+
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def get(self, phone_number: str) -> Optional[ResolvedUser]:
+        with self._lock:
+            entry = self._entries.get(phone_number)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(phone_number)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            return None
+
+    def put(self, user: ResolvedUser):
+        with self._lock:
+            self._entries[user.phone_number] = (time.monotonic() + self.ttl, user)
+            self._entries.move_to_end(user.phone_number)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def resolve(self, phone_number: str, db: Session) -> ResolvedUser:
+        user = self.get(phone_number)
+        if user is not None:
+            return user
+
+        with self._lock:
+            flight = self._inflight.get(phone_number)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[phone_number] = _Flight()
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            # Nhost users have no local password; give them the hash of "" like before
+            local_user = crud.get_or_create_user(db, phone_number, f"user_{phone_number}", nhost_password_hash())
+            flight.result = ResolvedUser(local_user.phone_number, local_user.username, local_user.is_active)
+            self.put(flight.result)
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[phone_number]
+            flight.event.set()
+
+
+user_resolver = UserResolver(USER_CACHE_TTL, USER_CACHE_SIZE)
+
+
+@lru_cache(maxsize=1)
+def nhost_password_hash() -> str:
+    return crud.get_password_hash("")
+
+
+def sync_user_with_nhost(phone_number: str, db: Session) -> ResolvedUser:
+    """Resolve the Nhost user to a local user, creating it on first sight"""
     try:
-        # Check if user exists locally
-        existing_user = crud.get_user_by_phone(db, phone_number)
-        if existing_user:
-            return existing_user
-        
-        # Create user in local database to match Nhost user
-        # You might want to fetch additional user info from Nhost GraphQL API
-        user = crud.create_user(
-            db, 
-            phone_number=phone_number, 
-            username=f"user_{phone_number}",  # Default username
-            password="",  # No password needed for Nhost users
-            initial_balance=0.0
-        )
-        return user
+        return user_resolver.resolve(phone_number, db)
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -0,0 +1,195 @@
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+import os
+import struct
+import threading
+import time
+from .shm import SharedTable, default_path, fcntl, key_hash64
+
+# Snapshots kept per worker; 0 disables the cache
+BALANCE_CACHE_SIZE = int(os.getenv("BALANCE_CACHE_SIZE", "100000"))
+# Seconds a user's version (and so every snapshot and ETag tagged with it) lasts
+# without a write. Invalidation only reaches the workers of one host, so this
+# bounds how stale another instance's writes can leave them; 0 is unbounded,
+# for single-instance deployments only
+BALANCE_CACHE_TTL = float(os.getenv("BALANCE_CACHE_TTL", "5"))
+
+
+def _new_version() -> int:
+    # Versions start from the clock, so a user whose slot was evicted or reset
+    # never gets back a version an older snapshot was tagged with
+    return time.time_ns()
+
+
+def _expired(version: int, ttl_ns: int) -> bool:
+    return ttl_ns > 0 and time.time_ns() - version >= ttl_ns
+
+
+class MemoryVersionStore:
+    """Per-user versions for this process only; least recently used users are evicted"""
+
+    def __init__(self, max_keys: int = 500000, ttl: float = 0):
+        self.max_keys = max_keys
+        self.ttl_ns = int(ttl * 1e9)
+        self._versions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def current(self, key: str) -> int:
+        with self._lock:
+            version = self._versions.pop(key, None)
+            if version is None or _expired(version, self.ttl_ns):
+                version = _new_version()
+            self._versions[key] = version
+            if len(self._versions) > self.max_keys:
+                self._versions.popitem(last=False)
+            return version
+
+    def bump(self, *keys: str):
+        with self._lock:
+            for key in keys:
+                self._versions.pop(key, None)
+                self._versions[key] = _new_version()
+            while len(self._versions) > self.max_keys:
+                self._versions.popitem(last=False)
+
+
+class SharedVersionStore:
+    """Per-user versions in a memory-mapped table shared by every worker on the host.
+
+    A bump in one worker invalidates every worker's snapshot of that user.
+    A key lives in one of `probe` slots after its hash; when they are all
+    taken the slot with the oldest version is reused. A version older than
+    `ttl` seconds is replaced on read, for every worker at once.
+    """
+
+    SLOT = struct.Struct("QQ")  # key hash, version
+
+    def __init__(self, path: str, slots: int = 262144, probe: int = 8, ttl: float = 0):
+        self.table = SharedTable(path, self.SLOT, slots)
+        self.slots = slots
+        self.probe = probe
+        self.ttl_ns = int(ttl * 1e9)
+
+    def _find(self, key_hash: int):
+        start = key_hash % self.slots
+        oldest_slot, oldest_version = None, None
+        for i in range(self.probe):
+            index = (start + i) % self.slots
+            slot_hash, version = self.table.read(index)
+            if slot_hash == key_hash:
+                return index, version
+            if oldest_version is None or version < oldest_version:
+                oldest_slot, oldest_version = index, version
+        return oldest_slot, None
+
+    def current(self, key: str) -> int:
+        key_hash = key_hash64(key)
+        with self.table.locked():
+            index, version = self._find(key_hash)
+            if version is None or _expired(version, self.ttl_ns):
+                version = _new_version()
+                self.table.write(index, key_hash, version)
+            return version
+
+    def bump(self, *keys: str):
+        with self.table.locked():
+            for key in keys:
+                key_hash = key_hash64(key)
+                index, version = self._find(key_hash)
+                self.table.write(index, key_hash, max((version or 0) + 1, _new_version()))
+
+
+def default_version_store():
+    backend = os.getenv("BALANCE_CACHE_BACKEND", "shared").lower()
+    if backend == "shared" and fcntl is not None:
+        path = os.getenv("BALANCE_CACHE_SHM_PATH", default_path("telebirr-versions"))
+        return SharedVersionStore(path, slots=int(os.getenv("BALANCE_CACHE_VERSION_SLOTS", "262144")),
+                                  ttl=BALANCE_CACHE_TTL)
+    return MemoryVersionStore(ttl=BALANCE_CACHE_TTL)
+
+
+class Snapshot(NamedTuple):
+    body: bytes
+    version: int
+    valid_until: Optional[float]  # epoch seconds, for responses that change with time alone
+
+
+class SnapshotCache:
+    """Read-through cache of per-user response bodies, checked against user versions.
+
+    Snapshots live in a per-worker LRU. Each one is tagged with the user's
+    version read before the database was queried, and is only served while
+    the version store still returns that version, so any write that calls
+    invalidate() (from any worker, with the shared store) retires it, and
+    so does the version's TTL, for writes made on other hosts.
+    """
+
+    def __init__(self, versions, max_entries: int):
+        self.versions = versions
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "stale": 0, "expired": 0, "invalidations": 0}
+
+    def version(self, phone_number: str) -> int:
+        return self.versions.current(phone_number)
+
+    def _lookup(self, phone_number: str, kind: str):
+        """(snapshot or None, version to tag a fresh snapshot with)"""
+        version = self.versions.current(phone_number)
+        if self.max_entries <= 0:
+            return None, version
+        with self._lock:
+            entry = self._entries.get((phone_number, kind))
+            if entry is None:
+                self.counters["misses"] += 1
+            elif entry.version != version:
+                self.counters["stale"] += 1
+            elif entry.valid_until is not None and entry.valid_until <= time.time():
+                self.counters["expired"] += 1
+            else:
+                self._entries.move_to_end((phone_number, kind))
+                self.counters["hits"] += 1
+                return entry, version
+        return None, version
+
+    def _store(self, phone_number: str, kind: str, snapshot: Snapshot) -> Snapshot:
+        if self.max_entries > 0:
+            with self._lock:
+                self._entries[(phone_number, kind)] = snapshot
+                self._entries.move_to_end((phone_number, kind))
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return snapshot
+
+    def read_through(self, phone_number: str, kind: str, load) -> Snapshot:
+        """Cached snapshot, or load() -> (body, valid_until) stored for next time"""
+        snapshot, version = self._lookup(phone_number, kind)
+        if snapshot is None:
+            body, valid_until = load()
+            snapshot = self._store(phone_number, kind, Snapshot(body, version, valid_until))
+        return snapshot
+
+    async def read_through_async(self, phone_number: str, kind: str, load) -> Snapshot:
+        """read_through() for an async load()"""
+        snapshot, version = self._lookup(phone_number, kind)
+        if snapshot is None:
+            body, valid_until = await load()
+            snapshot = self._store(phone_number, kind, Snapshot(body, version, valid_until))
+        return snapshot
+
+    def invalidate(self, *phone_numbers: str):
+        """Call after committing any write that changes what these users see"""
+        self.versions.bump(*phone_numbers)
+        self.counters["invalidations"] += len(phone_numbers)
+
+    def stats(self) -> dict:
+        lookups = self.counters["hits"] + self.counters["misses"] + self.counters["stale"] + self.counters["expired"]
+        return {
+            **self.counters,
+            "entries": len(self._entries),
+            "hitRatio": round(self.counters["hits"] / lookups, 4) if lookups else None
+        }
+
+
+balance_cache = SnapshotCache(default_version_store(), BALANCE_CACHE_SIZE)
@@ -1,28 +1,46 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import select
-from passlib.context import CryptContext
+from sqlalchemy.orm import Session, aliased
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy import select, insert, text, tuple_, union_all, bindparam, cast, func, DateTime, String
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from . import models
+from .cache import balance_cache
+from .database import CRUD_MODE
+from .hashing import get_password_hash, verify_password
 from datetime import datetime, timedelta
 from decimal import Decimal
+import base64
+import json
+import os
+import random
+import time
+from typing import List, NamedTuple, Optional, Tuple
 import uuid
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Users are loaded with their whole balance: users.balance plus any credit
+# shards, or with CRUD_MODE=ledger (where users.balance is a cache the ledger
+# compactor refreshes) the balance computed from the ledger
+USER_STATEMENT = select(models.User, models.User.balance + func.shard_balance(models.User.phone_number))
+LEDGER_USER_STATEMENT = select(models.User, func.ledger_balance(models.User.phone_number))
 
-def get_password_hash(password: str) -> str:
-    # Ensure password is within bcrypt 72-byte limit
-    if len(password.encode('utf-8')) > 72:
-        password = password[:72]
-    return pwd_context.hash(password)
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+def with_balance(row):
+    """User of a (User, balance) row, with that balance set as if loaded"""
+    if row is None:
+        return None
+    user, balance = row
+    set_committed_value(user, "balance", balance)  # not a change to flush back to users.balance
+    return user
+
 
 def get_user_by_phone(db: Session, phone_number: str):
-    return db.query(models.User).filter(models.User.phone_number == phone_number).first()
+    statement = LEDGER_USER_STATEMENT if CRUD_MODE == "ledger" else USER_STATEMENT
+    return with_balance(db.execute(statement.where(models.User.phone_number == phone_number)).first())
 
 def create_user(db: Session, phone_number: str, username: str, password: str, initial_balance: float = 0.0):
+    return create_user_with_hash(db, phone_number, username, get_password_hash(password), initial_balance)
+
+def create_user_with_hash(db: Session, phone_number: str, username: str, hashed: str, initial_balance: float = 0.0):
     try:
-        hashed = get_password_hash(password)
         user = models.User(
             phone_number=phone_number, 
             username=username, 
@@ -31,12 +49,39 @@ def create_user(db: Session, phone_number: str, username: str, password: str, in
         )
         db.add(user)
         db.commit()
+        balance_cache.invalidate(phone_number)
         db.refresh(user)
         return user
     except Exception as e:
         db.rollback()
         raise e
 
+def get_or_create_user(db: Session, phone_number: str, username: str, hashed: str):
+    """Return the user, inserting it first if missing.
+
+    ON CONFLICT DO NOTHING makes concurrent first requests for the same phone
+    (from any worker) converge on one row instead of failing on the primary key.
+    """
+    user = get_user_by_phone(db, phone_number)
+    if user:
+        return user
+    db.execute(pg_insert(models.User).values(
+        phone_number=phone_number,
+        username=username,
+        password_hash=hashed,
+        balance=Decimal("0.00")
+    ).on_conflict_do_nothing(index_elements=[models.User.phone_number]))
+    db.commit()
+    return get_user_by_phone(db, phone_number)
+
+def update_password_hash(db: Session, user: models.User, hashed: str):
+    user.password_hash = hashed
+    db.add(user)
+    db.commit()
+    # Reread through get_user_by_phone: the balance is more than users.balance
+    # in ledger mode and for an account with credit shards
+    return get_user_by_phone(db, user.phone_number)
+
 def authenticate_user(db: Session, phone_number: str, password: str):
     user = get_user_by_phone(db, phone_number)
     if not user:
@@ -61,48 +106,333 @@ def create_transaction(db: Session, from_phone: str, to_phone: str, amount: floa
     return tx
 
 
+class TransferResult(NamedTuple):
+    id: uuid.UUID
+    new_balance: Decimal
+
+
+# One statement per transfer. `locked` takes both row locks in phone-number
+# order before either UPDATE runs, so opposite-direction transfers between the
+# same pair cannot deadlock. The debit is conditional on the current balance,
+# and the credit and the transactions row only happen if the debit did.
+# A recipient with credit_shards > 0 is not locked: the credit goes to one of
+# its balance_shards rows, picked once in `recipient` (a random() in the
+# UPDATE's WHERE would be drawn again when a concurrent credit to the same
+# shard makes Postgres recheck the row). FOR NO KEY UPDATE lets
+# the transactions foreign keys share-lock a hot recipient while it is debited.
+TRANSFER_SQL = text("""
+WITH recipient AS (
+    SELECT phone_number, credit_shards, floor(random() * credit_shards)::int AS shard
+    FROM users WHERE phone_number = :to_phone
+), locked AS (
+    SELECT phone_number FROM users
+    WHERE phone_number = :from_phone
+       OR phone_number IN (SELECT phone_number FROM recipient WHERE credit_shards = 0)
+    ORDER BY phone_number
+    FOR NO KEY UPDATE
+), debit AS (
+    UPDATE users SET balance = balance - CAST(:amount AS numeric)
+    WHERE phone_number = :from_phone
+      AND balance >= CAST(:amount AS numeric)
+      AND :from_phone <> :to_phone
+      AND EXISTS (SELECT 1 FROM recipient)
+      AND (SELECT count(*) FROM locked) = (SELECT CASE WHEN credit_shards > 0 THEN 1 ELSE 2 END FROM recipient)
+    RETURNING balance
+), credit AS (
+    UPDATE users SET balance = balance + CAST(:amount AS numeric)
+    WHERE phone_number IN (SELECT phone_number FROM locked WHERE phone_number = :to_phone)
+      AND EXISTS (SELECT 1 FROM debit)
+    RETURNING phone_number
+), shard_credit AS (
+    UPDATE balance_shards SET balance = balance_shards.balance + CAST(:amount AS numeric)
+    FROM recipient
+    WHERE balance_shards.phone_number = recipient.phone_number
+      AND balance_shards.shard = recipient.shard
+      AND recipient.credit_shards > 0
+      AND EXISTS (SELECT 1 FROM debit)
+    RETURNING balance_shards.phone_number
+), tx AS (
+    INSERT INTO transactions (id, from_phone, to_phone, amount, transaction_type, status, created_at)
+    SELECT CAST(:tx_id AS uuid), :from_phone, :to_phone, CAST(:amount AS numeric),
+           'TRANSFER'::transaction_type, 'COMPLETED'::transaction_status, CAST(:created_at AS timestamp)
+    WHERE EXISTS (SELECT 1 FROM credit UNION ALL SELECT 1 FROM shard_credit)
+    RETURNING id
+)
+SELECT
+    (SELECT array_agg(phone_number) FROM (SELECT phone_number FROM locked UNION SELECT phone_number FROM recipient) found) AS found,
+    (SELECT balance FROM debit) + shard_balance(:from_phone) AS new_balance,
+    (SELECT id FROM tx) AS tx_id
+""")
+
+
+# Moves an account's balance_shards into users.balance; returns the amount moved
+CONSOLIDATE_SHARDS_SQL = text("SELECT consolidate_balance_shards(:phone)")
+
+# Relative updates for the equb operations, so credits landing in the
+# account's shards meanwhile are neither lost nor counted twice. Both return
+# the new balance including the shards; the debit returns nothing if
+# users.balance does not cover it.
+DEBIT_USER_SQL = text("""
+UPDATE users SET balance = balance - CAST(:amount AS numeric)
+WHERE phone_number = :phone AND balance >= CAST(:amount AS numeric)
+RETURNING balance + shard_balance(phone_number)
+""")
+CREDIT_USER_SQL = text("""
+UPDATE users SET balance = balance + CAST(:amount AS numeric)
+WHERE phone_number = :phone
+RETURNING balance + shard_balance(phone_number)
+""")
+SET_CREDIT_SHARDS_SQL = text("SELECT set_credit_shards(:phone, :shards)")
+MAX_CREDIT_SHARDS = 64
+
+
+def debit_user(db: Session, phone_number: str, amount: Decimal) -> Optional[Decimal]:
+    """Debit users.balance, consolidating the shards first if it falls short; None if still insufficient"""
+    params = {"phone": phone_number, "amount": amount}
+    new_balance = db.execute(DEBIT_USER_SQL, params).scalar()
+    if new_balance is None and db.execute(CONSOLIDATE_SHARDS_SQL, {"phone": phone_number}).scalar():
+        new_balance = db.execute(DEBIT_USER_SQL, params).scalar()
+    return new_balance
+
+
+def set_credit_shards(db: Session, phone_number: str, shards: int) -> bool:
+    """Spread the account's incoming credits over `shards` rows (0 turns it off); False if no such user"""
+    found = db.execute(SET_CREDIT_SHARDS_SQL, {"phone": phone_number, "shards": shards}).scalar()
+    db.commit()
+    balance_cache.invalidate(phone_number)
+    return found
+
+
+def transfer_params(from_phone: str, to_phone: str, amount: float) -> dict:
+    return {
+        "from_phone": from_phone,
+        "to_phone": to_phone,
+        "amount": Decimal(str(amount)),
+        "tx_id": str(uuid.uuid4()),
+        "created_at": datetime.utcnow(),
+    }
+
+
+def transfer_outcome(row, from_phone: str, to_phone: str):
+    """Map a TRANSFER_SQL result row to (ok, TransferResult | error message)"""
+    if row.tx_id is not None:
+        return True, TransferResult(row.tx_id, row.new_balance)
+    found = row.found or []
+    if from_phone not in found:
+        return False, "Sender not found"
+    if to_phone not in found:
+        return False, "Recipient not found"
+    return False, "Insufficient balance"
+
+
+# A deadlock aborts the whole transaction, so the transfer can simply be run
+# again. Concurrent payouts from a sharded account hit them now and then: the
+# FK checks of incoming credits keep share-locking its users row.
+TRANSFER_ATTEMPTS = 5
+
+
+def is_deadlock(error: Exception) -> bool:
+    return getattr(getattr(error, "orig", None), "pgcode", None) == "40P01"
+
+
+def deadlock_backoff(attempt: int) -> float:
+    """Seconds to wait before retrying, jittered so the victims do not collide again"""
+    return random.uniform(0, 0.005 * attempt)
+
+
 def transfer_money(db: Session, from_phone: str, to_phone: str, amount: float):
+    """Move `amount` from sender to recipient in one round trip plus COMMIT.
+
+    Returns (True, TransferResult) with the sender's new balance so callers
+    do not need to re-read the user. A sender whose users.balance falls short
+    gets its credit shards consolidated and the transfer retried once; a
+    deadlock is retried up to TRANSFER_ATTEMPTS times.
+    """
+    params = transfer_params(from_phone, to_phone, amount)
+    for attempt in range(1, TRANSFER_ATTEMPTS + 1):
+        try:
+            row = db.execute(TRANSFER_SQL, params).one()
+            ok, result = transfer_outcome(row, from_phone, to_phone)
+            if not ok and result == "Insufficient balance":
+                # Consolidate in its own transaction: re-locking rows the failed
+                # attempt still holds would queue behind other payouts' tuple locks
+                db.rollback()
+                moved = db.execute(CONSOLIDATE_SHARDS_SQL, {"phone": from_phone}).scalar()
+                db.commit()
+                if moved:
+                    row = db.execute(TRANSFER_SQL, params).one()
+                    ok, result = transfer_outcome(row, from_phone, to_phone)
+            if ok:
+                db.commit()
+                balance_cache.invalidate(from_phone, to_phone)
+            else:
+                db.rollback()
+            return ok, result
+
+        except Exception as e:
+            db.rollback()
+            if attempt == TRANSFER_ATTEMPTS or not is_deadlock(e):
+                return False, str(e)
+            time.sleep(deadlock_backoff(attempt))
+
+
+class BatchItemResult(NamedTuple):
+    index: int
+    to_phone: str
+    amount: Decimal
+    transaction_id: Optional[uuid.UUID]
+    error: Optional[str]
+
+
+class BatchTransferResult(NamedTuple):
+    new_balance: Decimal
+    items: List[BatchItemResult]
+
+
+# Locks every user touched by a batch in phone-number order, the same order
+# TRANSFER_SQL uses, and returns their balances in the same round trip.
+BATCH_LOCK_USERS_SQL = text("""
+SELECT phone_number, balance FROM users
+WHERE phone_number = ANY(CAST(:phones AS varchar[]))
+ORDER BY phone_number
+FOR NO KEY UPDATE
+""")
+
+# Duplicate recipients are summed first: UPDATE ... FROM applies one row per target
+BATCH_CREDIT_SQL = text("""
+UPDATE users SET balance = users.balance + credits.amount
+FROM (
+    SELECT phone, sum(amount) AS amount
+    FROM unnest(CAST(:phones AS varchar[]), CAST(:amounts AS numeric[])) AS t(phone, amount)
+    GROUP BY phone
+) AS credits
+WHERE users.phone_number = credits.phone
+""")
+
+BATCH_DEBIT_SQL = text("UPDATE users SET balance = balance - CAST(:total AS numeric) WHERE phone_number = :from_phone")
+
+
+def _chunks(items: list, size: int):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _accept_batch(from_phone: str, transfers: List[Tuple[str, float]], amounts: List[Decimal], balance: Decimal, known_phones):
+    """Accept items in order while balance covers them.
+
+    Returns the balance left, a BatchItemResult per item and the
+    transactions rows of the accepted ones.
+    """
+    now = datetime.utcnow()
+    results = []
+    accepted = []
+    for index, ((to_phone, _), amount) in enumerate(zip(transfers, amounts)):
+        if to_phone == from_phone:
+            error = "Cannot send money to yourself"
+        elif to_phone not in known_phones:
+            error = "Recipient not found"
+        elif amount > balance:
+            error = "Insufficient balance"
+        else:
+            error = None
+            balance -= amount
+            accepted.append({
+                "id": uuid.uuid4(),
+                "from_phone": from_phone,
+                "to_phone": to_phone,
+                "amount": amount,
+                "transaction_type": models.TransactionType.TRANSFER,
+                "status": models.TransactionStatus.COMPLETED,
+                "created_at": now,
+            })
+        results.append(BatchItemResult(index, to_phone, amount, accepted[-1]["id"] if error is None else None, error))
+    return balance, results, accepted
+
+
+def batch_transfer_money(db: Session, from_phone: str, transfers: List[Tuple[str, float]], chunk_size: int = 1000):
+    """Pay many recipients from one sender inside a single DB transaction.
+
+    Items are validated against one locked lookup of all involved users and
+    accepted in order while the sender's balance covers them; the rest are
+    reported as failed. Credits and transactions rows are written in bulk
+    statements of at most `chunk_size` items.
+    """
+    amounts = [Decimal(str(amount)) for _, amount in transfers]
+    phones = sorted({from_phone, *(to_phone for to_phone, _ in transfers)})
+
     try:
-        # Start explicit transaction
-        sender = get_user_by_phone(db, from_phone)
-        receiver = get_user_by_phone(db, to_phone)
-        
-        if sender is None:
+        balances = {}
+        for chunk in _chunks(phones, chunk_size):
+            balances.update(db.execute(BATCH_LOCK_USERS_SQL, {"phones": chunk}).all())
+
+        if from_phone not in balances:
+            db.rollback()
             return False, "Sender not found"
-        if receiver is None:
-            return False, "Recipient not found"
-        if sender.balance < Decimal(str(amount)):
-            return False, "Insufficient balance"
+        # Recipients' shards can stay; the sender's are spent from users.balance
+        balances[from_phone] += db.execute(CONSOLIDATE_SHARDS_SQL, {"phone": from_phone}).scalar_one()
+
+        balance, results, accepted = _accept_batch(from_phone, transfers, amounts, balances[from_phone], balances)
+
+        for chunk in _chunks(accepted, chunk_size):
+            db.execute(BATCH_CREDIT_SQL, {
+                "phones": [row["to_phone"] for row in chunk],
+                "amounts": [row["amount"] for row in chunk],
+            })
+            db.execute(insert(models.Transaction), chunk)
+
+        if accepted:
+            db.execute(BATCH_DEBIT_SQL, {"total": sum(row["amount"] for row in accepted), "from_phone": from_phone})
 
-        # Update balances
-        sender.balance -= Decimal(str(amount))
-        receiver.balance += Decimal(str(amount))
-        
-        # Save changes
-        db.add(sender)
-        db.add(receiver)
-        db.flush()  # Flush to get updated balances
-        
-        # Create transaction record
-        tx = models.Transaction(
-            from_phone=from_phone, 
-            to_phone=to_phone, 
-            amount=Decimal(str(amount)), 
-            transaction_type=models.TransactionType.TRANSFER,
-            status=models.TransactionStatus.COMPLETED,
-            created_at=datetime.utcnow()
-        )
-        db.add(tx)
-        
-        # Commit all changes together
         db.commit()
-        db.refresh(tx)
-        return True, tx
-        
+        balance_cache.invalidate(from_phone, *{row["to_phone"] for row in accepted})
+        return True, BatchTransferResult(balance, results)
+
     except Exception as e:
         db.rollback()
         return False, str(e)
 
+# Locks the senders and unsharded recipients of a group commit in phone-number
+# order, like TRANSFER_SQL does for one pair, so groups cannot deadlock with
+# each other or with single transfers. Sharded recipients stay unlocked.
+GROUP_LOCK_USERS_SQL = text("""
+SELECT phone_number FROM users
+WHERE phone_number = ANY(CAST(:senders AS varchar[]))
+   OR (phone_number = ANY(CAST(:recipients AS varchar[])) AND credit_shards = 0)
+ORDER BY phone_number
+FOR NO KEY UPDATE
+""")
+
+
+def group_transfer_money(db: Session, transfers: List[Tuple[str, str, float]]) -> List[Tuple[bool, object]]:
+    """Apply independent transfers from many callers with a single COMMIT.
+
+    Each (from_phone, to_phone, amount) runs TRANSFER_SQL in turn, so a
+    transfer sees the ones before it. Unlike transfer_money, a sender whose
+    users.balance falls short never has its credit shards consolidated, so
+    (False, "Insufficient balance") is not final: the caller must retry those
+    items through transfer_money, as TransferPipeline._apply does. Every other
+    outcome is the one transfer_money would return. TRANSFER_SQL changes
+    nothing unless its transfer succeeds, so failed items need no savepoint.
+    If a statement raises, the whole group is rolled back and the error
+    re-raised.
+    """
+    try:
+        db.execute(GROUP_LOCK_USERS_SQL, {
+            "senders": sorted({from_phone for from_phone, _, _ in transfers}),
+            "recipients": sorted({to_phone for _, to_phone, _ in transfers}),
+        })
+        outcomes = []
+        for from_phone, to_phone, amount in transfers:
+            row = db.execute(TRANSFER_SQL, transfer_params(from_phone, to_phone, amount)).one()
+            outcomes.append(transfer_outcome(row, from_phone, to_phone))
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    balance_cache.invalidate(*{phone for (from_phone, to_phone, _), (ok, _) in zip(transfers, outcomes) if ok
+                               for phone in (from_phone, to_phone)})
+    return outcomes
+
 
 def create_equb_account(db: Session, phone_number: str, amount: float, duration_months: int):
     if amount < 500:
@@ -119,8 +449,9 @@ def create_equb_account(db: Session, phone_number: str, amount: float, duration_
     maturity_date = datetime.utcnow() + timedelta(seconds=30)  # 30 seconds for testing
     
     try:
-        user.balance -= Decimal(str(amount))
-        db.add(user)
+        if debit_user(db, phone_number, Decimal(str(amount))) is None:
+            db.rollback()
+            return False, "Insufficient balance"
         
         equb_account = models.EqubAccount(
             phone_number=phone_number,
@@ -143,6 +474,7 @@ def create_equb_account(db: Session, phone_number: str, amount: float, duration_
         db.add(tx)
         
         db.commit()
+        balance_cache.invalidate(phone_number)
         db.refresh(equb_account)
         return True, equb_account
     except Exception as e:
@@ -167,52 +499,425 @@ def withdraw_equb(db: Session, phone_number: str, equb_account_id: str):
     except ValueError:
         return False, "Invalid equb account ID"
     
+    # Locked so a concurrent withdrawal of the same equb waits, then no
+    # longer finds it active instead of paying it out a second time
     equb_account = db.query(models.EqubAccount).filter(
         models.EqubAccount.id == equb_uuid,
         models.EqubAccount.phone_number == phone_number,
         models.EqubAccount.is_active == True
-    ).first()
+    ).with_for_update().first()
     
     if not equb_account:
+        db.rollback()
         return False, "Equb account not found"
     
     if not equb_account.can_withdraw and equb_account.maturity_date > datetime.utcnow():
+        db.rollback()
         return False, "Equb account not mature for withdrawal"
     
     try:
         equb_account.can_withdraw = True
         equb_account.is_active = False
-        user.balance += equb_account.amount
+        new_balance = db.execute(CREDIT_USER_SQL, {"phone": phone_number, "amount": equb_account.amount}).scalar_one()
         
-        db.add(user)
         db.add(equb_account)
         
         tx = create_transaction(db, phone_number, phone_number, float(equb_account.amount), 'EQUB_WITHDRAWAL')
         
         db.commit()
-        return True, tx
+        balance_cache.invalidate(phone_number)
+        return True, TransferResult(tx.id, new_balance)
     except Exception as e:
         db.rollback()
         return False, str(e)
 
 
-def get_user_transactions(db: Session, phone_number: str):
-    return db.query(models.Transaction).filter(
-        (models.Transaction.from_phone == phone_number) | 
-        (models.Transaction.to_phone == phone_number)
-    ).order_by(models.Transaction.created_at.desc()).limit(50).all()
+TRANSACTION_PAGE_SIZE = 50
+MAX_TRANSACTION_PAGE_SIZE = 200
 
 
-def update_equb_maturity(db: Session):
-    equb_accounts = db.query(models.EqubAccount).filter(
-        models.EqubAccount.maturity_date <= datetime.utcnow(),
-        models.EqubAccount.can_withdraw == False,
-        models.EqubAccount.is_active == True
-    ).all()
-    
-    for account in equb_accounts:
-        account.can_withdraw = True
-        db.add(account)
-    
-    db.commit()
-    return len(equb_accounts)
+class TransactionPage(NamedTuple):
+    transactions: list
+    next_cursor: Optional[str]
+
+
+def encode_transaction_cursor(tx) -> str:
+    raw = f"{tx.created_at.isoformat()}|{tx.id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_transaction_cursor(cursor: str) -> Tuple[datetime, uuid.UUID]:
+    """Raises ValueError for anything encode_transaction_cursor did not produce"""
+    raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+    created_at, tx_id = raw.split("|")
+    return datetime.fromisoformat(created_at), uuid.UUID(tx_id)
+
+
+def _transaction_page_statement(after_cursor: bool):
+    """Newest-first page of a user's transactions, one row past :limit.
+
+    Sent and received rows are read as two separate scans of the
+    (from_phone, created_at, id) and (to_phone, created_at, id) indexes and
+    merged, instead of an OR that needs a bitmap scan plus a sort of every
+    matching row. The cursor is the (created_at, id) of the last row shown.
+    """
+    tx = models.Transaction
+    order = (tx.created_at.desc(), tx.id.desc())
+    phone = bindparam("phone")
+    sent = select(tx).where(tx.from_phone == phone)
+    # Rows sent to oneself (equb deposits/withdrawals) come from the first scan
+    # only; from_phone is NULL on the stored procedure's equb withdrawals
+    received = select(tx).where(tx.to_phone == phone, tx.from_phone.is_distinct_from(phone))
+    if after_cursor:
+        position = tuple_(bindparam("cursor_at", type_=DateTime), bindparam("cursor_id", type_=tx.id.type))
+        sent = sent.where(tuple_(tx.created_at, tx.id) < position)
+        received = received.where(tuple_(tx.created_at, tx.id) < position)
+    page = union_all(
+        sent.order_by(*order).limit(bindparam("limit")),
+        received.order_by(*order).limit(bindparam("limit"))
+    ).subquery()
+    row = aliased(tx, page)
+    return select(row).order_by(row.created_at.desc(), row.id.desc()).limit(bindparam("limit"))
+
+
+# Built once; constructing the ORM union costs more than running it
+_TRANSACTION_PAGE_STATEMENTS = {after: _transaction_page_statement(after) for after in (False, True)}
+
+
+def transaction_page_query(phone_number: str, cursor: Optional[str], limit: int):
+    """(statement, params) for a page of `limit` rows after `cursor`"""
+    params = {"phone": phone_number, "limit": limit + 1}
+    if cursor:
+        params["cursor_at"], params["cursor_id"] = decode_transaction_cursor(cursor)
+    return _TRANSACTION_PAGE_STATEMENTS[bool(cursor)], params
+
+
+def transaction_page(rows, limit: int) -> TransactionPage:
+    rows = list(rows)
+    if len(rows) > limit:
+        return TransactionPage(rows[:limit], encode_transaction_cursor(rows[limit - 1]))
+    return TransactionPage(rows, None)
+
+
+def get_user_transactions(db: Session, phone_number: str, cursor: Optional[str] = None, limit: int = TRANSACTION_PAGE_SIZE):
+    rows = db.execute(*transaction_page_query(phone_number, cursor, limit)).scalars().all()
+    return transaction_page(rows, limit)
+
+
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "1000"))
+
+
+def _transaction_export_statement():
+    """All of a user's transactions in [:start, :end), oldest first.
+
+    Same two-scan shape as the history pages, ascending, so Postgres merges
+    two index scans and can hand rows over before it has read them all.
+    Postgres renders every column as text in export order, so rows go
+    straight to the CSV/JSON writers without per-value conversion in Python.
+    """
+    tx = models.Transaction
+    columns = (tx.id, tx.from_phone, tx.to_phone, tx.amount, tx.transaction_type, tx.status, tx.created_at)
+    phone = bindparam("phone")
+    in_range = (tx.created_at >= bindparam("start"), tx.created_at < bindparam("end"))
+    order = (tx.created_at, tx.id)
+    sent = select(*columns).where(tx.from_phone == phone, *in_range).order_by(*order)
+    received = select(*columns).where(tx.to_phone == phone, tx.from_phone.is_distinct_from(phone), *in_range).order_by(*order)
+    rows = union_all(sent, received).subquery()
+    return select(
+        cast(rows.c.id, String).label("id"), rows.c.from_phone, rows.c.to_phone,
+        cast(rows.c.amount, String).label("amount"), cast(rows.c.transaction_type, String).label("transaction_type"),
+        cast(rows.c.status, String).label("status"),
+        func.to_char(rows.c.created_at, 'YYYY-MM-DD"T"HH24:MI:SS.US').label("created_at")
+    ).order_by(rows.c.created_at, rows.c.id)
+
+
+TRANSACTION_EXPORT_STATEMENT = _transaction_export_statement()
+
+
+def transaction_export_params(phone_number: str, start: Optional[datetime], end: Optional[datetime]) -> dict:
+    return {"phone": phone_number, "start": start or datetime.min, "end": end or datetime.max}
+
+
+def stream_user_transactions(conn, phone_number: str, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                             chunk_rows: int = EXPORT_CHUNK_ROWS):
+    """Yield lists of up to chunk_rows rows from a server-side cursor on conn"""
+    result = conn.execution_options(stream_results=True, yield_per=chunk_rows).execute(
+        TRANSACTION_EXPORT_STATEMENT, transaction_export_params(phone_number, start, end)
+    )
+    for chunk in result.partitions():
+        yield chunk
+
+
+def equb_withdrawable(account, now: Optional[datetime] = None) -> bool:
+    """Whether an equb can be withdrawn, without waiting for the scheduler to flip can_withdraw"""
+    return account.can_withdraw or account.maturity_date <= (now or datetime.utcnow())
+
+
+# One batch of the maturity scheduler (app/scheduler.py): the oldest matured
+# accounts first, read from the idx_equb_pending_maturity partial index
+MATURE_EQUB_BATCH_SQL = text("""
+    WITH due AS (
+        SELECT id FROM equb_accounts
+        WHERE can_withdraw = FALSE AND is_active = TRUE AND maturity_date <= :now
+        ORDER BY maturity_date
+        LIMIT :batch_size
+        FOR UPDATE SKIP LOCKED
+    )
+    UPDATE equb_accounts SET can_withdraw = TRUE
+    FROM due WHERE equb_accounts.id = due.id
+""")
+
+
+def update_equb_maturity(conn, batch_size: int, now: Optional[datetime] = None) -> int:
+    """Flip can_withdraw on up to batch_size matured accounts; returns how many"""
+    return conn.execute(MATURE_EQUB_BATCH_SQL, {"now": now or datetime.utcnow(), "batch_size": batch_size}).rowcount
+
+
+# DB-side execution mode (CRUD_MODE=db): each money-moving operation is one
+# call to the matching stored procedure in schema.sql. Results are mapped to
+# the same (ok, result) shapes as the Python implementations above.
+
+PROCEDURE_MESSAGES = {
+    "Equb not yet mature for withdrawal": "Equb account not mature for withdrawal",
+}
+
+
+def _procedure_result(raw):
+    # psycopg2 decodes JSONB itself, asyncpg hands back the JSON text
+    result = json.loads(raw) if isinstance(raw, str) else raw
+    if not result.get("success"):
+        message = result.get("message", "Unknown error")
+        return False, PROCEDURE_MESSAGES.get(message, message)
+    return True, result
+
+
+def map_transfer_procedure(raw):
+    ok, result = _procedure_result(raw)
+    if not ok:
+        return ok, result
+    return True, TransferResult(uuid.UUID(result["transaction_id"]), Decimal(str(result["new_balance"])))
+
+
+def map_equb_deposit_procedure(raw, phone_number: str):
+    ok, result = _procedure_result(raw)
+    if not ok:
+        return ok, result
+    # Transient instance, only used to build EqubAccountResponse
+    return True, models.EqubAccount(
+        id=uuid.UUID(result["equb_id"]),
+        phone_number=phone_number,
+        amount=Decimal(str(result["amount"])),
+        deposit_date=datetime.fromisoformat(result["deposit_date"]),
+        maturity_date=datetime.fromisoformat(result["maturity_date"]),
+        can_withdraw=False,
+        is_active=True
+    )
+
+
+def map_equb_withdrawal_procedure(raw):
+    ok, result = _procedure_result(raw)
+    if not ok:
+        return ok, result
+    return True, TransferResult(uuid.UUID(result["transaction_id"]), Decimal(str(result["new_balance"])))
+
+
+TRANSFER_PROCEDURE_SQL = text("SELECT process_money_transfer(:from_phone, :to_phone, CAST(:amount AS numeric))")
+EQUB_DEPOSIT_PROCEDURE_SQL = text("SELECT process_equb_deposit(:phone_number, CAST(:amount AS numeric), :duration_months)")
+EQUB_WITHDRAWAL_PROCEDURE_SQL = text("SELECT process_equb_withdrawal(:phone_number, CAST(:equb_account_id AS uuid))")
+
+
+def _call_procedure(db: Session, statement, params: dict):
+    try:
+        raw = db.execute(statement, params).scalar_one()
+        db.commit()
+        return raw
+    except Exception:
+        db.rollback()
+        raise
+
+
+def db_transfer_money(db: Session, from_phone: str, to_phone: str, amount: float):
+    try:
+        raw = _call_procedure(db, TRANSFER_PROCEDURE_SQL, {
+            "from_phone": from_phone, "to_phone": to_phone, "amount": Decimal(str(amount))
+        })
+    except Exception as e:
+        return False, str(e)
+    balance_cache.invalidate(from_phone, to_phone)
+    return map_transfer_procedure(raw)
+
+
+def db_create_equb_account(db: Session, phone_number: str, amount: float, duration_months: int):
+    try:
+        raw = _call_procedure(db, EQUB_DEPOSIT_PROCEDURE_SQL, {
+            "phone_number": phone_number, "amount": Decimal(str(amount)), "duration_months": duration_months
+        })
+    except Exception as e:
+        return False, str(e)
+    balance_cache.invalidate(phone_number)
+    return map_equb_deposit_procedure(raw, phone_number)
+
+
+def db_withdraw_equb(db: Session, phone_number: str, equb_account_id: str):
+    try:
+        equb_uuid = uuid.UUID(equb_account_id)
+    except ValueError:
+        return False, "Invalid equb account ID"
+
+    try:
+        raw = _call_procedure(db, EQUB_WITHDRAWAL_PROCEDURE_SQL, {
+            "phone_number": phone_number, "equb_account_id": str(equb_uuid)
+        })
+    except Exception as e:
+        return False, str(e)
+    balance_cache.invalidate(phone_number)
+    return map_equb_withdrawal_procedure(raw)
+
+
+# Ledger mode (CRUD_MODE=ledger): money moves by appending balanced entries
+# to ledger_entries through the ledger_* functions in schema.sql, which
+# return the same JSON as the process_* procedures. Balances are snapshot
+# plus later entries (ledger_balance); app/ledger.py compacts them.
+
+LEDGER_TRANSFER_SQL = text("SELECT ledger_transfer(:from_phone, :to_phone, CAST(:amount AS numeric))")
+LEDGER_EQUB_DEPOSIT_SQL = text("SELECT ledger_equb_deposit(:phone_number, CAST(:amount AS numeric), :duration_months)")
+LEDGER_EQUB_WITHDRAWAL_SQL = text("SELECT ledger_equb_withdrawal(:phone_number, CAST(:equb_account_id AS uuid))")
+
+# Debits of an account are serialized on its users row; FOR NO KEY UPDATE
+# leaves the FOR KEY SHARE locks of foreign keys (credits to it) unblocked
+LEDGER_LOCK_SENDER_SQL = text("SELECT 1 FROM users WHERE phone_number = :phone AND is_active = TRUE FOR NO KEY UPDATE")
+# A statement of its own after the lock, so it sees debits committed while waiting
+LEDGER_BALANCE_SQL = text("SELECT ledger_balance(:phone)")
+BATCH_EXISTING_USERS_SQL = text("SELECT phone_number FROM users WHERE phone_number = ANY(CAST(:phones AS varchar[]))")
+LEDGER_APPEND_SQL = text("""
+INSERT INTO ledger_entries (transaction_id, account, amount)
+SELECT * FROM unnest(CAST(CAST(:ids AS varchar[]) AS uuid[]), CAST(:accounts AS varchar[]), CAST(:amounts AS numeric[]))
+""")
+
+
+def ledger_transfer_money(db: Session, from_phone: str, to_phone: str, amount: float):
+    try:
+        raw = _call_procedure(db, LEDGER_TRANSFER_SQL, {
+            "from_phone": from_phone, "to_phone": to_phone, "amount": Decimal(str(amount))
+        })
+    except Exception as e:
+        return False, str(e)
+    balance_cache.invalidate(from_phone, to_phone)
+    return map_transfer_procedure(raw)
+
+
+def ledger_create_equb_account(db: Session, phone_number: str, amount: float, duration_months: int):
+    try:
+        raw = _call_procedure(db, LEDGER_EQUB_DEPOSIT_SQL, {
+            "phone_number": phone_number, "amount": Decimal(str(amount)), "duration_months": duration_months
+        })
+    except Exception as e:
+        return False, str(e)
+    balance_cache.invalidate(phone_number)
+    return map_equb_deposit_procedure(raw, phone_number)
+
+
+def ledger_withdraw_equb(db: Session, phone_number: str, equb_account_id: str):
+    try:
+        equb_uuid = uuid.UUID(equb_account_id)
+    except ValueError:
+        return False, "Invalid equb account ID"
+
+    try:
+        raw = _call_procedure(db, LEDGER_EQUB_WITHDRAWAL_SQL, {
+            "phone_number": phone_number, "equb_account_id": str(equb_uuid)
+        })
+    except Exception as e:
+        return False, str(e)
+    balance_cache.invalidate(phone_number)
+    return map_equb_withdrawal_procedure(raw)
+
+
+def ledger_batch_transfer_money(db: Session, from_phone: str, transfers: List[Tuple[str, float]], chunk_size: int = 1000):
+    """batch_transfer_money for ledger mode: only the sender is locked, recipients are credited by appending"""
+    amounts = [Decimal(str(amount)) for _, amount in transfers]
+    recipients = sorted({to_phone for to_phone, _ in transfers})
+
+    try:
+        if db.execute(LEDGER_LOCK_SENDER_SQL, {"phone": from_phone}).first() is None:
+            db.rollback()
+            return False, "Sender not found"
+        balance = db.execute(LEDGER_BALANCE_SQL, {"phone": from_phone}).scalar_one()
+        known_phones = set()
+        for chunk in _chunks(recipients, chunk_size):
+            known_phones.update(db.execute(BATCH_EXISTING_USERS_SQL, {"phones": chunk}).scalars())
+
+        balance, results, accepted = _accept_batch(from_phone, transfers, amounts, balance, known_phones)
+
+        for chunk in _chunks(accepted, chunk_size):
+            ids = [str(row["id"]) for row in chunk]
+            db.execute(LEDGER_APPEND_SQL, {
+                "ids": ids + ids,
+                "accounts": [from_phone] * len(chunk) + [row["to_phone"] for row in chunk],
+                "amounts": [-row["amount"] for row in chunk] + [row["amount"] for row in chunk],
+            })
+            db.execute(insert(models.Transaction), chunk)
+
+        db.commit()
+        balance_cache.invalidate(from_phone, *{row["to_phone"] for row in accepted})
+        return True, BatchTransferResult(balance, results)
+
+    except Exception as e:
+        db.rollback()
+        return False, str(e)
+
+
+# One pass of the ledger compactor (app/ledger.py). The window runs from the
+# newest horizon taken so far up to the xmin of this statement's snapshot:
+# every transaction below that xmin has finished, so no entry will appear
+# under the new horizon later. Each account with entries in the window gets
+# a new snapshot; entries under its current horizon are already in it.
+COMPACT_LEDGER_SQL = text("""
+WITH bounds AS (
+    SELECT COALESCE(max(horizon), 0) AS low, txid_snapshot_xmin(txid_current_snapshot()) AS high
+    FROM balance_snapshots
+), delta AS (
+    SELECT e.account, sum(e.amount) AS amount
+    FROM bounds b
+    JOIN ledger_entries e ON e.txid >= b.low AND e.txid < b.high
+    LEFT JOIN balance_snapshots s ON s.account = e.account
+    WHERE e.txid >= COALESCE(s.horizon, 0)
+    GROUP BY e.account
+)
+INSERT INTO balance_snapshots AS s (account, balance, horizon, taken_at)
+SELECT d.account, COALESCE(old.balance, 0) + d.amount, b.high, now()
+FROM delta d
+CROSS JOIN bounds b
+LEFT JOIN balance_snapshots old ON old.account = d.account
+ON CONFLICT (account) DO UPDATE
+SET balance = EXCLUDED.balance, horizon = EXCLUDED.horizon, taken_at = EXCLUDED.taken_at
+RETURNING account
+""")
+
+# users.balance is only a cache in ledger mode; its UPDATE fires the balance event
+REFRESH_USER_BALANCES_SQL = text("""
+UPDATE users SET balance = current.balance
+FROM (
+    SELECT account, ledger_balance(account) AS balance
+    FROM unnest(CAST(:accounts AS varchar[])) AS account
+) AS current
+WHERE users.phone_number = current.account AND users.balance IS DISTINCT FROM current.balance
+""")
+
+
+def compact_ledger(conn) -> List[str]:
+    """Roll finished entries into balance_snapshots; returns the accounts snapshotted"""
+    return list(conn.execute(COMPACT_LEDGER_SQL).scalars())
+
+
+def refresh_user_balances(conn, accounts: List[str]) -> int:
+    """Copy the ledger balance of accounts into users.balance; returns rows changed"""
+    return conn.execute(REFRESH_USER_BALANCES_SQL, {"accounts": accounts}).rowcount
+
+
+SET_LEDGER_MODE_SQL = text("SELECT set_ledger_mode(:enabled)")
+
+
+def set_ledger_mode(conn, enabled: bool) -> bool:
+    """Hand the balances to the ledger or back to users.balance; False if they already were there"""
+    return conn.execute(SET_LEDGER_MODE_SQL, {"enabled": enabled}).scalar()
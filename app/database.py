@@ -0,0 +1,176 @@
+import os
+import asyncio
+import logging
+import time
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.orm import sessionmaker
+from starlette.concurrency import run_in_threadpool
+from dotenv import load_dotenv
+from .pool import plan_pools, fixed_pool_settings, pool_status, MeteredQueuePool, MeteredAsyncQueuePool
+from .metrics import instrument_engine
+from .slow_queries import slow_query_log
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+DATABASE_URL = os.getenv("DATABASE_URL")
+
+if not DATABASE_URL:
+    raise ValueError("DATABASE_URL environment variable is required")
+
+# "sync" runs handlers in the threadpool on psycopg2, "async" runs them on the
+# event loop with asyncpg. Both paths share models and schemas.
+DB_MODE = os.getenv("DB_MODE", "sync").lower()
+
+if DB_MODE not in ("sync", "async"):
+    raise ValueError("DB_MODE must be 'sync' or 'async'")
+
+# "python" runs transfers and equb operations in the ORM, "db" makes one call
+# per operation to the stored procedures defined in schema.sql, "ledger" calls
+# the ledger_* functions there, which append double-entry rows instead of
+# updating balances (see app/ledger.py).
+CRUD_MODE = os.getenv("CRUD_MODE", "python").lower()
+
+if CRUD_MODE not in ("python", "db", "ledger"):
+    raise ValueError("CRUD_MODE must be 'python', 'db' or 'ledger'")
+
+IS_POSTGRES = DATABASE_URL.startswith(("postgresql", "postgres://"))
+DB_CONNECT_TIMEOUT = int(os.getenv("DB_CONNECT_TIMEOUT", "5"))
+
+# Each worker's share of DB_MAX_CONNECTIONS (app/pool.py) covers every
+# connection it opens. Exports hold a connection for the whole download, so
+# they stream from their own DB_EXPORT_POOL_SIZE connections and never starve
+# requests. In async mode the psycopg2 engine serves only background jobs, the
+# transfer pipeline and plan capture, and gets DB_SYNC_POOL_SIZE; in sync mode
+# those take from the request pool. The event hub's LISTEN connection and the
+# slow-query log's EXPLAIN connection are opened outside any pool.
+DB_EXPORT_POOL_SIZE = int(os.getenv("DB_EXPORT_POOL_SIZE", "2"))
+DB_SYNC_POOL_SIZE = int(os.getenv("DB_SYNC_POOL_SIZE", "2"))
+# Read here so the budget can count the listener (app/events.py)
+EVENTS_ENABLED = os.getenv("EVENTS_ENABLED", "true").lower() == "true"
+
+FIXED_POOLS = {"export": DB_EXPORT_POOL_SIZE}
+if DB_MODE == "async":
+    FIXED_POOLS["sync"] = DB_SYNC_POOL_SIZE
+POOL_PLAN = plan_pools(FIXED_POOLS, extra=int(EVENTS_ENABLED) + int(slow_query_log.explain_sample > 0))
+POOL_SETTINGS = POOL_PLAN.request
+
+if IS_POSTGRES and POOL_PLAN.connections > POOL_PLAN.share:
+    logger.error(
+        "Each worker may hold up to %d connections but its share of DB_MAX_CONNECTIONS is %d "
+        "(request pool %d+%d, fixed pools %s, listener/explain connections); raise DB_MAX_CONNECTIONS, "
+        "lower WEB_CONCURRENCY or DB_DEPLOY_OVERLAP, or set EVENTS_ENABLED=false / SLOW_QUERY_EXPLAIN_SAMPLE=0",
+        POOL_PLAN.connections, POOL_PLAN.share, POOL_SETTINGS["pool_size"], POOL_SETTINGS["max_overflow"], POOL_PLAN.fixed
+    )
+
+if IS_POSTGRES:
+    engine = create_engine(
+        DATABASE_URL,
+        poolclass=MeteredQueuePool,
+        connect_args={"connect_timeout": DB_CONNECT_TIMEOUT},
+        **(POOL_SETTINGS if DB_MODE == "sync" else fixed_pool_settings(POOL_PLAN.fixed["sync"]))
+    )
+else:
+    engine = create_engine(DATABASE_URL)
+
+instrument_engine(engine)
+slow_query_log.install(engine)
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# Streams /user/transactions/export in sync mode; not metered, so a long
+# download never shows up as request pool saturation
+export_engine = engine
+if IS_POSTGRES and DB_MODE == "sync":
+    export_engine = create_engine(
+        DATABASE_URL,
+        poolclass=QueuePool,
+        connect_args={"connect_timeout": DB_CONNECT_TIMEOUT},
+        **fixed_pool_settings(POOL_PLAN.fixed["export"])
+    )
+    instrument_engine(export_engine)
+
+
+def get_db():
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def get_async_database_url(url: str) -> str:
+    """Rewrite a psycopg2-style URL to use the asyncpg driver"""
+    for prefix in ("postgresql+psycopg2://", "postgresql://", "postgres://"):
+        if url.startswith(prefix):
+            return "postgresql+asyncpg://" + url[len(prefix):]
+    return url
+
+
+async_engine = None
+async_export_engine = None
+AsyncSessionLocal = None
+
+if DB_MODE == "async":
+    from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+    async_engine = create_async_engine(
+        get_async_database_url(DATABASE_URL),
+        poolclass=MeteredAsyncQueuePool,
+        connect_args={"timeout": DB_CONNECT_TIMEOUT},
+        **POOL_SETTINGS
+    )
+    instrument_engine(async_engine.sync_engine)
+    async_export_engine = create_async_engine(
+        get_async_database_url(DATABASE_URL),
+        connect_args={"timeout": DB_CONNECT_TIMEOUT},
+        **fixed_pool_settings(POOL_PLAN.fixed["export"])
+    )
+    instrument_engine(async_export_engine.sync_engine)
+    # Plans are still taken over psycopg2
+    slow_query_log.install(async_engine.sync_engine, explain_engine=engine)
+    # Attributes must stay loaded after commit: there is no lazy IO on AsyncSession
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+
+async def get_async_db():
+    if AsyncSessionLocal is None:
+        raise RuntimeError("Async database session requested but DB_MODE is not 'async'")
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+def _ping(timeout: float):
+    with engine.connect() as conn:
+        if IS_POSTGRES:
+            conn.execute(text(f"SET LOCAL statement_timeout = {int(timeout * 1000)}"))
+        conn.execute(text("SELECT 1"))
+
+
+async def _async_ping(timeout: float):
+    async with async_engine.connect() as conn:
+        await conn.execute(text(f"SET LOCAL statement_timeout = {int(timeout * 1000)}"))
+        await conn.execute(text("SELECT 1"))
+
+
+async def check_database(timeout: float) -> dict:
+    """Ping the active engine, giving up after `timeout` seconds"""
+    started = time.perf_counter()
+    try:
+        if async_engine is not None:
+            await asyncio.wait_for(_async_ping(timeout), timeout)
+        else:
+            await asyncio.wait_for(run_in_threadpool(_ping, timeout), timeout)
+        state = "connected"
+    except asyncio.TimeoutError:
+        state = "timeout"
+    except Exception:
+        state = "not_connected"
+
+    active_engine = async_engine.sync_engine if async_engine is not None else engine
+    return {
+        "database": state,
+        "latencyMs": round((time.perf_counter() - started) * 1000, 2),
+        "pool": pool_status(active_engine),
+    }
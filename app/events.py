@@ -0,0 +1,247 @@
+import asyncio
+import orjson
+import logging
+import os
+from collections import deque
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+from .database import IS_POSTGRES, DB_CONNECT_TIMEOUT, EVENTS_ENABLED, engine
+
+logger = logging.getLogger(__name__)
+
+# Seconds between keep-alive comments on every open stream
+EVENTS_HEARTBEAT = float(os.getenv("EVENTS_HEARTBEAT", "15"))
+# Frames buffered for a client that is not reading; past this it is sent a
+# resync event and disconnected
+EVENTS_QUEUE_SIZE = int(os.getenv("EVENTS_QUEUE_SIZE", "64"))
+EVENTS_MAX_CONNECTIONS = int(os.getenv("EVENTS_MAX_CONNECTIONS", "20000"))
+
+# Postgres channel the notify_* triggers in schema.sql publish on
+EVENTS_CHANNEL = "telebirr_events"
+
+PING_FRAME = ": ping\n\n"
+RESYNC_FRAME = "event: resync\ndata: {}\n\n"
+# First frame of every stream: how long EventSource waits before reconnecting
+OPEN_FRAME = "retry: 5000\n\n"
+
+
+class Subscriber:
+    """One open event stream: a bounded queue of ready-to-send SSE frames"""
+
+    __slots__ = ("phone_number", "frames", "balance", "wakeup", "closed")
+
+    def __init__(self, phone_number: str):
+        self.phone_number = phone_number
+        self.frames = deque()
+        self.balance = None  # only the latest balance frame is worth sending
+        self.wakeup = asyncio.Event()
+        self.closed = False
+
+    def push(self, frame: str, balance: bool = False) -> bool:
+        """Queue a frame; False if the client fell behind and is being dropped"""
+        if self.closed:
+            return False
+        if balance:
+            self.balance = frame
+        elif len(self.frames) >= EVENTS_QUEUE_SIZE:
+            # The client is not reading fast enough (the transport is
+            # backpressuring the stream). Drop what is queued and tell it to
+            # refetch its state instead of buffering without bound.
+            self.frames.clear()
+            self.frames.append(RESYNC_FRAME)
+            self.balance = None
+            self.closed = True
+        else:
+            self.frames.append(frame)
+        self.wakeup.set()
+        return not self.closed
+
+    def take(self) -> str:
+        """Everything queued, as one chunk"""
+        if self.balance is not None:
+            self.frames.append(self.balance)
+            self.balance = None
+        frames = "".join(self.frames)
+        self.frames.clear()
+        return frames
+
+
+class EventHub:
+    """Fans Postgres notifications out to this worker's open event streams.
+
+    Every worker holds one LISTEN connection outside the pool, read on the
+    event loop, so each committed balance change or transaction reaches
+    whichever worker holds the user's stream. Postgres only delivers a
+    NOTIFY once the writing transaction commits, and the triggers fire for
+    every write path (ORM, stored procedures, batch transfers).
+
+    Idle streams cost one Subscriber and no timers: a single heartbeat task
+    pings them all.
+    """
+
+    def __init__(self, heartbeat: float):
+        self.heartbeat = heartbeat
+        self._subscribers = {}  # phone number -> set of Subscriber
+        self._connections = 0
+        self._tasks = []
+        self._listening = False
+        self.counters = {"notifications": 0, "delivered": 0, "overflows": 0, "reconnects": 0, "errors": 0}
+
+    def subscribe(self, phone_number: str) -> Subscriber:
+        subscriber = Subscriber(phone_number)
+        self._subscribers.setdefault(phone_number, set()).add(subscriber)
+        self._connections += 1
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        subscribers = self._subscribers.get(subscriber.phone_number)
+        if subscribers is not None and subscriber in subscribers:
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self._subscribers[subscriber.phone_number]
+            self._connections -= 1
+
+    def publish(self, phone_numbers, frame: str, balance: bool = False):
+        for phone_number in phone_numbers:
+            for subscriber in self._subscribers.get(phone_number, ()):
+                if subscriber.push(frame, balance):
+                    self.counters["delivered"] += 1
+                else:
+                    self.counters["overflows"] += 1
+
+    def _broadcast(self, frame: str):
+        for subscribers in self._subscribers.values():
+            for subscriber in subscribers:
+                subscriber.push(frame)
+
+    def dispatch(self, payload: str):
+        """Route one notification from the notify_* triggers"""
+        self.counters["notifications"] += 1
+        if not self._subscribers:
+            return
+        event = orjson.loads(payload)
+        # The payload is already JSON; it is forwarded without re-encoding
+        frame = f"event: {event['event']}\ndata: {payload}\n\n"
+        if event["event"] == "balance":
+            self.publish((event["phoneNumber"],), frame, balance=True)
+        else:
+            self.publish({event["fromPhone"], event["toPhone"]} - {None}, frame)
+
+    def _connect(self):
+        cargs, cparams = engine.dialect.create_connect_args(engine.url)
+        cparams.setdefault("connect_timeout", DB_CONNECT_TIMEOUT)
+        conn = engine.dialect.dbapi.connect(*cargs, **cparams)
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            cursor.execute(f"LISTEN {EVENTS_CHANNEL}")
+        return conn
+
+    async def _listen(self):
+        loop = asyncio.get_running_loop()
+        backoff = 1.0
+        while True:
+            conn = None
+            try:
+                conn = await loop.run_in_executor(None, self._connect)
+                readable = asyncio.Event()
+                loop.add_reader(conn.fileno(), readable.set)
+                if self.counters["notifications"] or self.counters["errors"]:
+                    # Events may have been missed while disconnected
+                    self.counters["reconnects"] += 1
+                    self._broadcast(RESYNC_FRAME)
+                self._listening = True
+                backoff = 1.0
+                try:
+                    while True:
+                        try:
+                            await asyncio.wait_for(readable.wait(), self.heartbeat)
+                        except asyncio.TimeoutError:
+                            # A silently dropped connection never turns readable
+                            await loop.run_in_executor(None, self._ping, conn)
+                        readable.clear()
+                        conn.poll()
+                        while conn.notifies:
+                            self.dispatch(conn.notifies.pop(0).payload)
+                finally:
+                    self._listening = False
+                    loop.remove_reader(conn.fileno())
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.counters["errors"] += 1
+                logger.warning("Event listener connection failed, retrying in %.0fs: %s", backoff, e)
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 30.0)
+            finally:
+                if conn is not None:
+                    conn.close()
+
+    @staticmethod
+    def _ping(conn):
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT 1")
+
+    async def _ping_streams(self):
+        while True:
+            await asyncio.sleep(self.heartbeat)
+            self._broadcast(PING_FRAME)
+
+    def start(self):
+        """Call from the event loop (app startup)"""
+        if not self._tasks and IS_POSTGRES:
+            loop = asyncio.get_running_loop()
+            self._tasks = [loop.create_task(self._listen()), loop.create_task(self._ping_streams())]
+
+    def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        # Let open streams finish so shutdown does not wait on them
+        for subscribers in self._subscribers.values():
+            for subscriber in subscribers:
+                subscriber.closed = True
+                subscriber.wakeup.set()
+
+    @property
+    def available(self) -> bool:
+        return bool(self._tasks)
+
+    @property
+    def connections(self) -> int:
+        return self._connections
+
+    async def stream(self, phone_number: str):
+        # Subscribed once the response starts, so a stream that never starts holds nothing
+        subscriber = self.subscribe(phone_number)
+        try:
+            yield OPEN_FRAME
+            while True:
+                await subscriber.wakeup.wait()
+                subscriber.wakeup.clear()
+                frames = subscriber.take()
+                if frames:
+                    yield frames
+                if subscriber.closed:
+                    return
+        finally:
+            self.unsubscribe(subscriber)
+
+    def stats(self) -> dict:
+        return {**self.counters, "connections": self._connections, "listening": self._listening}
+
+
+event_hub = EventHub(EVENTS_HEARTBEAT)
+
+
+def event_stream_response(phone_number: str):
+    """text/event-stream of balance and transaction events for one user"""
+    if not event_hub.available:
+        raise HTTPException(status_code=503, detail="Event stream unavailable")
+    if event_hub.connections >= EVENTS_MAX_CONNECTIONS:
+        raise HTTPException(status_code=503, detail="Too many event streams", headers={"Retry-After": "5"})
+    return StreamingResponse(
+        event_hub.stream(phone_number),
+        media_type="text/event-stream",
+        # X-Accel-Buffering: keep nginx-style proxies from holding events back
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
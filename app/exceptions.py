@@ -1,9 +1,12 @@
+import logging
 from fastapi import HTTPException, Request
 from fastapi.responses import JSONResponse
 from fastapi.exceptions import RequestValidationError
 from starlette.exceptions import HTTPException as StarletteHTTPException
 from . import schemas
 
+logger = logging.getLogger(__name__)
+
 
 async def http_exception_handler(request: Request, exc: HTTPException):
     return JSONResponse(
@@ -12,7 +15,8 @@ async def http_exception_handler(request: Request, exc: HTTPException):
             success=False,
             message=exc.detail,
             error_code=get_error_code(exc.status_code)
-        ).dict()
+        ).dict(),
+        headers=getattr(exc, "headers", None)
     )
 
 
@@ -28,6 +32,9 @@ async def validation_exception_handler(request: Request, exc: RequestValidationE
 
 
 async def general_exception_handler(request: Request, exc: Exception):
+    # The client only gets a generic 500; the traceback goes to the log and
+    # telebirr_http_exceptions_total counts it by route and type
+    logger.error("Unhandled %s on %s %s", type(exc).__name__, request.method, request.url.path, exc_info=exc)
     return JSONResponse(
         status_code=500,
         content=schemas.ErrorResponse(
@@ -46,7 +53,9 @@ def get_error_code(status_code: int) -> str:
         404: "NOT_FOUND",
         409: "CONFLICT",
         422: "VALIDATION_ERROR",
-        500: "INTERNAL_ERROR"
+        429: "RATE_LIMITED",
+        500: "INTERNAL_ERROR",
+        503: "SERVICE_UNAVAILABLE"
     }
     return error_codes.get(status_code, "UNKNOWN_ERROR")
 
@@ -0,0 +1,88 @@
+import os
+import asyncio
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from fastapi import HTTPException, status
+from passlib.context import CryptContext
+from . import metrics
+from .pool import get_worker_count
+
+# bcrypt cost factor. Changing it makes needs_rehash() true for existing
+# hashes, and login rehashes them with the new cost.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# Processes doing bcrypt work per gunicorn worker; by default the workers split the CPUs
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(max(1, (os.cpu_count() or 1) // get_worker_count()))))
+# Requests allowed to wait for a hashing process before we answer 503
+PASSWORD_HASH_MAX_QUEUE = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", "32"))
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+
+def get_password_hash(password: str) -> str:
+    # Ensure password is within bcrypt 72-byte limit
+    if len(password.encode('utf-8')) > 72:
+        password = password[:72]
+    return pwd_context.hash(password)
+
+
+def verify_password(plain_password: str, hashed_password: str) -> bool:
+    return pwd_context.verify(plain_password, hashed_password)
+
+
+def needs_rehash(hashed_password: str) -> bool:
+    return pwd_context.needs_update(hashed_password)
+
+
+class PasswordHasher:
+    """Runs bcrypt in a process pool with a bounded number of waiting requests"""
+
+    def __init__(self, workers: int, max_queue: int):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.in_flight = 0
+        self.stats = {"hashes": 0, "verifications": 0, "seconds": 0.0, "rejected": 0}
+        self._executor = None
+
+    def _get_executor(self):
+        # Created on first use so each gunicorn worker gets its own processes.
+        # Spawned, not forked: by then the worker runs threads (threadpool, JWKS
+        # refresh, scheduler) and a child forked while one of them holds a lock
+        # can hang forever, and with it every login waiting on that process.
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._executor
+
+    async def _run(self, operation, fn, *args):
+        if self.in_flight >= self.workers + self.max_queue:
+            self.stats["rejected"] += 1
+            metrics.password_hash_rejected.inc()
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Authentication service busy, please retry"
+            )
+        self.in_flight += 1
+        started = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._get_executor(), fn, *args)
+        finally:
+            self.in_flight -= 1
+            elapsed = time.perf_counter() - started
+            self.stats["seconds"] += elapsed
+            metrics.password_hash_duration.observe(elapsed, operation)
+
+    async def hash(self, password: str) -> str:
+        self.stats["hashes"] += 1
+        return await self._run("hash", get_password_hash, password)
+
+    async def verify(self, password: str, hashed_password: str) -> bool:
+        self.stats["verifications"] += 1
+        return await self._run("verify", verify_password, password, hashed_password)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+password_hasher = PasswordHasher(PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_QUEUE)
@@ -0,0 +1,68 @@
+import logging
+import os
+from . import crud
+from .database import CRUD_MODE, engine
+from .periodic import AdvisoryLockedJob
+
+logger = logging.getLogger(__name__)
+
+# Seconds between compactions; reads stay exact in between, they just sum more entries
+LEDGER_COMPACT_INTERVAL = float(os.getenv("LEDGER_COMPACT_INTERVAL", "2"))
+# users rows refreshed per statement/commit, so senders never wait long on the refresh
+LEDGER_REFRESH_BATCH_SIZE = int(os.getenv("LEDGER_REFRESH_BATCH_SIZE", "500"))
+
+# pg_advisory_lock key shared by every worker and instance
+LEDGER_COMPACT_LOCK_KEY = 0x1ed6e7
+
+
+class LedgerCompactor(AdvisoryLockedJob):
+    """Background thread rolling ledger entries into balance snapshots.
+
+    Runs only with CRUD_MODE=ledger, one process per round (see
+    AdvisoryLockedJob). After each compaction users.balance is refreshed for
+    the accounts that moved, which is also when their balance events fire.
+    """
+
+    name = "ledger-compactor"
+    lock_key = LEDGER_COMPACT_LOCK_KEY
+
+    def __init__(self, interval: float, batch_size: int):
+        super().__init__(interval)
+        self.batch_size = batch_size
+        self.stats.update(compactions=0, accounts=0, refreshed=0)
+
+    def compact(self) -> int:
+        """Run one compaction if this process gets the lock; returns accounts snapshotted"""
+        return self.run_locked() or 0
+
+    def run(self, conn) -> int:
+        accounts = crud.compact_ledger(conn)
+        conn.commit()
+        accounts.sort()
+        refreshed = 0
+        for start in range(0, len(accounts), self.batch_size):
+            refreshed += crud.refresh_user_balances(conn, accounts[start:start + self.batch_size])
+            conn.commit()
+        self.stats["compactions"] += 1
+        self.stats["accounts"] += len(accounts)
+        self.stats["refreshed"] += refreshed
+        return len(accounts)
+
+
+def apply_ledger_mode():
+    """Hand the balances to the side CRUD_MODE reads, if the database has them on the other (set_ledger_mode in schema.sql)"""
+    enabled = CRUD_MODE == "ledger"
+    try:
+        with engine.begin() as conn:
+            switched = crud.set_ledger_mode(conn, enabled)
+    except Exception as e:
+        if enabled:
+            raise
+        # Databases that never had the ledger tables still run the other modes
+        logger.warning("Could not check the database's ledger mode: %s", e)
+        return
+    if switched:
+        logger.warning("Balances moved %s the ledger for CRUD_MODE=%s", "to" if enabled else "off", CRUD_MODE)
+
+
+ledger_compactor = LedgerCompactor(LEDGER_COMPACT_INTERVAL, LEDGER_REFRESH_BATCH_SIZE)
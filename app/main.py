@@ -1,42 +1,42 @@
+import hmac
 import os
-from fastapi import FastAPI, Depends, HTTPException, status, Query, Request
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, Session
+from fastapi import FastAPI, APIRouter, Depends, HTTPException, status, Query, Request
+from sqlalchemy.orm import Session
 from dotenv import load_dotenv
-from . import models, crud, schemas, auth, exceptions, rate_limiter
-from typing import Dict
+from . import models, crud, schemas, auth, exceptions, metrics, rate_limiter, responses, async_routes
+from .hashing import password_hasher, needs_rehash
+from .scheduler import equb_maturity_scheduler, EQUB_MATURITY_SCHEDULER
+from .ledger import ledger_compactor, apply_ledger_mode
+from .transfer_pipeline import transfer_pipeline, TRANSFER_PIPELINE
+from .cache import balance_cache
+from .slow_queries import slow_query_log
+from .events import event_hub, event_stream_response, EVENTS_ENABLED
+from .database import DB_MODE, CRUD_MODE, IS_POSTGRES, engine, export_engine, async_engine, async_export_engine, SessionLocal, get_db, check_database
+from typing import Dict, Optional
+from datetime import datetime
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 from fastapi.exceptions import RequestValidationError
 from starlette.exceptions import HTTPException as StarletteHTTPException
+from starlette.concurrency import run_in_threadpool
 
 load_dotenv()
 
 # Use environment variables with secure defaults
-DATABASE_URL = os.getenv("DATABASE_URL")
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secure-secret-key-change-in-production")
 
-if not DATABASE_URL:
-    raise ValueError("DATABASE_URL environment variable is required")
-
 if SECRET_KEY == "your-secure-secret-key-change-in-production":
     print("WARNING: Using default SECRET_KEY. Change in production!")
 
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-
-
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+HEALTH_DB_TIMEOUT = float(os.getenv("HEALTH_DB_TIMEOUT", "2"))
+BATCH_TRANSFER_CHUNK_SIZE = int(os.getenv("BATCH_TRANSFER_CHUNK_SIZE", "1000"))
+# Bearer token for the /admin endpoints; they are not served without one
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
 
 
 def get_current_user():
     def dependency(phone_number: str = Depends(auth.verify_token_only), db: Session = Depends(get_db)):
-        # Sync user from Nhost to local database if needed
+        # Sync user from Nhost to local database if needed; cached users cost no query
         user = auth.sync_user_with_nhost(phone_number, db)
         return user
     return dependency
@@ -51,6 +51,8 @@ app.add_middleware(
     allow_methods=["GET", "POST"],
     allow_headers=["Content-Type", "Authorization"],
 )
+# Outermost, so its timings include CORS handling
+app.add_middleware(metrics.MetricsMiddleware)
 
 # Exception handlers
 app.add_exception_handler(HTTPException, exceptions.http_exception_handler)
@@ -60,9 +62,34 @@ app.add_exception_handler(Exception, exceptions.general_exception_handler)
 
 @app.on_event("startup")
 def on_startup():
+    metrics.registry.start()
     # Skip automatic table creation for production
     # Tables should be created manually using schema.sql
-    pass
+    # Load Nhost signing keys now so the first authenticated request does not wait on the network
+    auth.jwks_store.start(prewarm=os.getenv("JWKS_PREWARM", "true").lower() == "true")
+    if IS_POSTGRES:
+        apply_ledger_mode()
+    if EQUB_MATURITY_SCHEDULER:
+        equb_maturity_scheduler.start()
+    if CRUD_MODE == "ledger":
+        ledger_compactor.start()
+    if TRANSFER_PIPELINE:
+        transfer_pipeline.start()
+    if EVENTS_ENABLED:
+        event_hub.start()
+
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    password_hasher.shutdown()
+    auth.jwks_store.stop()
+    equb_maturity_scheduler.stop()
+    ledger_compactor.stop()
+    transfer_pipeline.stop()
+    event_hub.stop()
+    if async_engine is not None:
+        await async_engine.dispose()
+        await async_export_engine.dispose()
 
 
 @app.get("/")
@@ -70,48 +97,101 @@ def root():
     return {"message": "TeleBirr API is running", "status": "healthy"}
 
 @app.get("/health")
-def health_check():
-    return {"status": "healthy", "database": "not_connected"}
+async def health_check():
+    result = await check_database(HEALTH_DB_TIMEOUT)
+    healthy = result["database"] == "connected"
+    return JSONResponse(
+        status_code=200 if healthy else 503,
+        content={
+            "status": "healthy" if healthy else "unhealthy", "dbMode": DB_MODE, "crudMode": CRUD_MODE, **result,
+            "balanceCache": balance_cache.stats(), "events": event_hub.stats(),
+            "transferPipeline": transfer_pipeline.stats()
+        }
+    )
+
+
+if metrics.METRICS_ENABLED:
+    @app.get("/metrics", include_in_schema=False)
+    def metrics_endpoint(request: Request):
+        # Adds up every gunicorn worker on this host (METRICS_BACKEND=shared)
+        if not metrics.authorized(request.headers.get("Authorization")):
+            raise HTTPException(status_code=401, detail="Invalid metrics token")
+        return Response(metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
+
+
+if ADMIN_TOKEN:
+    def require_admin(request: Request):
+        if not hmac.compare_digest(request.headers.get("Authorization") or "", f"Bearer {ADMIN_TOKEN}"):
+            raise HTTPException(status_code=401, detail="Invalid admin token")
+
+    @app.get("/admin/slow-queries", include_in_schema=False, dependencies=[Depends(require_admin)])
+    def slow_queries_endpoint(limit: int = Query(50, ge=1, le=1000)):
+        # Ring buffer of the worker that answers; SLOW_QUERY_LOG has every worker's entries
+        return responses.json_response({"success": True, **slow_query_log.snapshot(limit)})
+
+    @app.put("/admin/users/{phoneNumber}/credit-shards", include_in_schema=False, dependencies=[Depends(require_admin)])
+    def credit_shards_endpoint(phoneNumber: str, shards: int = Query(..., ge=0, le=crud.MAX_CREDIT_SHARDS)):
+        # Hot merchant accounts: spread incoming credits over this many rows, 0 folds them back
+        db = SessionLocal()
+        try:
+            found = crud.set_credit_shards(db, phoneNumber, shards)
+        finally:
+            db.close()
+        if not found:
+            raise HTTPException(status_code=404, detail="User not found")
+        return responses.json_response({"success": True, "phoneNumber": phoneNumber, "creditShards": shards})
+
+
+# Sync endpoints; replaced by async_routes.router when DB_MODE=async
+router = APIRouter()
+
+if CRUD_MODE == "db":
+    transfer_money, create_equb_account, withdraw_equb = crud.db_transfer_money, crud.db_create_equb_account, crud.db_withdraw_equb
+elif CRUD_MODE == "ledger":
+    transfer_money, create_equb_account, withdraw_equb = crud.ledger_transfer_money, crud.ledger_create_equb_account, crud.ledger_withdraw_equb
+else:
+    transfer_money, create_equb_account, withdraw_equb = crud.transfer_money, crud.create_equb_account, crud.withdraw_equb
+    if TRANSFER_PIPELINE:
+        # send-money waits for its group commit; the transfer itself is the same TRANSFER_SQL
+        transfer_money = transfer_pipeline.transfer
+# Batches are bulk statements in python and db mode alike; the ledger appends entries instead
+batch_transfer_money = crud.ledger_batch_transfer_money if CRUD_MODE == "ledger" else crud.batch_transfer_money
 
 
 # Authentication endpoints
-@app.post("/auth/signup", response_model=schemas.AuthResponse)
-def signup(payload: schemas.SignupRequest, db=Depends(get_db)):
+# bcrypt runs in hashing.password_hasher's process pool; these handlers are
+# async so a login burst waits there instead of holding threadpool threads.
+@router.post("/auth/signup", response_model=schemas.AuthResponse, dependencies=[Depends(rate_limiter.auth_rate_limit)])
+async def signup(payload: schemas.SignupRequest, db=Depends(get_db)):
     # Check if user already exists
-    existing_user = crud.get_user_by_phone(db, payload.phoneNumber)
+    existing_user = await run_in_threadpool(crud.get_user_by_phone, db, payload.phoneNumber)
     if existing_user:
         raise HTTPException(status_code=409, detail="Phone number already registered")
     
+    hashed = await password_hasher.hash(payload.password)
     # Create user with initial balance of 1000 Birr for testing
-    user = crud.create_user(db, payload.phoneNumber, payload.username, payload.password, 1000.0)
+    user = await run_in_threadpool(crud.create_user_with_hash, db, payload.phoneNumber, payload.username, hashed, 1000.0)
     if not user:
         raise HTTPException(status_code=500, detail="Failed to create user")
     
-    return {
-        "success": True,
-        "message": "Account created successfully",
-        "phoneNumber": user.phone_number,
-        "username": user.username,
-        "balance": f"{user.balance:.2f}"
-    }
-
-@app.post("/auth/login", response_model=schemas.AuthResponse)
-def login(payload: schemas.LoginRequest, db=Depends(get_db)):
+    return responses.json_response(responses.auth_response("Account created successfully", user))
+
+@router.post("/auth/login", response_model=schemas.AuthResponse, dependencies=[Depends(rate_limiter.auth_rate_limit)])
+async def login(payload: schemas.LoginRequest, db=Depends(get_db)):
     # Verify user credentials
-    user = crud.authenticate_user(db, payload.phoneNumber, payload.password)
-    if not user:
+    user = await run_in_threadpool(crud.get_user_by_phone, db, payload.phoneNumber)
+    if not user or not await password_hasher.verify(payload.password, user.password_hash):
         raise HTTPException(status_code=401, detail="Invalid phone number or password")
     
-    return {
-        "success": True,
-        "message": "Login successful",
-        "phoneNumber": user.phone_number,
-        "username": user.username,
-        "balance": f"{user.balance:.2f}"
-    }
+    # Upgrade hashes made with a different BCRYPT_ROUNDS while we have the password
+    if needs_rehash(user.password_hash):
+        hashed = await password_hasher.hash(payload.password)
+        user = await run_in_threadpool(crud.update_password_hash, db, user, hashed)
+    
+    return responses.json_response(responses.auth_response("Login successful", user))
 
 
-@app.post("/transactions/send-money", response_model=schemas.TransactionResponse)
+@router.post("/transactions/send-money", response_model=schemas.TransactionResponse, dependencies=[Depends(rate_limiter.transaction_rate_limit)])
 def send_money(payload: schemas.SendMoneyRequest, db=Depends(get_db)):
     # Use sender phone from payload
     sender_phone = payload.senderPhone
@@ -119,7 +199,7 @@ def send_money(payload: schemas.SendMoneyRequest, db=Depends(get_db)):
     if sender_phone == payload.recipientPhone:
         raise HTTPException(status_code=400, detail="Cannot send money to yourself")
     
-    ok, result = crud.transfer_money(db, sender_phone, payload.recipientPhone, float(payload.amount))
+    ok, result = transfer_money(db, sender_phone, payload.recipientPhone, float(payload.amount))
     if not ok:
         if "Insufficient balance" in result:
             raise HTTPException(status_code=400, detail="Insufficient balance")
@@ -128,20 +208,25 @@ def send_money(payload: schemas.SendMoneyRequest, db=Depends(get_db)):
         else:
             raise HTTPException(status_code=500, detail=result)
     
-    # Get updated sender balance after transaction
-    updated_sender = crud.get_user_by_phone(db, sender_phone)
+    # transfer_money returns the sender's balance as of the debit
+    return responses.json_response(responses.transaction_response("Money sent successfully", result))
+
+
+@router.post("/transactions/batch-send", response_model=schemas.BatchTransferResponse, dependencies=[Depends(rate_limiter.transaction_rate_limit)])
+def batch_send_money(payload: schemas.BatchTransferRequest, db=Depends(get_db)):
+    transfers = [(item.recipientPhone, float(item.amount)) for item in payload.transfers]
+    ok, result = batch_transfer_money(db, payload.senderPhone, transfers, BATCH_TRANSFER_CHUNK_SIZE)
+    if not ok:
+        if "not found" in result:
+            raise HTTPException(status_code=404, detail="Sender not found")
+        raise HTTPException(status_code=500, detail=result)
     
-    return {
-        "success": True,
-        "message": "Money sent successfully",
-        "transactionId": str(result.id),
-        "newBalance": f"{updated_sender.balance:.2f}"
-    }
+    return responses.json_response(responses.batch_transfer_response(result))
 
 
-@app.post("/equb/deposit", response_model=schemas.EqubDepositResponse)
+@router.post("/equb/deposit", response_model=schemas.EqubDepositResponse, dependencies=[Depends(rate_limiter.transaction_rate_limit)])
 def equb_deposit(payload: schemas.EqubDepositRequest, db=Depends(get_db)):
-    ok, result = crud.create_equb_account(db, payload.phoneNumber, float(payload.amount), payload.durationMonths)
+    ok, result = create_equb_account(db, payload.phoneNumber, float(payload.amount), payload.durationMonths)
     if not ok:
         if "Minimum deposit" in result:
             raise HTTPException(status_code=400, detail="Minimum deposit is 500 Birr")
@@ -152,24 +237,12 @@ def equb_deposit(payload: schemas.EqubDepositRequest, db=Depends(get_db)):
         else:
             raise HTTPException(status_code=500, detail=result)
     
-    return {
-        "success": True,
-        "message": "Equb deposit successful",
-        "equbAccount": {
-            "id": str(result.id),
-            "phoneNumber": result.phone_number,
-            "amount": f"{result.amount:.2f}",
-            "depositDate": result.deposit_date.isoformat(),
-            "maturityDate": result.maturity_date.isoformat(),
-            "canWithdraw": result.can_withdraw,
-            "isActive": result.is_active
-        }
-    }
+    return responses.json_response(responses.equb_deposit_response(result))
 
 
-@app.post("/equb/withdraw", response_model=schemas.EqubWithdrawResponse)
+@router.post("/equb/withdraw", response_model=schemas.EqubWithdrawResponse, dependencies=[Depends(rate_limiter.transaction_rate_limit)])
 def equb_withdraw(payload: schemas.EqubWithdrawRequest, db=Depends(get_db)):
-    ok, result = crud.withdraw_equb(db, payload.phoneNumber, payload.equbAccountId)
+    ok, result = withdraw_equb(db, payload.phoneNumber, payload.equbAccountId)
     if not ok:
         if "not found" in result:
             raise HTTPException(status_code=404, detail="Equb account not found")
@@ -180,79 +253,85 @@ def equb_withdraw(payload: schemas.EqubWithdrawRequest, db=Depends(get_db)):
         else:
             raise HTTPException(status_code=500, detail=result)
     
-    user = crud.get_user_by_phone(db, payload.phoneNumber)
-    return {
-        "success": True,
-        "message": "Equb withdrawal successful",
-        "transactionId": str(result.id),
-        "newBalance": f"{user.balance:.2f}"
-    }
+    return responses.json_response(responses.transaction_response("Equb withdrawal successful", result))
+
 
+@router.get("/user/transactions")
+def get_transaction_history(request: Request, phoneNumber: str = Query(...), cursor: Optional[str] = Query(None),
+                            limit: int = Query(crud.TRANSACTION_PAGE_SIZE, ge=1, le=crud.MAX_TRANSACTION_PAGE_SIZE), db=Depends(get_db)):
+    # History only changes through writes that bump the user's version, so a
+    # poller holding the current tag is answered before any query; versions
+    # expire after BALANCE_CACHE_TTL, bounding what writes on other hosts miss
+    tag = responses.etag(balance_cache.version(phoneNumber))
+    if responses.etag_matches(request, tag):
+        return responses.not_modified(tag)
 
-@app.get("/user/transactions")
-def get_transaction_history(phoneNumber: str = Query(...), db=Depends(get_db)):
     user = crud.get_user_by_phone(db, phoneNumber)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
-    
-    transactions = crud.get_user_transactions(db, phoneNumber)
-    
-    transaction_responses = []
-    for tx in transactions:
-        transaction_responses.append({
-            "id": str(tx.id),
-            "fromPhone": tx.from_phone,
-            "toPhone": tx.to_phone,
-            "amount": f"{tx.amount:.2f}",
-            "transactionType": tx.transaction_type.value,
-            "status": tx.status.value,
-            "createdAt": tx.created_at.isoformat()
-        })
-    
-    return {
-        "success": True,
-        "transactions": transaction_responses
-    }
 
+    try:
+        page = crud.get_user_transactions(db, phoneNumber, cursor, limit)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
 
-@app.get("/user/check-phone")
-def check_phone_number(phoneNumber: str = Query(...), db=Depends(get_db)):
-    user = crud.get_user_by_phone(db, phoneNumber)
-    if not user:
-        raise HTTPException(status_code=404, detail="Phone number not found")
-    
-    return {
-        "success": True,
-        "phoneNumber": user.phone_number,
-        "username": user.username
-    }
+    return responses.json_response(responses.transaction_history_response(page), headers=responses.validator_headers(tag))
 
 
-@app.get("/user/balance", response_model=schemas.BalanceResponse)
-def get_balance(phoneNumber: str = Query(...), db=Depends(get_db)):
+@router.get("/user/transactions/export")
+def export_transactions(phoneNumber: str = Query(...), start: Optional[datetime] = Query(None), end: Optional[datetime] = Query(None),
+                        fmt: str = Query("csv", alias="format", pattern="^(csv|ndjson)$"), db=Depends(get_db)):
     user = crud.get_user_by_phone(db, phoneNumber)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
-    
-    # Update equb maturity status before returning
-    crud.update_equb_maturity(db)
-    
-    equb_accounts = crud.get_equb_accounts(db, phoneNumber)
-    
-    equb_account_responses = []
-    for account in equb_accounts:
-        equb_account_responses.append({
-            "id": str(account.id),
-            "phoneNumber": account.phone_number,
-            "amount": f"{account.amount:.2f}",
-            "depositDate": account.deposit_date.isoformat(),
-            "maturityDate": account.maturity_date.isoformat(),
-            "canWithdraw": account.can_withdraw,
-            "isActive": account.is_active
-        })
-    
-    return {
-        "success": True,
-        "balance": f"{user.balance:.2f}",
-        "equbAccounts": equb_account_responses
-    }
+    if start and end and start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    db.close()  # release its connection; the export takes its own for as long as it streams
+
+    # Runs chunk by chunk in the threadpool while the response is sent; the
+    # export pool's connection is held for the export and returned when it
+    # ends or the client leaves
+    def body():
+        yield responses.export_header(fmt)
+        with export_engine.connect() as conn:
+            for rows in crud.stream_user_transactions(conn, phoneNumber, start, end):
+                yield responses.export_chunk(rows, fmt)
+
+    return responses.transaction_export_response(body(), fmt, phoneNumber)
+
+
+@router.get("/user/check-phone")
+def check_phone_number(phoneNumber: str = Query(...), db=Depends(get_db)):
+    def load():
+        user = crud.get_user_by_phone(db, phoneNumber)
+        if not user:
+            raise HTTPException(status_code=404, detail="Phone number not found")
+        return responses.snapshot(responses.check_phone_response(user))
+
+    return responses.json_body(balance_cache.read_through(phoneNumber, "check-phone", load).body)
+
+
+@router.get("/user/events")
+async def user_events(phoneNumber: str = Query(...)):
+    # Server-sent balance and transaction events; see events.EventHub
+    return event_stream_response(phoneNumber)
+
+
+@router.get("/user/balance", response_model=schemas.BalanceResponse)
+def get_balance(request: Request, phoneNumber: str = Query(...), db=Depends(get_db)):
+    # Cache hits are answered without touching the database, with a 304 if the
+    # client's If-None-Match is current; every write in crud.py invalidates
+    # the users it changed
+    def load():
+        user = crud.get_user_by_phone(db, phoneNumber)
+        if not user:
+            raise HTTPException(status_code=404, detail="User not found")
+
+        # canWithdraw is derived from maturity_date; the maturity scheduler keeps the stored flag in step
+        equb_accounts = crud.get_equb_accounts(db, phoneNumber)
+        return responses.balance_snapshot(user, equb_accounts)
+
+    return responses.conditional_json(request, balance_cache.read_through(phoneNumber, "balance", load))
+
+
+app.include_router(async_routes.router if DB_MODE == "async" else router)
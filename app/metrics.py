@@ -0,0 +1,422 @@
+import bisect
+import glob
+import hmac
+import logging
+import os
+import struct
+import threading
+import time
+from contextvars import ContextVar
+from sqlalchemy import event
+from .shm import SharedTable, default_path, fcntl
+
+logger = logging.getLogger(__name__)
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+# If set, GET /metrics requires "Authorization: Bearer <METRICS_TOKEN>"
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+# Series kept per worker; new series past this are dropped with a warning
+METRICS_SLOTS = int(os.getenv("METRICS_SLOTS", "4096"))
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1, 5)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+POOL_WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10)
+PASSWORD_HASH_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+SLOT = struct.Struct("d248s")  # value, series ('name{label="value",...}', utf-8, NUL padded)
+VALUE = struct.Struct("d")
+
+
+def _rows(data: bytes):
+    """(series, value) of a table, in the order the series were created"""
+    for value, series in SLOT.iter_unpack(data[:len(data) - len(data) % SLOT.size]):
+        if not series[0]:
+            break
+        yield series.rstrip(b"\0").decode(), value
+
+
+class MetricStore:
+    """Series of one process in a fixed table, each in the next free slot.
+
+    Only the owning process writes its table, so updates take a thread lock
+    and no file lock. Series keep their slot, so the table reads back in
+    creation order (histogram buckets stay together).
+    """
+
+    def __init__(self, buffer, slots: int, rows=()):
+        self.buffer = buffer  # bytearray, or a SharedTable's mapping
+        self.slots = slots
+        self._offsets = {series: index * SLOT.size for index, (series, _) in enumerate(rows)}
+        self._lock = threading.Lock()
+        self._full = False
+
+    def add(self, series: str, amount: float):
+        with self._lock:
+            self._add(series, amount)
+
+    def add_many(self, updates):
+        with self._lock:
+            for series, amount in updates:
+                self._add(series, amount)
+
+    def _add(self, series: str, amount: float):
+        offset = self._offsets.get(series)
+        if offset is None:
+            offset = self._allocate(series)
+            if offset is None:
+                return
+        VALUE.pack_into(self.buffer, offset, VALUE.unpack_from(self.buffer, offset)[0] + amount)
+
+    def _allocate(self, series: str):
+        index = len(self._offsets)
+        if index >= self.slots:
+            if not self._full:
+                self._full = True
+                logger.warning("Metrics table full (%d series), dropping %s", self.slots, series)
+            return None
+        offset = index * SLOT.size
+        SLOT.pack_into(self.buffer, offset, 0.0, series.encode())
+        self._offsets[series] = offset
+        return offset
+
+    def rows(self):
+        return list(_rows(bytes(self.buffer)))
+
+
+class MemoryBackend:
+    """Series of this worker only; /metrics answers for the worker it hits"""
+
+    def __init__(self, slots: int):
+        self.slots = slots
+        self._store = None
+        self._pid = None
+
+    def store(self) -> MetricStore:
+        if self._pid != os.getpid():  # a fork (gunicorn --preload) starts from zero
+            self._store, self._pid = MetricStore(bytearray(self.slots * SLOT.size), self.slots), os.getpid()
+        return self._store
+
+    def collect(self):
+        return [self.store().rows()]
+
+
+class SharedBackend:
+    """One table file per worker in `directory`; /metrics adds up all of them.
+
+    When a worker starts it folds the counters and histograms of workers
+    that have exited (gunicorn --max-requests restarts them) into
+    retired.db and deletes their files, so totals never go backwards and the
+    file count stays bounded. Gauges of exited workers are dropped.
+    """
+
+    def __init__(self, directory: str, slots: int):
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        self.directory = directory
+        self.slots = slots
+        self._store = None
+        self._retired = None
+        self._pid = None
+
+    def _path(self, pid: int) -> str:
+        return os.path.join(self.directory, f"worker-{pid}.db")
+
+    def store(self) -> MetricStore:
+        pid = os.getpid()
+        if self._pid != pid:
+            self._retired = SharedTable(self._retired_path(), SLOT, self.slots * 2)
+            with self._retired.locked():
+                self._retire_exited(pid)
+            self._store = MetricStore(SharedTable(self._path(pid), SLOT, self.slots).buffer, self.slots)
+            self._pid = pid
+        return self._store
+
+    def _retire_exited(self, pid: int):
+        retired = MetricStore(self._retired.buffer, self.slots * 2, self._read(self._retired_path()))
+        for path in glob.glob(os.path.join(self.directory, "worker-*.db")):
+            owner = int(path.rsplit("-", 1)[1][:-3])
+            # Our own pid's file is left over from an earlier process that had it
+            if owner != pid and _alive(owner):
+                continue
+            retired.add_many((series, value) for series, value in self._read(path)
+                             if not isinstance(FAMILIES.get(_family_name(series)), Gauge))
+            os.unlink(path)
+
+    def _retired_path(self) -> str:
+        return os.path.join(self.directory, "retired.db")
+
+    @staticmethod
+    def _read(path: str):
+        try:
+            with open(path, "rb") as f:
+                return list(_rows(f.read()))
+        except FileNotFoundError:
+            return []
+
+    def collect(self):
+        self.store()
+        with self._retired.locked():
+            return [self._read(path) for path in [self._retired_path()] + glob.glob(os.path.join(self.directory, "worker-*.db"))]
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _family_name(series: str) -> str:
+    name = series.split("{", 1)[0]
+    for suffix in ("_bucket", "_sum", "_count"):
+        if name.endswith(suffix) and name[:-len(suffix)] in FAMILIES:
+            return name[:-len(suffix)]
+    return name
+
+
+def _labels(names, values) -> str:
+    return ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _series(name: str, labels: str) -> str:
+    return f"{name}{{{labels}}}" if labels else name
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if value != float("inf") else "+Inf"
+
+
+class Family:
+    kind = None
+
+    def __init__(self, name: str, help: str, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._series = {}
+        FAMILIES[name] = self
+
+    def render(self, samples):
+        return [f"{series} {_number(value)}" for series, value in samples]
+
+
+class Counter(Family):
+    kind = "counter"
+
+    def inc(self, *label_values, amount: float = 1):
+        if registry.enabled:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = _series(self.name, _labels(self.labels, label_values))
+            registry.backend.store().add(series, amount)
+
+
+class Gauge(Counter):
+    """Summed over workers, like a counter, but dropped when a worker exits"""
+    kind = "gauge"
+
+
+class Histogram(Family):
+    """Buckets are stored per bucket and made cumulative when rendered"""
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(float(bucket) for bucket in buckets) + (float("inf"),)
+
+    def _names(self, labels: str):
+        """(bucket series, sum series, count series) for a rendered label set"""
+        prefix = labels + "," if labels else ""
+        buckets = [f'{self.name}_bucket{{{prefix}le="{_number(bucket)}"}}' for bucket in self.buckets]
+        return buckets, _series(self.name + "_sum", labels), _series(self.name + "_count", labels)
+
+    def observe(self, value: float, *label_values):
+        if registry.enabled:
+            names = self._series.get(label_values)
+            if names is None:
+                names = self._series[label_values] = self._names(_labels(self.labels, label_values))
+            buckets, sum_series, count_series = names
+            registry.backend.store().add_many(
+                ((buckets[bisect.bisect_left(self.buckets, value)], 1), (sum_series, value), (count_series, 1)))
+
+    def render(self, samples):
+        values = dict(samples)
+        lines = []
+        for series, _ in samples:
+            if not series.startswith(self.name + "_count"):
+                continue
+            labels = series[len(self.name) + 7:-1] if "{" in series else ""
+            buckets, sum_series, count_series = self._names(labels)
+            cumulative = 0.0
+            for bucket in buckets:
+                cumulative += values.get(bucket, 0.0)
+                lines.append(f"{bucket} {_number(cumulative)}")
+            lines.append(f"{sum_series} {_number(values.get(sum_series, 0.0))}")
+            lines.append(f"{count_series} {_number(values[count_series])}")
+        return lines
+
+
+FAMILIES = {}
+
+
+class Registry:
+    """Records nothing until start(), so scripts importing the app's modules
+    (benchmarks, the scheduler run by hand) leave no worker files behind"""
+
+    def __init__(self):
+        self.enabled = False
+        self.backend = None
+
+    def start(self):
+        self.enabled = METRICS_ENABLED
+
+    def configure(self):
+        backend = os.getenv("METRICS_BACKEND", "shared").lower()
+        if backend == "shared" and fcntl is not None:
+            directory = os.getenv("METRICS_DIR", default_path("telebirr-metrics"))
+            self.backend = SharedBackend(directory, METRICS_SLOTS)
+        else:
+            self.backend = MemoryBackend(METRICS_SLOTS)
+
+    def render(self) -> str:
+        totals = {}
+        for rows in self.backend.collect():
+            for series, value in rows:
+                totals[series] = totals.get(series, 0.0) + value
+        grouped = {}
+        for series, value in totals.items():
+            grouped.setdefault(_family_name(series), []).append((series, value))
+        lines = []
+        for name, family in FAMILIES.items():
+            samples = grouped.get(name)
+            if samples:
+                lines.append(f"# HELP {name} {family.help}")
+                lines.append(f"# TYPE {name} {family.kind}")
+                lines.extend(family.render(samples))
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+http_requests = Counter("telebirr_http_requests_total", "HTTP requests by route and status", ("method", "route", "status"))
+http_duration = Histogram("telebirr_http_request_duration_seconds", "Time until the response starts", ("method", "route"))
+http_in_progress = Gauge("telebirr_http_requests_in_progress", "Requests being handled, including open event streams")
+http_exceptions = Counter("telebirr_http_exceptions_total", "Unhandled exceptions answered with a 500", ("route", "exception"))
+db_queries = Counter("telebirr_db_queries_total", "SQL statements executed", ("route",))
+db_query_seconds = Counter("telebirr_db_query_seconds_total", "Time spent in SQL statements", ("route",))
+db_query_duration = Histogram("telebirr_db_query_duration_seconds", "Duration of each SQL statement", buckets=QUERY_BUCKETS)
+db_queries_per_request = Histogram("telebirr_db_queries_per_request", "SQL statements per request", ("route",), QUERY_COUNT_BUCKETS)
+db_pool_wait = Histogram("telebirr_db_pool_wait_seconds", "Wait for a pooled connection at checkout", buckets=POOL_WAIT_BUCKETS)
+db_pool_saturated = Counter("telebirr_db_pool_saturated_checkouts_total", "Checkouts that found no idle connection")
+db_pool_timeouts = Counter("telebirr_db_pool_timeouts_total", "Checkouts that gave up after DB_POOL_TIMEOUT")
+password_hash_duration = Histogram("telebirr_password_hash_seconds", "bcrypt work including the wait for a hashing process",
+                                   ("operation",), PASSWORD_HASH_BUCKETS)
+password_hash_rejected = Counter("telebirr_password_hash_rejected_total", "Password checks answered 503 because the queue was full")
+
+registry.configure()
+
+
+def authorized(authorization: str) -> bool:
+    return not METRICS_TOKEN or hmac.compare_digest(authorization or "", f"Bearer {METRICS_TOKEN}")
+
+
+# Statement counts for the request being handled. Handlers in the threadpool
+# run in a copy of the request's context, so they update the same object.
+class RequestMetrics:
+    __slots__ = ("queries", "db_seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+
+
+_current_request: ContextVar = ContextVar("request_metrics", default=None)
+
+
+def instrument_engine(engine):
+    """Time every statement on engine (the sync_engine of an async engine)"""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context.metrics_started = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, "metrics_started", None)
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started
+        db_query_duration.observe(elapsed)
+        request = _current_request.get()
+        if request is not None:
+            request.queries += 1
+            request.db_seconds += elapsed
+        else:  # scheduler, event listener and other work outside a request
+            db_queries.inc("background")
+            db_query_seconds.inc("background", amount=elapsed)
+
+
+class MetricsMiddleware:
+    """Per-route request count, latency, SQL statements and DB time.
+
+    Latency runs until the response starts, so streamed exports and event
+    streams count their time to first byte. Routes are labelled with their
+    path template; anything that matched no route is "unmatched".
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._routes = {}
+
+    def _route(self, scope) -> str:
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        route = self._routes.get(endpoint)
+        if route is None:
+            self._routes = {r.endpoint: r.path for r in scope["app"].routes if hasattr(r, "endpoint")}
+            route = self._routes.get(endpoint, "unmatched")
+        return route
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not registry.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        response = {"status": 500, "elapsed": None}
+        request = RequestMetrics()
+        token = _current_request.set(request)
+
+        async def send_timed(message):
+            if message["type"] == "http.response.start":
+                response["status"], response["elapsed"] = message["status"], time.perf_counter() - started
+            await send(message)
+
+        http_in_progress.inc()
+        try:
+            await self.app(scope, receive, send_timed)
+        except Exception as exc:
+            http_exceptions.inc(self._route(scope), type(exc).__name__)
+            raise
+        finally:
+            http_in_progress.inc(amount=-1)
+            _current_request.reset(token)
+            route, method = self._route(scope), scope["method"]
+            elapsed = response["elapsed"] if response["elapsed"] is not None else time.perf_counter() - started
+            http_requests.inc(method, route, response["status"])
+            http_duration.observe(elapsed, method, route)
+            db_queries_per_request.observe(request.queries, route)
+            if request.queries:
+                db_queries.inc(route, amount=request.queries)
+                db_query_seconds.inc(route, amount=request.db_seconds)
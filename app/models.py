@@ -48,8 +48,8 @@ class Transaction(Base):
     from_phone = Column(String(15), ForeignKey("users.phone_number"))
     to_phone = Column(String(15), ForeignKey("users.phone_number"))
     amount = Column(DECIMAL(15,2), nullable=False)
-    transaction_type = Column(Enum(TransactionType), nullable=False)
-    status = Column(Enum(TransactionStatus), default=TransactionStatus.PENDING)
+    transaction_type = Column(Enum(TransactionType, name="transaction_type"), nullable=False)
+    status = Column(Enum(TransactionStatus, name="transaction_status"), default=TransactionStatus.PENDING)
     description = Column(String)
     reference_id = Column(String(50))
     equb_account_id = Column(PostgresUUID(as_uuid=True), ForeignKey("equb_accounts.id"))
@@ -0,0 +1,70 @@
+import logging
+import threading
+from sqlalchemy import text
+from .database import engine
+
+logger = logging.getLogger(__name__)
+
+ADVISORY_LOCK_SQL = text("SELECT pg_try_advisory_lock(:key)")
+ADVISORY_UNLOCK_SQL = text("SELECT pg_advisory_unlock(:key)")
+
+
+class AdvisoryLockedJob:
+    """Background thread running a job every `interval` seconds, in one process at a time.
+
+    Every worker runs one, but each round first takes a Postgres advisory
+    lock on `lock_key`, so only one process in the deployment runs the job
+    at a time and the others skip that round. The lock is session-level on
+    the round's own connection, so a crashed leader releases it with its
+    connection. Subclasses set `name` and `lock_key` and implement run().
+    """
+
+    name = "periodic-job"
+    lock_key = None
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.stats = {"skipped": 0, "errors": 0}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def run(self, conn):
+        """One round of the job on `conn`, which holds the lock; commits its own work"""
+        raise NotImplementedError
+
+    def run_locked(self):
+        """Run one round if this process gets the lock; returns run()'s result, None if skipped"""
+        with engine.connect() as conn:
+            if not conn.execute(ADVISORY_LOCK_SQL, {"key": self.lock_key}).scalar():
+                conn.rollback()
+                self.stats["skipped"] += 1
+                return None
+            conn.commit()
+            try:
+                return self.run(conn)
+            finally:
+                try:
+                    conn.rollback()
+                    conn.execute(ADVISORY_UNLOCK_SQL, {"key": self.lock_key})
+                    conn.commit()
+                except Exception:
+                    conn.invalidate()  # closing the session releases the lock too
+                    raise
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_locked()
+            except Exception as e:
+                self.stats["errors"] += 1
+                logger.warning("%s failed: %s", self.name, e)
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread = None
@@ -0,0 +1,157 @@
+import os
+import math
+import threading
+import time
+from typing import NamedTuple
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from . import metrics
+
+
+def _env_int(name: str, default: int) -> int:
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+def get_worker_count() -> int:
+    """Number of gunicorn workers sharing this host's connection budget"""
+    return max(1, _env_int("WEB_CONCURRENCY", 1))
+
+
+def _common_settings() -> dict:
+    return {
+        "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", "10")),
+        "pool_recycle": _env_int("DB_POOL_RECYCLE", 1800),
+        "pool_pre_ping": os.getenv("DB_POOL_PRE_PING", "true").lower() == "true",
+    }
+
+
+def worker_share(workers: int = None) -> int:
+    """Connections one worker may hold.
+
+    DB_MAX_CONNECTIONS is the number of Postgres connections this deployment may
+    hold in total. DB_DEPLOY_OVERLAP reserves room for old and new instances to
+    run side by side during a deploy.
+    """
+    workers = workers or get_worker_count()
+    budget = _env_int("DB_MAX_CONNECTIONS", 20)
+    overlap = max(1, _env_int("DB_DEPLOY_OVERLAP", 2))
+    return max(1, budget // (workers * overlap))
+
+
+class PoolPlan(NamedTuple):
+    request: dict     # engine settings of the request pool
+    fixed: dict       # size of each fixed pool
+    connections: int  # most connections the worker can hold
+    share: int        # what it may hold
+
+
+def plan_pools(fixed_pools: dict, extra: int, workers: int = None) -> PoolPlan:
+    """Split one worker's share between its request pool, fixed pools and extra connections.
+
+    `fixed_pools` maps each fixed-size pool to the size it asks for; `extra`
+    counts connections opened outside any pool. The request pool keeps at
+    least one connection and the fixed pools shrink in proportion, to no
+    less than one each, to fit the rest. DB_POOL_SIZE / DB_MAX_OVERFLOW
+    override the request pool. If the minimum still exceeds the share,
+    `connections` says by how much.
+    """
+    share = worker_share(workers)
+    room = share - extra - 1
+    wanted = sum(fixed_pools.values())
+    fixed = dict(fixed_pools)
+    if wanted > room:
+        fixed = {name: max(1, size * room // wanted) for name, size in fixed_pools.items()}
+
+    per_worker = max(1, share - extra - sum(fixed.values()))
+    pool_size = _env_int("DB_POOL_SIZE", max(1, math.ceil(per_worker * 0.75)))
+    max_overflow = _env_int("DB_MAX_OVERFLOW", max(0, per_worker - pool_size))
+
+    request = {"pool_size": pool_size, "max_overflow": max_overflow, **_common_settings()}
+    return PoolPlan(request, fixed, pool_size + max_overflow + sum(fixed.values()) + extra, share)
+
+
+def fixed_pool_settings(size: int) -> dict:
+    """A pool of at most `size` connections, for engines outside the request path"""
+    return {"pool_size": max(1, size), "max_overflow": 0, **_common_settings()}
+
+
+class PoolMetrics:
+    """Checkout wait time and saturation counters for one worker's pool"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self.saturated_checkouts = 0
+        self.timeouts = 0
+
+    def record_checkout(self, waited: float, saturated: bool):
+        metrics.db_pool_wait.observe(waited)
+        if saturated:
+            metrics.db_pool_saturated.inc()
+        with self._lock:
+            self.checkouts += 1
+            self.wait_seconds_total += waited
+            self.wait_seconds_max = max(self.wait_seconds_max, waited)
+            if saturated:
+                self.saturated_checkouts += 1
+
+    def record_timeout(self, waited: float):
+        metrics.db_pool_wait.observe(waited)
+        metrics.db_pool_timeouts.inc()
+        with self._lock:
+            self.timeouts += 1
+            self.wait_seconds_total += waited
+            self.wait_seconds_max = max(self.wait_seconds_max, waited)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "waitSecondsTotal": round(self.wait_seconds_total, 6),
+                "waitSecondsMax": round(self.wait_seconds_max, 6),
+                "saturatedCheckouts": self.saturated_checkouts,
+                "timeouts": self.timeouts,
+            }
+
+
+pool_metrics = PoolMetrics()
+
+
+class _MeteredPoolMixin:
+    """Times every checkout; a checkout is saturated if no idle connection was left"""
+
+    def _do_get(self):
+        saturated = self.checkedin() == 0 and self.overflow() >= self._max_overflow
+        started = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except PoolTimeoutError:
+            pool_metrics.record_timeout(time.perf_counter() - started)
+            raise
+        pool_metrics.record_checkout(time.perf_counter() - started, saturated)
+        return conn
+
+
+class MeteredQueuePool(_MeteredPoolMixin, QueuePool):
+    pass
+
+
+class MeteredAsyncQueuePool(_MeteredPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+def pool_status(engine) -> dict:
+    pool = engine.pool
+    if not isinstance(pool, QueuePool):
+        return {"class": type(pool).__name__}
+    return {
+        "size": pool.size(),
+        "checkedIn": pool.checkedin(),
+        "checkedOut": pool.checkedout(),
+        "overflow": pool.overflow(),
+        "maxOverflow": pool._max_overflow,
+        **pool_metrics.snapshot(),
+    }
@@ -1,34 +1,192 @@
 from fastapi import Request, HTTPException
-from collections import defaultdict
+from collections import OrderedDict
+import ipaddress
+import logging
+import os
+import struct
+import threading
 import time
+from .shm import SharedTable, default_path, fcntl, key_hash64
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryBackend:
+    """Token buckets for this process only; least recently used keys are evicted"""
+
+    def __init__(self, max_keys: int = 100000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key: str, capacity: float, rate: float, now: float):
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return allowed, 0.0 if allowed else (1 - tokens) / rate
+
+
+class SharedMemoryBackend:
+    """Token buckets in a memory-mapped file shared by every worker on the host.
+
+    The file is a fixed table of `slots` buckets (24 bytes each), so memory
+    stays constant however many clients show up. A key lives in one of
+    `probe` consecutive slots after its hash. A new key reuses an empty or
+    idle slot (bucket full again), or else evicts the least recently used
+    slot in its probe range.
+    """
+
+    SLOT = struct.Struct("Qdd")  # key hash, tokens, last update (wall clock)
+
+    def __init__(self, path: str, slots: int = 65536, probe: int = 8):
+        self.table = SharedTable(path, self.SLOT, slots)
+        self.slots = slots
+        self.probe = probe
+
+    def take(self, key: str, capacity: float, rate: float, now: float):
+        key_hash = key_hash64(key)
+        start = key_hash % self.slots
+        with self.table.locked():
+            slot, tokens, updated = None, capacity, now
+            idle_slot, oldest_slot, oldest_updated = None, None, None
+            for i in range(self.probe):
+                index = (start + i) % self.slots
+                slot_hash, slot_tokens, slot_updated = self.table.read(index)
+                if slot_hash == key_hash:
+                    slot, tokens, updated = index, slot_tokens, slot_updated
+                    break
+                if idle_slot is None and (slot_hash == 0 or slot_tokens + (now - slot_updated) * rate >= capacity):
+                    idle_slot = index
+                if oldest_updated is None or slot_updated < oldest_updated:
+                    oldest_slot, oldest_updated = index, slot_updated
+            if slot is None:
+                slot = idle_slot if idle_slot is not None else oldest_slot
+
+            tokens = min(capacity, tokens + max(0.0, now - updated) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self.table.write(slot, key_hash, tokens, now)
+        return allowed, 0.0 if allowed else (1 - tokens) / rate
+
+
+def default_backend():
+    backend = os.getenv("RATE_LIMIT_BACKEND", "shared").lower()
+    if backend == "shared" and fcntl is not None:
+        path = os.getenv("RATE_LIMIT_SHM_PATH", default_path("telebirr-ratelimit"))
+        return SharedMemoryBackend(path, slots=int(os.getenv("RATE_LIMIT_SLOTS", "65536")))
+    return MemoryBackend()
+
+
+def parse_networks(value: str):
+    """'10.0.0.0/8, 127.0.0.1' -> the networks; single addresses are /32 or /128"""
+    return tuple(ipaddress.ip_network(part.strip(), strict=False) for part in value.split(",") if part.strip())
+
+
+def client_address(peer: str, forwarded_for: str, trusted_proxies) -> str:
+    """The client a request came from, as far as trusted proxies can vouch.
+
+    A peer that is not a trusted proxy is the client, whatever it sends in
+    X-Forwarded-For. Otherwise hops are read right to left, each appended by
+    the proxy before it, and the first one that is not itself a trusted
+    proxy is the client. Entries further left are whatever the client chose
+    to send and are ignored.
+    """
+    if not trusted_proxies or not _is_trusted(peer, trusted_proxies):
+        return peer
+    hop = peer
+    for hop in reversed([part.strip() for part in forwarded_for.split(",") if part.strip()]):
+        if not _is_trusted(hop, trusted_proxies):
+            return hop
+    return hop
+
+
+def _is_trusted(address: str, trusted_proxies) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in trusted_proxies)
+
+
+def parse_limit(value: str):
+    """'5/300' -> (5, 300): 5 requests per 300 seconds"""
+    max_requests, window_seconds = value.split("/")
+    return int(max_requests), int(window_seconds)
+
 
 class RateLimiter:
-    def __init__(self, max_requests: int = 10, window_seconds: int = 60):
+    """Token bucket of `max_requests` refilled evenly over `window_seconds`.
+
+    Each key costs O(1) state and time per request. Limits hold across
+    gunicorn workers when the backend is shared.
+    """
+
+    def __init__(self, max_requests: int = 10, window_seconds: int = 60, name: str = "default", backend=None):
         self.max_requests = max_requests
         self.window_seconds = window_seconds
-        self.requests = defaultdict(list)
-    
+        self.name = name
+        self.backend = backend or MemoryBackend()
+        self.rate = max_requests / window_seconds
+        self.retry_after = 0.0
+
     def is_allowed(self, client_ip: str) -> bool:
-        now = time.time()
-        # Clean old requests
-        self.requests[client_ip] = [
-            req_time for req_time in self.requests[client_ip]
-            if now - req_time < self.window_seconds
-        ]
-        
-        # Check if limit exceeded
-        if len(self.requests[client_ip]) >= self.max_requests:
-            return False
-        
-        # Add current request
-        self.requests[client_ip].append(now)
-        return True
+        allowed, self.retry_after = self.hit(client_ip)
+        return allowed
+
+    def hit(self, client_ip: str):
+        """Consume one request for client_ip; returns (allowed, retry_after_seconds)"""
+        return self.backend.take(f"{self.name}:{client_ip}", self.max_requests, self.rate, time.time())
+
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+# Proxies (addresses or CIDRs) whose X-Forwarded-For is believed; with none,
+# clients are keyed by the address that connected
+RATE_LIMIT_TRUSTED_PROXIES = parse_networks(os.getenv("RATE_LIMIT_TRUSTED_PROXIES", ""))
+_backend = default_backend()
+
+if RATE_LIMIT_ENABLED and not RATE_LIMIT_TRUSTED_PROXIES:
+    # Fails closed: forwarded clients share the proxy's bucket instead of choosing their own key
+    logger.warning("RATE_LIMIT_TRUSTED_PROXIES is empty, so clients are keyed by the connecting address; "
+                   "behind a load balancer (e.g. Koyeb's) every client shares its bucket until its "
+                   "addresses are listed there")
+_untrusted_forward_logged = False
 
 # Global rate limiter instances
-auth_limiter = RateLimiter(max_requests=5, window_seconds=300)  # 5 attempts per 5 minutes
-transaction_limiter = RateLimiter(max_requests=20, window_seconds=60)  # 20 transactions per minute
+auth_limiter = RateLimiter(*parse_limit(os.getenv("AUTH_RATE_LIMIT", "5/300")), name="auth", backend=_backend)  # 5 attempts per 5 minutes
+transaction_limiter = RateLimiter(*parse_limit(os.getenv("TRANSACTION_RATE_LIMIT", "20/60")), name="transaction", backend=_backend)  # 20 transactions per minute
 
 def check_rate_limit(request: Request, limiter: RateLimiter):
-    client_ip = request.client.host
-    if not limiter.is_allowed(client_ip):
-        raise HTTPException(status_code=429, detail="Rate limit exceeded")
\ No newline at end of file
+    global _untrusted_forward_logged
+    peer = request.client.host if request.client else ""
+    if not RATE_LIMIT_TRUSTED_PROXIES and not _untrusted_forward_logged and "x-forwarded-for" in request.headers:
+        _untrusted_forward_logged = True
+        logger.warning("Rate limiting forwarded requests by their proxy %s; add its range to RATE_LIMIT_TRUSTED_PROXIES "
+                       "if it is the deployment's load balancer", peer)
+    client_ip = client_address(peer, request.headers.get("x-forwarded-for", ""), RATE_LIMIT_TRUSTED_PROXIES)
+    allowed, retry_after = limiter.hit(client_ip)
+    if not allowed:
+        raise HTTPException(
+            status_code=429,
+            detail="Rate limit exceeded",
+            headers={"Retry-After": str(max(1, int(retry_after + 0.999)))}
+        )
+
+def rate_limit(limiter: RateLimiter):
+    """Route dependency applying `limiter` to the client IP"""
+    # Sync, so FastAPI runs it in the threadpool: the shared backend's flock never blocks the event loop
+    def dependency(request: Request):
+        if RATE_LIMIT_ENABLED:
+            check_rate_limit(request, limiter)
+    return dependency
+
+
+# Route dependencies: dependencies=[Depends(rate_limiter.auth_rate_limit)]
+auth_rate_limit = rate_limit(auth_limiter)
+transaction_rate_limit = rate_limit(transaction_limiter)
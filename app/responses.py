@@ -0,0 +1,216 @@
+# Response builders shared by the sync (main.py) and async (async_routes.py) endpoints.
+#
+# Builders return plain dicts that json_response() encodes with orjson in one
+# pass. Handlers return that Response, so FastAPI does not validate the dict
+# against response_model again or run it through jsonable_encoder; the
+# response_model stays on the route for the OpenAPI schema. orjson writes
+# UUIDs, enums and naive datetimes (same text as .isoformat()) itself, so
+# builders pass those through; money() is the one formatting step left.
+import csv
+import io
+import orjson
+import uuid
+from datetime import datetime, timezone
+from fastapi.responses import Response, StreamingResponse
+from .crud import equb_withdrawable
+
+
+def money(amount) -> str:
+    return f"{amount:.2f}"
+
+
+def _encode_default(value):
+    # orjson only recognises uuid.UUID itself, not asyncpg's subclass
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+def json_bytes(content) -> bytes:
+    return orjson.dumps(content, default=_encode_default)
+
+
+def json_response(content, status_code: int = 200, headers=None):
+    return Response(json_bytes(content), status_code=status_code, media_type="application/json", headers=headers)
+
+
+def auth_response(message: str, user):
+    return {
+        "success": True,
+        "message": message,
+        "phoneNumber": user.phone_number,
+        "username": user.username,
+        "balance": money(user.balance)
+    }
+
+
+def transaction_response(message: str, result):
+    # result.new_balance is the caller's balance right after the write
+    return {
+        "success": True,
+        "message": message,
+        "transactionId": result.id,
+        "newBalance": money(result.new_balance)
+    }
+
+
+def equb_account_response(account, now=None):
+    return {
+        "id": account.id,
+        "phoneNumber": account.phone_number,
+        "amount": money(account.amount),
+        "depositDate": account.deposit_date,
+        "maturityDate": account.maturity_date,
+        "canWithdraw": equb_withdrawable(account, now),
+        "isActive": account.is_active
+    }
+
+
+def equb_deposit_response(account):
+    return {
+        "success": True,
+        "message": "Equb deposit successful",
+        "equbAccount": equb_account_response(account)
+    }
+
+
+def batch_transfer_response(result):
+    item_responses = []
+    for item in result.items:
+        item_responses.append({
+            "index": item.index,
+            "recipientPhone": item.to_phone,
+            "amount": money(item.amount),
+            "status": "FAILED" if item.error else "COMPLETED",
+            "transactionId": item.transaction_id,
+            "error": item.error
+        })
+
+    failed = sum(1 for item in result.items if item.error)
+    return {
+        "success": failed == 0,
+        "message": "Batch processed",
+        "completed": len(result.items) - failed,
+        "failed": failed,
+        "newBalance": money(result.new_balance),
+        "results": item_responses
+    }
+
+
+def transaction_history_response(page):
+    transaction_responses = []
+    for tx in page.transactions:
+        transaction_responses.append({
+            "id": tx.id,
+            "fromPhone": tx.from_phone,
+            "toPhone": tx.to_phone,
+            "amount": money(tx.amount),
+            "transactionType": tx.transaction_type,
+            "status": tx.status,
+            "createdAt": tx.created_at
+        })
+
+    return {
+        "success": True,
+        "transactions": transaction_responses,
+        "nextCursor": page.next_cursor
+    }
+
+
+EXPORT_FIELDS = ["id", "fromPhone", "toPhone", "amount", "transactionType", "status", "createdAt"]
+EXPORT_MEDIA_TYPES = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+
+def export_header(fmt: str) -> str:
+    return ",".join(EXPORT_FIELDS) + "\r\n" if fmt == "csv" else ""
+
+
+def export_chunk(rows, fmt: str) -> str:
+    # Rows from crud.TRANSACTION_EXPORT_STATEMENT: all text, in EXPORT_FIELDS order
+    if fmt == "csv":
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        return buffer.getvalue()
+    return b"".join(orjson.dumps(dict(zip(EXPORT_FIELDS, row)), option=orjson.OPT_APPEND_NEWLINE) for row in rows).decode()
+
+
+def transaction_export_response(body, fmt: str, phone_number: str):
+    """Stream `body` (an iterator of export_header/export_chunk strings) as a download"""
+    return StreamingResponse(
+        body,
+        media_type=EXPORT_MEDIA_TYPES[fmt],
+        headers={"Content-Disposition": f'attachment; filename="transactions-{phone_number}.{fmt}"'}
+    )
+
+
+def balance_response(user, equb_accounts):
+    now = datetime.utcnow()
+    return {
+        "success": True,
+        "balance": money(user.balance),
+        "equbAccounts": [equb_account_response(account, now) for account in equb_accounts]
+    }
+
+
+def balance_snapshot(user, equb_accounts):
+    """balance_response() as a cache snapshot, valid until the next pending equb matures"""
+    now = datetime.utcnow()
+    pending = [account.maturity_date for account in equb_accounts if not equb_withdrawable(account, now)]
+    valid_until = min(pending).replace(tzinfo=timezone.utc).timestamp() if pending else None
+    return snapshot(balance_response(user, equb_accounts), valid_until)
+
+
+def check_phone_response(user):
+    return {
+        "success": True,
+        "phoneNumber": user.phone_number,
+        "username": user.username
+    }
+
+
+def snapshot(content, valid_until=None):
+    """(rendered JSON body, valid_until) for cache.SnapshotCache.read_through"""
+    return json_bytes(content), valid_until
+
+
+def json_body(body: bytes, headers=None):
+    # Already-rendered JSON goes out as is, skipping response_model validation
+    return Response(body, media_type="application/json", headers=headers)
+
+
+def etag(version: int, valid_until=None) -> str:
+    """Entity tag for a user's data at `version`.
+
+    Every write in crud.py bumps the version of the users it changes, so the
+    tag changes with the response. `valid_until` covers what changes with
+    time alone (an equb maturing), so a balance tag also moves then.
+    """
+    if valid_until is None:
+        return f'"{version:x}"'
+    return f'"{version:x}.{int(valid_until):x}"'
+
+
+def etag_matches(request, tag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    # Weak comparison (RFC 9110 13.1.2): W/ prefixes are ignored
+    candidates = [candidate.strip() for candidate in header.split(",")]
+    return "*" in candidates or tag in (candidate.removeprefix("W/") for candidate in candidates)
+
+
+def validator_headers(tag: str):
+    # no-cache: clients and proxies may keep the body but must revalidate every poll
+    return {"ETag": tag, "Cache-Control": "private, no-cache"}
+
+
+def not_modified(tag: str):
+    return Response(status_code=304, headers=validator_headers(tag))
+
+
+def conditional_json(request, snapshot):
+    """304 if the client already has this cache.Snapshot, else its body"""
+    tag = etag(snapshot.version, snapshot.valid_until)
+    if etag_matches(request, tag):
+        return not_modified(tag)
+    return json_body(snapshot.body, validator_headers(tag))
@@ -0,0 +1,47 @@
+import os
+from . import crud
+from .periodic import AdvisoryLockedJob
+
+# Seconds between sweeps; equb maturity in crud.create_equb_account is 30s for testing
+EQUB_MATURITY_INTERVAL = float(os.getenv("EQUB_MATURITY_INTERVAL", "10"))
+# Accounts updated per statement/commit, so a backlog never holds many row locks at once
+EQUB_MATURITY_BATCH_SIZE = int(os.getenv("EQUB_MATURITY_BATCH_SIZE", "1000"))
+EQUB_MATURITY_SCHEDULER = os.getenv("EQUB_MATURITY_SCHEDULER", "true").lower() == "true"
+
+# pg_advisory_lock key shared by every worker and instance
+EQUB_MATURITY_LOCK_KEY = 0x7e1eb1
+
+
+class EqubMaturityScheduler(AdvisoryLockedJob):
+    """Background thread flipping can_withdraw on matured equb accounts.
+
+    One process sweeps per round (see AdvisoryLockedJob). Reads never depend
+    on the sweep having run: see crud.equb_withdrawable.
+    """
+
+    name = "equb-maturity"
+    lock_key = EQUB_MATURITY_LOCK_KEY
+
+    def __init__(self, interval: float, batch_size: int):
+        super().__init__(interval)
+        self.batch_size = batch_size
+        self.stats.update(sweeps=0, updated=0)
+
+    def sweep(self) -> int:
+        """Run one sweep if this process gets the lock; returns accounts updated"""
+        return self.run_locked() or 0
+
+    def run(self, conn) -> int:
+        updated = 0
+        while not self._stop.is_set():
+            count = crud.update_equb_maturity(conn, self.batch_size)
+            conn.commit()
+            updated += count
+            if count < self.batch_size:
+                break
+        self.stats["sweeps"] += 1
+        self.stats["updated"] += updated
+        return updated
+
+
+equb_maturity_scheduler = EqubMaturityScheduler(EQUB_MATURITY_INTERVAL, EQUB_MATURITY_BATCH_SIZE)
@@ -1,109 +1,69 @@
-from pydantic import BaseModel, constr, PositiveFloat, validator
-from typing import Optional, List
+from pydantic import AfterValidator, BaseModel, Field, StringConstraints
+from typing import Annotated, Optional, List
 from datetime import datetime
 import uuid
-import re
+
+
+# Reusable field types. Every constraint but EqubAccountId's is a pattern or
+# bound checked inside pydantic-core, so validation rarely calls back into Python.
+EthiopianPhone = Annotated[str, StringConstraints(pattern=r'^09[0-9]{8}$')]  # 09XXXXXXXX
+Username = Annotated[str, StringConstraints(min_length=2, max_length=50)]
+Password = Annotated[str, StringConstraints(pattern=r'^[a-zA-Z0-9]{6}$')]  # exactly 6 alphanumeric characters
+# Birr amounts; inf and nan are rejected by the bounds
+TransferAmount = Annotated[float, Field(ge=1, le=100000)]
+EqubAmount = Annotated[float, Field(ge=500, le=50000)]
+EqubDuration = Annotated[int, Field(ge=1, le=1)]  # months; only 1-month equbs are offered
+# Whatever uuid.UUID() takes, as the handlers parse it with that; no pattern
+# matches all of its spellings (stray hyphens and braces, "uuid:", "0x", "_")
+
+
+def _check_uuid(value: str) -> str:
+    uuid.UUID(value)
+    return value
+
+
+EqubAccountId = Annotated[str, AfterValidator(_check_uuid)]
+
+MAX_BATCH_TRANSFER_ITEMS = 50000
 
 
 # Request schemas
 class SignupRequest(BaseModel):
-    phoneNumber: constr(min_length=10, max_length=10)
-    username: constr(min_length=2, max_length=50)
-    password: constr(min_length=6, max_length=6)
-    
-    @validator('phoneNumber')
-    def validate_phone(cls, v):
-        if not re.match(r'^09[0-9]{8}$', v):
-            raise ValueError('Phone number must be in format 09XXXXXXXX')
-        return v
-    
-    @validator('password')
-    def validate_password(cls, v):
-        if not re.match(r'^[a-zA-Z0-9]{6}$', v):
-            raise ValueError('Password must be exactly 6 alphanumeric characters')
-        return v
+    phoneNumber: EthiopianPhone
+    username: Username
+    password: Password
 
 
 class LoginRequest(BaseModel):
-    phoneNumber: constr(min_length=10, max_length=10)
-    password: constr(min_length=6, max_length=6)
-    
-    @validator('phoneNumber')
-    def validate_phone(cls, v):
-        if not re.match(r'^09[0-9]{8}$', v):
-            raise ValueError('Phone number must be in format 09XXXXXXXX')
-        return v
+    phoneNumber: EthiopianPhone
+    password: Annotated[str, StringConstraints(min_length=6, max_length=6)]
 
 
 class SendMoneyRequest(BaseModel):
-    senderPhone: constr(min_length=10, max_length=10)
-    recipientPhone: constr(min_length=10, max_length=10)
-    amount: PositiveFloat
-    
-    @validator('senderPhone')
-    def validate_sender_phone(cls, v):
-        if not re.match(r'^09[0-9]{8}$', v):
-            raise ValueError('Sender phone number must be in format 09XXXXXXXX')
-        return v
-    
-    @validator('recipientPhone')
-    def validate_recipient_phone(cls, v):
-        if not re.match(r'^09[0-9]{8}$', v):
-            raise ValueError('Recipient phone number must be in format 09XXXXXXXX')
-        return v
-    
-    @validator('amount')
-    def validate_amount(cls, v):
-        if v > 100000:
-            raise ValueError('Maximum transfer amount is 100,000 Birr')
-        if v < 1:
-            raise ValueError('Minimum transfer amount is 1 Birr')
-        return v
+    senderPhone: EthiopianPhone
+    recipientPhone: EthiopianPhone
+    amount: TransferAmount
+
+
+class BatchTransferItem(BaseModel):
+    recipientPhone: EthiopianPhone
+    amount: TransferAmount
+
+
+class BatchTransferRequest(BaseModel):
+    senderPhone: EthiopianPhone
+    transfers: Annotated[List[BatchTransferItem], Field(min_length=1, max_length=MAX_BATCH_TRANSFER_ITEMS)]
 
 
 class EqubDepositRequest(BaseModel):
-    phoneNumber: constr(min_length=10, max_length=10)
-    amount: PositiveFloat
-    durationMonths: int = 1
-    
-    @validator('phoneNumber')
-    def validate_phone(cls, v):
-        if not re.match(r'^09[0-9]{8}$', v):
-            raise ValueError('Phone number must be in format 09XXXXXXXX')
-        return v
-    
-    @validator('amount')
-    def validate_amount(cls, v):
-        if v < 500:
-            raise ValueError('Minimum equb deposit is 500 Birr')
-        if v > 50000:
-            raise ValueError('Maximum equb deposit is 50,000 Birr')
-        return v
-    
-    @validator('durationMonths')
-    def validate_duration(cls, v):
-        if v != 1:
-            raise ValueError('Equb duration must be exactly 1 month')
-        return v
+    phoneNumber: EthiopianPhone
+    amount: EqubAmount
+    durationMonths: EqubDuration = 1
 
 
 class EqubWithdrawRequest(BaseModel):
-    phoneNumber: constr(min_length=10, max_length=10)
-    equbAccountId: str
-    
-    @validator('phoneNumber')
-    def validate_phone(cls, v):
-        if not re.match(r'^09[0-9]{8}$', v):
-            raise ValueError('Phone number must be in format 09XXXXXXXX')
-        return v
-    
-    @validator('equbAccountId')
-    def validate_uuid(cls, v):
-        try:
-            uuid.UUID(v)
-        except ValueError:
-            raise ValueError('Invalid equb account ID format')
-        return v
+    phoneNumber: EthiopianPhone
+    equbAccountId: EqubAccountId
 
 
 class AuthResponse(BaseModel):
@@ -121,6 +81,24 @@ class TransactionResponse(BaseModel):
     newBalance: str
 
 
+class BatchTransferItemResponse(BaseModel):
+    index: int
+    recipientPhone: str
+    amount: str
+    status: str
+    transactionId: Optional[str] = None
+    error: Optional[str] = None
+
+
+class BatchTransferResponse(BaseModel):
+    success: bool
+    message: str
+    completed: int
+    failed: int
+    newBalance: str
+    results: List[BatchTransferItemResponse]
+
+
 class EqubAccountResponse(BaseModel):
     id: str
     phoneNumber: str
@@ -163,6 +141,7 @@ class TransactionHistoryItem(BaseModel):
 class TransactionHistoryResponse(BaseModel):
     success: bool
     transactions: List[TransactionHistoryItem]
+    nextCursor: Optional[str] = None  # pass back as ?cursor= for the next page; null on the last page
 
 
 class CheckPhoneResponse(BaseModel):
@@ -0,0 +1,67 @@
+import hashlib
+import mmap
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows; callers fall back to per-process state
+    fcntl = None
+
+
+def key_hash64(key: str) -> int:
+    """Non-zero 64-bit hash of key; 0 marks an empty slot"""
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "little") or 1
+
+
+def default_path(name: str) -> str:
+    shm_dir = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(shm_dir, name)
+
+
+class SharedTable:
+    """Fixed number of fixed-size records in a memory-mapped file.
+
+    Every gunicorn worker on the host that opens the same path sees the
+    same records. Callers hold locked() around each read-modify-write; it
+    takes an flock on the file plus a thread lock for this process.
+    """
+
+    def __init__(self, path: str, record, slots: int):
+        if fcntl is None:
+            raise RuntimeError("SharedTable requires fcntl")
+        self.path = path
+        self.record = record  # struct.Struct
+        self.slots = slots
+        size = slots * record.size
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self._fd).st_size != size:
+                os.ftruncate(self._fd, size)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._map = mmap.mmap(self._fd, size)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def locked(self):
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    @property
+    def buffer(self):
+        """The mapping itself, for callers that pack single fields of a record"""
+        return self._map
+
+    def read(self, index: int):
+        return self.record.unpack_from(self._map, index * self.record.size)
+
+    def write(self, index: int, *values):
+        self.record.pack_into(self._map, index * self.record.size, *values)
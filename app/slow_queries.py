@@ -0,0 +1,353 @@
+# Slow-query log.
+#
+# Engine hooks time every statement; one over SLOW_QUERY_MS is recorded with
+# its normalized SQL (literals and IN lists folded), the shape of its binds
+# (types, never values) and the app function that issued it. A sample of
+# them is explained again on a connection of its own in a background thread,
+# so the request that was slow never waits for its plan: pure reads under
+# EXPLAIN (ANALYZE, BUFFERS) in a read-only transaction, anything that could
+# write or lock rows under plain EXPLAIN, which never runs it. Entries go to a
+# per-worker ring buffer (GET /admin/slow-queries) and, once their plan is
+# in, to an NDJSON file shared by the workers and rotated by size.
+import logging
+import os
+import queue
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timezone
+import orjson
+from sqlalchemy import event
+from . import metrics
+from .shm import fcntl
+
+try:
+    import greenlet
+except ImportError:  # only needed to find callers in DB_MODE=async
+    greenlet = None
+
+logger = logging.getLogger(__name__)
+
+# Statements slower than this are logged; 0 turns the log off
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+# Share of slow statements explained (pure reads re-run under EXPLAIN ANALYZE)
+SLOW_QUERY_EXPLAIN_SAMPLE = float(os.getenv("SLOW_QUERY_EXPLAIN_SAMPLE", "0.1"))
+# The same normalized statement is explained at most once per interval per worker
+SLOW_QUERY_EXPLAIN_INTERVAL = float(os.getenv("SLOW_QUERY_EXPLAIN_INTERVAL", "60"))
+SLOW_QUERY_EXPLAIN_TIMEOUT = float(os.getenv("SLOW_QUERY_EXPLAIN_TIMEOUT", "10"))
+SLOW_QUERY_BUFFER = int(os.getenv("SLOW_QUERY_BUFFER", "200"))
+# NDJSON file; empty keeps entries in the ring buffer only
+SLOW_QUERY_LOG = os.getenv("SLOW_QUERY_LOG", "slow_queries.ndjson")
+SLOW_QUERY_LOG_MAX_BYTES = int(os.getenv("SLOW_QUERY_LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+SLOW_QUERY_LOG_BACKUPS = int(os.getenv("SLOW_QUERY_LOG_BACKUPS", "5"))
+
+EXPLAIN_QUEUE_SIZE = 16
+# Never queue behind the row locks of live transfers while explaining
+EXPLAIN_LOCK_TIMEOUT_MS = 1000
+EXPLAINABLE = ("select", "with", "insert", "update", "delete")
+# Only these are re-run under ANALYZE, and never when they write or lock rows
+ANALYZABLE = ("select", "with")
+_WRITES = re.compile(r"\b(?:insert|update|delete|merge|share)\b", re.IGNORECASE)
+# SQLSTATE of a write attempted in a read-only transaction, e.g. by a function the SELECT calls
+READ_ONLY_SQL_TRANSACTION = "25006"
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"(?<![\w$%.])-?\d+(?:\.\d+)?\b")
+_PLACEHOLDER = r"(?:%\(\w+\)s|%s|\$\d+|\?)"
+_IN_LIST = re.compile(rf"\(\s*{_PLACEHOLDER}(?:\s*,\s*{_PLACEHOLDER})+\s*\)")
+_DOLLAR = re.compile(r"\$(\d+)")
+_WHITESPACE = re.compile(r"\s+")
+
+slow_queries = metrics.Counter("telebirr_db_slow_queries_total", "Statements slower than SLOW_QUERY_MS", ("caller",))
+
+
+def normalize(statement: str) -> str:
+    """Statement with whitespace collapsed, literals as ? and IN lists as (...)"""
+    statement = _STRING.sub("?", statement)
+    statement = _NUMBER.sub("?", statement)
+    statement = _IN_LIST.sub("(...)", statement)
+    return _WHITESPACE.sub(" ", statement).strip()
+
+
+def _type_name(value) -> str:
+    if isinstance(value, (list, tuple)):
+        return f"{type(value).__name__}[{len(value)}]"
+    return "null" if value is None else type(value).__name__
+
+
+def bind_shape(parameters, executemany: bool = False):
+    """Types of the bound values: a dict or list like the parameters, without the values"""
+    if executemany:
+        parameters = list(parameters)
+        return {"rows": len(parameters), "row": bind_shape(parameters[0]) if parameters else None}
+    if isinstance(parameters, dict):
+        return {name: _type_name(value) for name, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [_type_name(value) for value in parameters]
+    return None if parameters is None else _type_name(parameters)
+
+
+_SKIP_MODULES = {__name__, "app.database", "app.metrics", "app.pool"}
+
+
+def _app_frame(frame):
+    # Private helpers such as _call_procedure name their public caller instead
+    helper = None
+    while frame is not None:
+        module = frame.f_globals.get("__name__", "")
+        if module.startswith("app.") and module not in _SKIP_MODULES:
+            name = f"{module[4:]}.{frame.f_code.co_qualname}"
+            if not frame.f_code.co_name.startswith("_"):
+                return name
+            helper = helper or name
+        frame = frame.f_back
+    return helper
+
+
+def find_caller():
+    """Innermost public app function on the stack, e.g. "crud.get_user_transactions"
+
+    With DB_MODE=async the statement runs in a greenlet whose stack starts
+    inside SQLAlchemy; the awaiting coroutines are on the parent greenlet.
+    """
+    caller = _app_frame(sys._getframe(1))
+    if caller is None and greenlet is not None:
+        parent = greenlet.getcurrent().parent
+        if parent is not None:
+            caller = _app_frame(parent.gr_frame)
+    return caller or "unknown"
+
+
+def _psycopg2_statement(statement: str, parameters, paramstyle: str):
+    """statement and parameters in psycopg2's pyformat style"""
+    if paramstyle in ("pyformat", "format"):
+        return statement, parameters
+    # asyncpg: $1..$n over a tuple
+    values = {f"p{index}": str(value) if isinstance(value, uuid.UUID) else value
+              for index, value in enumerate(parameters or (), 1)}
+    return _DOLLAR.sub(r"%(p\1)s", statement.replace("%", "%%")), values
+
+
+class NdjsonFile:
+    """Append-only NDJSON file rotated at max_bytes into path.1 .. path.<backups>.
+
+    Workers append whole lines with O_APPEND; the size check and rotation
+    take an flock on path.lock so two workers never rotate at once.
+    """
+
+    def __init__(self, path: str, max_bytes: int, backups: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._lock = threading.Lock()
+        self._lock_fd = None
+        self._failed = False
+
+    def write(self, record: dict):
+        line = orjson.dumps(record, default=str) + b"\n"
+        with self._lock:
+            try:
+                if fcntl is not None:
+                    if self._lock_fd is None:
+                        self._lock_fd = os.open(self.path + ".lock", os.O_RDWR | os.O_CREAT, 0o600)
+                    fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+                try:
+                    self._rotate(len(line))
+                    fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+                    try:
+                        os.write(fd, line)
+                    finally:
+                        os.close(fd)
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+                self._failed = False
+            except OSError as e:
+                if not self._failed:  # once per outage, not per statement
+                    logger.warning("Cannot write slow query log %s: %s", self.path, e)
+                self._failed = True
+
+    def _rotate(self, incoming: int):
+        try:
+            size = os.stat(self.path).st_size
+        except FileNotFoundError:
+            return
+        if size + incoming <= self.max_bytes:
+            return
+        if self.backups <= 0:
+            os.truncate(self.path, 0)
+            return
+        for index in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{index}"):
+                os.replace(f"{self.path}.{index}", f"{self.path}.{index + 1}")
+        os.replace(self.path, f"{self.path}.1")
+
+
+class SlowQueryLog:
+    def __init__(self, threshold_ms: float = SLOW_QUERY_MS, explain_sample: float = SLOW_QUERY_EXPLAIN_SAMPLE,
+                 explain_interval: float = SLOW_QUERY_EXPLAIN_INTERVAL, buffer_size: int = SLOW_QUERY_BUFFER,
+                 path: str = SLOW_QUERY_LOG):
+        self.threshold = threshold_ms / 1000
+        self.explain_sample = explain_sample
+        self.explain_interval = explain_interval
+        self.entries = deque(maxlen=buffer_size)
+        self.file = NdjsonFile(path, SLOW_QUERY_LOG_MAX_BYTES, SLOW_QUERY_LOG_BACKUPS) if path else None
+        self.explain_engine = None
+        self._explained = {}  # normalized statement -> when it was last explained
+        self._queue = None
+        self._pid = None
+        self._connection = None
+        self._lock = threading.Lock()
+        self.counters = {"slow": 0, "explained": 0, "explainErrors": 0, "explainDropped": 0}
+
+    def install(self, engine, explain_engine=None):
+        """Time statements on engine (the sync_engine of an async engine).
+
+        Plans are taken on a psycopg2 connection of explain_engine (engine
+        itself by default); without a PostgreSQL one nothing is explained.
+        """
+        if self.threshold <= 0:
+            return
+        explain_engine = explain_engine or engine
+        if explain_engine.dialect.name == "postgresql" and explain_engine.dialect.driver == "psycopg2":
+            self.explain_engine = explain_engine
+
+        @event.listens_for(engine, "before_cursor_execute")
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            if context is not None:
+                context.slow_query_started = time.perf_counter()
+
+        @event.listens_for(engine, "after_cursor_execute")
+        def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            started = getattr(context, "slow_query_started", None)
+            if started is None:
+                return
+            elapsed = time.perf_counter() - started
+            if elapsed >= self.threshold:
+                self.record(statement, parameters, executemany, elapsed, conn.dialect.paramstyle, cursor.rowcount)
+
+    def record(self, statement: str, parameters, executemany: bool, elapsed: float, paramstyle: str = "pyformat",
+               rowcount: int = -1) -> dict:
+        normalized = normalize(statement)
+        entry = {
+            "at": datetime.now(timezone.utc).isoformat(),
+            "durationMs": round(elapsed * 1000, 2),
+            "caller": find_caller(),
+            "sql": normalized,
+            "params": bind_shape(parameters, executemany),
+            "rowcount": rowcount,
+            "pid": os.getpid(),
+            "explain": None,
+        }
+        self.counters["slow"] += 1
+        slow_queries.inc(entry["caller"])
+        self.entries.append(entry)
+        if not executemany and self._should_explain(normalized):
+            entry["explain"] = "pending"
+            try:
+                analyze = normalized.lower().startswith(ANALYZABLE) and not _WRITES.search(normalized)
+                self._explain_queue().put_nowait((entry, statement, parameters, paramstyle, analyze))
+                return entry
+            except queue.Full:
+                entry["explain"] = None
+                self.counters["explainDropped"] += 1
+        if self.file is not None:
+            self.file.write(entry)
+        return entry
+
+    def _should_explain(self, normalized: str) -> bool:
+        if self.explain_engine is None or not normalized.lower().startswith(EXPLAINABLE):
+            return False
+        if random.random() >= self.explain_sample:
+            return False
+        now = time.monotonic()
+        with self._lock:
+            if now - self._explained.get(normalized, -self.explain_interval) < self.explain_interval:
+                return False
+            if len(self._explained) >= 1000:
+                self._explained.clear()
+            self._explained[normalized] = now
+        return True
+
+    def _explain_queue(self):
+        # The thread is started on first use in each worker, never in the gunicorn master
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._queue = queue.Queue(EXPLAIN_QUEUE_SIZE)
+                self._connection = None
+                threading.Thread(target=self._explain_loop, args=(self._queue,), name="slow-query-explain",
+                                 daemon=True).start()
+            return self._queue
+
+    def _explain_loop(self, jobs):
+        while True:
+            entry, statement, parameters, paramstyle, analyze = jobs.get()
+            started = time.perf_counter()
+            try:
+                entry["explain"], entry["explainAnalyzed"] = self._explain(statement, parameters, paramstyle, analyze)
+                entry["explainMs"] = round((time.perf_counter() - started) * 1000, 2)
+                self.counters["explained"] += 1
+            except Exception as e:
+                entry["explain"] = None
+                entry["explainError"] = f"{type(e).__name__}: {e}".strip()
+                self.counters["explainErrors"] += 1
+                self._close()
+            if self.file is not None:
+                self.file.write(entry)
+
+    def _connect(self):
+        if self._connection is None or self._connection.closed:
+            engine = self.explain_engine
+            cargs, cparams = engine.dialect.create_connect_args(engine.url)
+            cparams.setdefault("connect_timeout", 5)
+            self._connection = engine.dialect.dbapi.connect(*cargs, **cparams)
+        return self._connection
+
+    def _close(self):
+        if self._connection is not None:
+            try:
+                self._connection.close()
+            except Exception:
+                pass
+            self._connection = None
+
+    def _explain(self, statement: str, parameters, paramstyle: str, analyze: bool):
+        """(plan, whether it was analyzed); a read that turns out to write falls back to plain EXPLAIN"""
+        statement, parameters = _psycopg2_statement(statement, parameters, paramstyle)
+        if analyze:
+            try:
+                return self._plan("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) ", statement, parameters, True), True
+            except Exception as e:
+                if getattr(e, "pgcode", None) != READ_ONLY_SQL_TRANSACTION:
+                    raise
+        return self._plan("EXPLAIN (FORMAT JSON) ", statement, parameters, False), False
+
+    def _plan(self, explain: str, statement: str, parameters, read_only: bool):
+        conn = self._connect()
+        try:
+            with conn.cursor() as cursor:
+                if read_only:
+                    # ANALYZE runs the statement: functions it calls must not write or lock rows
+                    cursor.execute("SET TRANSACTION READ ONLY")
+                cursor.execute("SET LOCAL statement_timeout = %s", (int(SLOW_QUERY_EXPLAIN_TIMEOUT * 1000),))
+                cursor.execute("SET LOCAL lock_timeout = %s", (EXPLAIN_LOCK_TIMEOUT_MS,))
+                cursor.execute(explain + statement, parameters)
+                plan = cursor.fetchone()[0]
+        finally:
+            conn.rollback()
+        plan = orjson.loads(plan) if isinstance(plan, str) else plan
+        return plan[0]
+
+    def snapshot(self, limit: int = 50) -> dict:
+        """Newest entries of this worker first"""
+        entries = list(self.entries)[::-1][:limit]
+        return {"thresholdMs": self.threshold * 1000, "explainSample": self.explain_sample,
+                "pid": os.getpid(), **self.counters, "entries": entries}
+
+
+slow_query_log = SlowQueryLog()
@@ -0,0 +1,183 @@
+import asyncio
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError
+from . import crud, metrics
+from .database import CRUD_MODE, SessionLocal
+
+logger = logging.getLogger(__name__)
+
+# Queue send-money transfers in each worker and commit them in groups. Groups
+# run TRANSFER_SQL, so this only applies with CRUD_MODE=python.
+TRANSFER_PIPELINE = os.getenv("TRANSFER_PIPELINE", "false").lower() == "true" and CRUD_MODE == "python"
+# Most transfers per group commit
+TRANSFER_BATCH_SIZE = int(os.getenv("TRANSFER_BATCH_SIZE", "16"))
+# Longest the first transfer of a group waits for others to join it; with 0,
+# groups are only what queued up while the previous commit ran
+TRANSFER_BATCH_DELAY_MS = float(os.getenv("TRANSFER_BATCH_DELAY_MS", "0"))
+# Longest a caller waits for a queued transfer before it is withdrawn from the queue
+TRANSFER_QUEUE_TIMEOUT = float(os.getenv("TRANSFER_QUEUE_TIMEOUT", "10"))
+
+group_size = metrics.Histogram("telebirr_transfer_group_size", "Transfers applied per group commit",
+                               buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256))
+queue_wait = metrics.Histogram("telebirr_transfer_queue_seconds", "Time from submit until the transfer's group started",
+                               buckets=metrics.QUERY_BUCKETS)
+
+
+class TransferPipeline:
+    """Background thread applying queued transfers in group commits.
+
+    Callers get a Future from submit(), or wait on it through transfer() and
+    transfer_async(), which stand in for crud.transfer_money. The thread takes
+    the oldest transfer, collects more for up to max_delay seconds or until
+    it has max_batch, and applies them with crud.group_transfer_money: one
+    transaction and one COMMIT for the whole group. A group that raises is
+    replayed one transfer at a time through crud.transfer_money, and so are
+    transfers refused for insufficient balance, since that path consolidates
+    the sender's credit shards first.
+
+    While the pipeline is not running, transfer() and transfer_async() call
+    crud.transfer_money on the caller's session instead. A transfer still
+    queued after `timeout` seconds is cancelled and reported as failed; one
+    whose group has started is waited for, like a direct call.
+    """
+
+    def __init__(self, max_batch: int, max_delay: float, timeout: float = TRANSFER_QUEUE_TIMEOUT):
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.timeout = timeout
+        self.counters = {"transfers": 0, "groups": 0, "replayed": 0, "errors": 0, "timeouts": 0}
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        # Orders submits against stop(), so nothing is queued behind the stop marker
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def submit(self, from_phone: str, to_phone: str, amount: float) -> Future:
+        """Queue a transfer; RuntimeError if the pipeline is not running"""
+        with self._lock:
+            if not self.running:
+                raise RuntimeError("Transfer pipeline is not running")
+            future = Future()
+            self._queue.put((from_phone, to_phone, amount, future, time.perf_counter()))
+        return future
+
+    def _timed_out(self, future: Future) -> bool:
+        """Withdraw a transfer whose group hasn't started; False if it has"""
+        if not future.cancel():
+            return False
+        self.counters["timeouts"] += 1
+        return True
+
+    def transfer(self, db, from_phone: str, to_phone: str, amount: float):
+        """crud.transfer_money through the pipeline; groups have their own session, `db` is only used without one"""
+        try:
+            future = self.submit(from_phone, to_phone, amount)
+        except RuntimeError:
+            return crud.transfer_money(db, from_phone, to_phone, amount)
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            if self._timed_out(future):
+                return False, "Transfer timed out waiting for its group commit"
+            return future.result()
+
+    async def transfer_async(self, db, from_phone: str, to_phone: str, amount: float):
+        try:
+            future = self.submit(from_phone, to_phone, amount)
+        except RuntimeError:
+            return await db.run_sync(crud.transfer_money, from_phone, to_phone, amount)
+        waiter = asyncio.wrap_future(future)
+        try:
+            return await asyncio.wait_for(asyncio.shield(waiter), self.timeout)
+        except asyncio.TimeoutError:
+            if self._timed_out(future):
+                return False, "Transfer timed out waiting for its group commit"
+            return await waiter
+
+    def _collect(self, first):
+        """The group started by `first`; None in it means stop after this group"""
+        group = [first]
+        deadline = time.perf_counter() + self.max_delay
+        while len(group) < self.max_batch and group[-1] is not None:
+            try:
+                group.append(self._queue.get(timeout=max(0.0, deadline - time.perf_counter())))
+            except queue.Empty:
+                break
+        return group
+
+    def _apply(self, group):
+        # Transfers whose caller gave up are dropped; the rest can no longer be cancelled
+        group = [item for item in group if item[3].set_running_or_notify_cancel()]
+        if not group:
+            return
+        db = None
+        try:
+            started = time.perf_counter()
+            for *_, submitted in group:
+                queue_wait.observe(started - submitted)
+            group_size.observe(len(group))
+            transfers = [(from_phone, to_phone, amount) for from_phone, to_phone, amount, _, _ in group]
+            db = SessionLocal()
+            try:
+                outcomes = crud.group_transfer_money(db, transfers)
+            except Exception as e:
+                self.counters["errors"] += 1
+                logger.warning("Group commit of %d transfers failed, replaying them one by one: %s",
+                               len(group), getattr(e, "orig", e))
+                outcomes = [None] * len(group)
+            for (from_phone, to_phone, amount, future, _), outcome in zip(group, outcomes):
+                if outcome is None or outcome == (False, "Insufficient balance"):
+                    self.counters["replayed"] += 1
+                    outcome = crud.transfer_money(db, from_phone, to_phone, amount)
+                future.set_result(outcome)
+        except Exception as e:
+            logger.exception("Applying a group of %d transfers failed", len(group))
+            for *_, future, _ in group:
+                if not future.done():
+                    future.set_result((False, str(e)))
+        finally:
+            if db is not None:
+                db.close()
+        self.counters["groups"] += 1
+        self.counters["transfers"] += len(group)
+
+    def _run(self):
+        while True:
+            group = self._collect(self._queue.get())
+            stopping = group[-1] is None
+            if stopping:
+                group.pop()
+            if group:
+                try:
+                    self._apply(group)
+                except Exception:
+                    # Every future already has its result; keep serving the queue
+                    logger.exception("Transfer pipeline group failed")
+            if stopping:
+                return
+
+    def start(self):
+        with self._lock:
+            if not self.running:
+                self._thread = threading.Thread(target=self._run, name="transfer-pipeline", daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        """Finish the transfers already queued, then exit"""
+        with self._lock:
+            if self._thread is not None:
+                self._queue.put(None)
+                self._thread = None
+
+    def stats(self) -> dict:
+        return {**self.counters, "queued": self._queue.qsize(), "running": self.running}
+
+
+transfer_pipeline = TransferPipeline(TRANSFER_BATCH_SIZE, TRANSFER_BATCH_DELAY_MS / 1000)
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""/user/balance latency with 1M equb accounts, and maturity sweep throughput.
+
+Loads USERS users with ACCOUNTS_PER_USER equb accounts each, maturities
+spread over the previous and next 30 days and none flagged withdrawable.
+It then times:
+  - one maturity scheduler sweep draining the backlog in batches
+  - /user/balance as served now (reads only, withdrawability derived)
+  - the old per-request global sweep (crud.update_equb_maturity before the
+    refactor) followed by the same read, for comparison
+
+Uses the database in DATABASE_URL, which must have schema.sql loaded. Use a
+local Postgres; the benchmark creates and deletes its own 0995xxxxxx users.
+
+Usage: DATABASE_URL=postgresql://postgres@localhost/telebirr python benchmarks/bench_balance.py
+"""
+import os
+import sys
+import time
+import random
+import statistics
+from datetime import datetime
+from sqlalchemy import text
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+load_dotenv()
+os.environ["EQUB_MATURITY_SCHEDULER"] = "false"  # sweeps are run by hand below
+os.environ["RATE_LIMIT_ENABLED"] = "false"
+
+from fastapi.testclient import TestClient
+from app import models
+from app.main import app
+from app.database import engine, SessionLocal
+from app.scheduler import equb_maturity_scheduler
+
+USERS = 20000
+ACCOUNTS_PER_USER = 50
+REQUESTS = 200
+LEGACY_REQUESTS = 10
+PHONE_PREFIX = "0995"
+
+
+def phone(n):
+    return f"{PHONE_PREFIX}{n:06d}"
+
+
+def reset(create=True):
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM equb_accounts WHERE phone_number LIKE :p"), {"p": PHONE_PREFIX + "%"})
+        conn.execute(text("DELETE FROM users WHERE phone_number LIKE :p"), {"p": PHONE_PREFIX + "%"})
+        if not create:
+            return
+        conn.execute(text("""
+            INSERT INTO users (phone_number, username, password_hash, balance)
+            SELECT :prefix || lpad(n::text, 6, '0'), 'bench', '', 0 FROM generate_series(0, :users - 1) AS n
+        """), {"prefix": PHONE_PREFIX, "users": USERS})
+        conn.execute(text("""
+            INSERT INTO equb_accounts (phone_number, amount, deposit_date, maturity_date, can_withdraw, is_active)
+            SELECT :prefix || lpad((n % :users)::text, 6, '0'), 500,
+                   :now - INTERVAL '60 days',
+                   :now + (n % 86400 - 43200) * INTERVAL '60 seconds',
+                   FALSE, TRUE
+            FROM generate_series(0, :rows - 1) AS n
+        """), {"prefix": PHONE_PREFIX, "users": USERS, "rows": USERS * ACCOUNTS_PER_USER, "now": datetime.utcnow()})
+    with engine.connect() as conn:
+        conn.execution_options(isolation_level="AUTOCOMMIT").execute(text("VACUUM ANALYZE equb_accounts"))
+
+
+def legacy_update_equb_maturity(db):
+    # crud.update_equb_maturity as /user/balance used to call it
+    equb_accounts = db.query(models.EqubAccount).filter(
+        models.EqubAccount.maturity_date <= datetime.utcnow(),
+        models.EqubAccount.can_withdraw == False,
+        models.EqubAccount.is_active == True
+    ).all()
+    for account in equb_accounts:
+        account.can_withdraw = True
+        db.add(account)
+    db.commit()
+    return len(equb_accounts)
+
+
+def report(label, samples):
+    ms = sorted(s * 1000 for s in samples)
+    print(f"  {label:<34} p50={statistics.median(ms):8.2f}ms  p95={ms[int(len(ms) * 0.95) - 1]:8.2f}ms")
+
+
+def timed_balance(client):
+    started = time.perf_counter()
+    response = client.get("/user/balance", params={"phoneNumber": phone(random.randrange(USERS))})
+    elapsed = time.perf_counter() - started
+    assert response.status_code == 200, response.text
+    return elapsed
+
+
+if __name__ == "__main__":
+    print(f"Loading {USERS * ACCOUNTS_PER_USER} equb accounts for {USERS} users...")
+    reset()
+
+    with TestClient(app) as client:
+        print(f"=== /user/balance, {ACCOUNTS_PER_USER} equb accounts per user ===")
+        report("read-only (pending backlog)", [timed_balance(client) for _ in range(REQUESTS)])
+
+        started = time.perf_counter()
+        updated = equb_maturity_scheduler.sweep()
+        elapsed = time.perf_counter() - started
+        print(f"  scheduler sweep: {updated} accounts in {elapsed:.2f}s "
+              f"({updated / elapsed:.0f}/s, batches of {equb_maturity_scheduler.batch_size})")
+        report("read-only (after sweep)", [timed_balance(client) for _ in range(REQUESTS)])
+
+        # Re-open the backlog so the legacy sweep has the same work to do on its first call
+        with engine.begin() as conn:
+            conn.execute(text("UPDATE equb_accounts SET can_withdraw = FALSE WHERE phone_number LIKE :p"), {"p": PHONE_PREFIX + "%"})
+        samples = []
+        for _ in range(LEGACY_REQUESTS):
+            started = time.perf_counter()
+            db = SessionLocal()
+            try:
+                legacy_update_equb_maturity(db)
+            finally:
+                db.close()
+            timed_balance(client)
+            samples.append(time.perf_counter() - started)
+        print(f"  legacy first request (global sweep): {samples[0] * 1000:.0f}ms")
+        report("legacy later requests", samples[1:])
+
+    reset(create=False)
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""Credit throughput on one hot merchant by users.credit_shards.
+
+Many customers pay the same merchant through crud.transfer_money. Unsharded,
+every payment queues on the merchant's users row; with N shards the credits
+land on one of N balance_shards rows at random and only the sender is locked.
+Each shard count is run on fresh accounts, then one consolidation of the
+merchant is timed.
+
+Calls the crud functions directly (no HTTP) against the database in
+DATABASE_URL, which must have schema.sql loaded. Use a local Postgres; the
+benchmark creates and deletes its own 09920000xx users.
+
+Usage: DATABASE_URL=postgresql://postgres@localhost/telebirr python benchmarks/bench_balance_shards.py [shards ...]
+"""
+import os
+import sys
+import time
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from sqlalchemy import text
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+load_dotenv()
+
+from app import crud
+from app.database import engine, SessionLocal
+
+CUSTOMERS = 63
+OPERATIONS = 4000
+THREADS = 16
+SHARD_COUNTS = [0, 1, 2, 4, 8, 16]
+MERCHANT = "0992000000"
+PHONES = [MERCHANT] + [f"09920000{i:02d}" for i in range(1, CUSTOMERS + 1)]
+
+
+def reset_accounts(create=True):
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM transactions WHERE from_phone = ANY(:p) OR to_phone = ANY(:p)"), {"p": PHONES})
+        conn.execute(text("DELETE FROM users WHERE phone_number = ANY(:p)"), {"p": PHONES})
+        for phone in PHONES if create else []:
+            conn.execute(
+                text("INSERT INTO users (phone_number, username, password_hash, balance) VALUES (:p, 'bench', '', :b)"),
+                {"p": phone, "b": Decimal("100000000.00")}
+            )
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def timed_payment(i):
+    db = SessionLocal()
+    try:
+        started = time.perf_counter()
+        ok, result = crud.transfer_money(db, PHONES[1 + i % CUSTOMERS], MERCHANT, 1)
+        elapsed = time.perf_counter() - started
+    finally:
+        db.close()
+    if not ok:
+        raise RuntimeError(result)
+    return elapsed
+
+
+def bench_shards(shards):
+    reset_accounts()
+    db = SessionLocal()
+    crud.set_credit_shards(db, MERCHANT, shards)
+    db.close()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=THREADS) as pool:
+        samples = list(pool.map(timed_payment, range(OPERATIONS)))
+    elapsed = time.perf_counter() - started
+    ms = [s * 1000 for s in samples]
+    label = f"{shards} shards" if shards else "unsharded"
+    print(f"  {label:<12} {OPERATIONS / elapsed:8.1f} ops/s  p50={statistics.median(ms):6.2f}ms  p99={percentile(ms, 99):7.2f}ms")
+
+
+def bench_consolidation():
+    """Time folding the last run's shards back into users.balance"""
+    with engine.connect() as conn:
+        started = time.perf_counter()
+        moved = conn.execute(crud.CONSOLIDATE_SHARDS_SQL, {"phone": MERCHANT}).scalar()
+        conn.commit()
+        elapsed = time.perf_counter() - started
+    print(f"  {'consolidate':<12} {elapsed * 1000:8.2f}ms to move {moved}")
+
+
+if __name__ == "__main__":
+    counts = [int(arg) for arg in sys.argv[1:]] or SHARD_COUNTS
+    print(f"=== fan-in to one merchant ({OPERATIONS} payments from {CUSTOMERS} customers, {THREADS} threads) ===")
+    for shards in counts:
+        bench_shards(shards)
+    bench_consolidation()
+    reset_accounts(create=False)
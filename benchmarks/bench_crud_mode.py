@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""Latency and throughput of CRUD_MODE=python vs CRUD_MODE=db.
+
+Calls the crud functions directly (no HTTP) against the database in
+DATABASE_URL, which must have schema.sql loaded. Use a local Postgres; the
+benchmark creates and deletes its own 09980000xx users.
+
+Usage: DATABASE_URL=postgresql://postgres@localhost/telebirr python benchmarks/bench_crud_mode.py
+"""
+import os
+import sys
+import time
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from sqlalchemy import text
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+load_dotenv()
+
+from app import crud
+from app.database import engine, SessionLocal
+
+ACCOUNTS = 32
+SEQUENTIAL_OPS = 500
+CONCURRENT_OPS = 4000
+THREADS = 8
+PHONES = [f"09980000{i:02d}" for i in range(ACCOUNTS)]
+
+MODES = {
+    "python": (crud.transfer_money, crud.create_equb_account, crud.withdraw_equb),
+    "db": (crud.db_transfer_money, crud.db_create_equb_account, crud.db_withdraw_equb),
+}
+
+
+def reset_accounts(create=True):
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM transactions WHERE from_phone = ANY(:p) OR to_phone = ANY(:p)"), {"p": PHONES})
+        conn.execute(text("DELETE FROM equb_accounts WHERE phone_number = ANY(:p)"), {"p": PHONES})
+        conn.execute(text("DELETE FROM users WHERE phone_number = ANY(:p)"), {"p": PHONES})
+        for phone in PHONES if create else []:
+            conn.execute(
+                text("INSERT INTO users (phone_number, username, password_hash, balance) VALUES (:p, 'bench', '', :b)"),
+                {"p": phone, "b": Decimal("100000000.00")}
+            )
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def timed(fn, *args):
+    db = SessionLocal()
+    try:
+        started = time.perf_counter()
+        ok, result = fn(db, *args)
+        elapsed = time.perf_counter() - started
+    finally:
+        db.close()
+    if not ok:
+        raise RuntimeError(result)
+    return elapsed, result
+
+
+def transfer_args(i):
+    return PHONES[i % ACCOUNTS], PHONES[(i * 7 + 1) % ACCOUNTS], 1
+
+
+def report(label, samples):
+    ms = [s * 1000 for s in samples]
+    print(f"  {label:<22} p50={statistics.median(ms):6.2f}ms  p95={percentile(ms, 95):6.2f}ms  p99={percentile(ms, 99):6.2f}ms")
+
+
+def bench_mode(name):
+    transfer, deposit, withdraw = MODES[name]
+    reset_accounts()
+    print(f"=== CRUD_MODE={name} ===")
+
+    report("transfer", [timed(transfer, *transfer_args(i))[0] for i in range(SEQUENTIAL_OPS)])
+
+    deposits = [timed(deposit, PHONES[i % ACCOUNTS], 500, 1) for i in range(SEQUENTIAL_OPS)]
+    report("equb deposit", [elapsed for elapsed, _ in deposits])
+
+    # Make every deposit withdrawable without waiting for maturity
+    with engine.begin() as conn:
+        conn.execute(text("UPDATE equb_accounts SET maturity_date = CURRENT_TIMESTAMP - INTERVAL '1 day' WHERE phone_number = ANY(:p)"), {"p": PHONES})
+    report("equb withdraw", [timed(withdraw, account.phone_number, str(account.id))[0] for _, account in deposits])
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=THREADS) as pool:
+        list(pool.map(lambda i: timed(transfer, *transfer_args(i)), range(CONCURRENT_OPS)))
+    elapsed = time.perf_counter() - started
+    print(f"  {'transfer throughput':<22} {CONCURRENT_OPS / elapsed:8.1f} ops/s with {THREADS} threads")
+
+
+if __name__ == "__main__":
+    for mode in sys.argv[1:] or list(MODES):
+        bench_mode(mode)
+    reset_accounts(create=False)
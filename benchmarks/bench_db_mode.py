@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""Requests/sec per worker for DB_MODE=sync vs DB_MODE=async.
+
+Start one worker per mode, e.g.
+
+    DB_MODE=sync  gunicorn app.main:app -w 1 -k uvicorn.workers.UvicornWorker --bind 127.0.0.1:8001
+    DB_MODE=async gunicorn app.main:app -w 1 -k uvicorn.workers.UvicornWorker --bind 127.0.0.1:8002
+
+then run: python benchmarks/bench_db_mode.py http://127.0.0.1:8001 http://127.0.0.1:8002
+"""
+import sys
+import time
+import requests
+from concurrent.futures import ThreadPoolExecutor
+
+CONCURRENCY = 64
+REQUESTS_PER_ENDPOINT = 2000
+SENDER = {"phoneNumber": "0911000001", "username": "Bench Sender", "password": "bench1"}
+RECIPIENT = {"phoneNumber": "0911000002", "username": "Bench Recipient", "password": "bench2"}
+
+
+def setup_users(base_url):
+    for user in (SENDER, RECIPIENT):
+        requests.post(f"{base_url}/auth/signup", json=user, timeout=10)
+
+
+def run(base_url, name, method, path, **kwargs):
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=CONCURRENCY, pool_maxsize=CONCURRENCY)
+    session.mount("http://", adapter)
+
+    def call(_):
+        response = session.request(method, f"{base_url}{path}", timeout=30, **kwargs)
+        return response.status_code < 500
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=CONCURRENCY) as pool:
+        ok = sum(pool.map(call, range(REQUESTS_PER_ENDPOINT)))
+    elapsed = time.perf_counter() - started
+    print(f"  {name:<14} {REQUESTS_PER_ENDPOINT / elapsed:8.1f} req/s   errors={REQUESTS_PER_ENDPOINT - ok}")
+
+
+def bench(base_url):
+    mode = requests.get(f"{base_url}/health", timeout=10).json().get("dbMode", "?")
+    print(f"=== {base_url} (DB_MODE={mode}) ===")
+    setup_users(base_url)
+    run(base_url, "balance", "GET", "/user/balance", params={"phoneNumber": SENDER["phoneNumber"]})
+    run(base_url, "check-phone", "GET", "/user/check-phone", params={"phoneNumber": RECIPIENT["phoneNumber"]})
+    run(base_url, "transactions", "GET", "/user/transactions", params={"phoneNumber": SENDER["phoneNumber"]})
+    run(base_url, "send-money", "POST", "/transactions/send-money", json={
+        "senderPhone": SENDER["phoneNumber"],
+        "recipientPhone": RECIPIENT["phoneNumber"],
+        "amount": 1
+    })
+
+
+if __name__ == "__main__":
+    for url in sys.argv[1:] or ["http://localhost:8000"]:
+        bench(url)
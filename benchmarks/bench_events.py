@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""Memory per idle event stream and NOTIFY-to-client fan-out latency.
+
+Opens STREAMS event streams in one worker's EventHub (each drained by its
+own task, the way a StreamingResponse drives it) spread over USERS users,
+and reports the Python memory they hold while idle. It then commits
+transfers with pg_notify the way the schema.sql triggers do and times how
+long until every stream of the recipient has the event.
+
+Socket and ASGI server buffers are not included; budget them on top.
+
+Uses the database in DATABASE_URL. Nothing is written to tables.
+
+Usage: DATABASE_URL=postgresql://postgres@localhost/telebirr python benchmarks/bench_events.py [STREAMS]
+"""
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+from sqlalchemy import text
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+load_dotenv()
+
+from app.database import engine
+from app.events import EventHub, EVENTS_CHANNEL
+
+STREAMS = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+USERS = 1000
+ROUNDS = 50
+
+
+def phone(n):
+    return f"0998{n:06d}"
+
+
+def notify(payloads):
+    with engine.connect() as conn:
+        for payload in payloads:
+            conn.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": EVENTS_CHANNEL, "payload": payload})
+        conn.commit()
+
+
+async def drain(stream, received):
+    async for chunk in stream:
+        received.append(time.perf_counter())
+
+
+async def main():
+    loop = asyncio.get_running_loop()
+    hub = EventHub(heartbeat=60)
+    hub.start()
+    while not hub.stats()["listening"]:
+        await asyncio.sleep(0.05)
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    received = {n: [] for n in range(USERS)}
+    tasks = [loop.create_task(drain(hub.stream(phone(i % USERS)), received[i % USERS])) for i in range(STREAMS)]
+    await asyncio.sleep(0.5)
+    held = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    print(f"=== {STREAMS} idle streams over {USERS} users ===")
+    print(f"  memory {held / 2**20:.1f} MiB, {held / STREAMS / 1024:.2f} KiB per stream")
+
+    per_user = STREAMS // USERS
+    latencies = []
+    for round_ in range(ROUNDS):
+        user = round_ % USERS
+        received[user].clear()
+        payload = json.dumps({"event": "transaction", "id": str(round_), "fromPhone": phone(USERS + 1),
+                              "toPhone": phone(user), "amount": "1.00"})
+        started = time.perf_counter()
+        await loop.run_in_executor(None, notify, [payload])
+        while len(received[user]) < per_user:
+            await asyncio.sleep(0.0005)
+        latencies.append((max(received[user]) - started) * 1000)
+    latencies.sort()
+    print(f"  commit -> {per_user} streams of the recipient: p50={statistics.median(latencies):.2f}ms "
+          f"p95={latencies[int(len(latencies) * 0.95) - 1]:.2f}ms")
+
+    for chunks in received.values():
+        chunks.clear()
+    started = time.perf_counter()
+    await loop.run_in_executor(None, notify, [json.dumps({"event": "balance", "phoneNumber": phone(i), "balance": "1.00"})
+                                              for i in range(USERS)])
+    while any(len(received[i]) < per_user for i in range(USERS)):
+        await asyncio.sleep(0.001)
+    print(f"  one commit notifying all {USERS} users -> all {STREAMS} streams: {(time.perf_counter() - started) * 1000:.1f}ms")
+    print(f"  hub: {hub.stats()}")
+
+    hub.stop()
+    await asyncio.gather(*tasks)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
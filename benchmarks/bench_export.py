@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""Time to first rows and peak memory of the streaming transaction export.
+
+Gives one user ROWS transactions, then produces the CSV export the way
+/user/transactions/export does (server-side cursor, one chunk at a time)
+and, for comparison, by fetching every row before formatting. Peak memory
+is what tracemalloc sees in this process.
+
+Uses the database in DATABASE_URL, which must have schema.sql loaded. Use a
+local Postgres; the benchmark creates and deletes its own 09960000xx users
+and their rows.
+
+Usage: DATABASE_URL=postgresql://postgres@localhost/telebirr python benchmarks/bench_export.py [ROWS]
+"""
+import os
+import sys
+import time
+import tracemalloc
+from sqlalchemy import text
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+load_dotenv()
+
+from app import crud, responses
+from app.database import engine
+
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+USER = "0996000000"
+PEER = "0996000001"
+
+
+def reset(rows=0):
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM transactions WHERE from_phone = ANY(:p) OR to_phone = ANY(:p)"), {"p": [USER, PEER]})
+        conn.execute(text("DELETE FROM users WHERE phone_number = ANY(:p)"), {"p": [USER, PEER]})
+        if not rows:
+            return
+        for phone in (USER, PEER):
+            conn.execute(text("INSERT INTO users (phone_number, username, password_hash, balance) VALUES (:p, 'bench', '', 0)"), {"p": phone})
+        conn.execute(text("""
+            INSERT INTO transactions (from_phone, to_phone, amount, transaction_type, status, created_at)
+            SELECT CASE WHEN n % 2 = 0 THEN :user ELSE :peer END, CASE WHEN n % 2 = 0 THEN :peer ELSE :user END,
+                   1 + n % 500, 'TRANSFER', 'COMPLETED', TIMESTAMP '2026-01-01' - n * INTERVAL '1 second'
+            FROM generate_series(1, :rows) AS n
+        """), {"user": USER, "peer": PEER, "rows": rows})
+    with engine.connect() as conn:
+        conn.execution_options(isolation_level="AUTOCOMMIT").execute(text("VACUUM ANALYZE transactions"))
+
+
+def streamed():
+    yield responses.export_header("csv")
+    with engine.connect() as conn:
+        for rows in crud.stream_user_transactions(conn, USER):
+            yield responses.export_chunk(rows, "csv")
+
+
+def buffered():
+    with engine.connect() as conn:
+        rows = conn.execute(crud.TRANSACTION_EXPORT_STATEMENT, crud.transaction_export_params(USER, None, None)).all()
+    yield responses.export_header("csv") + responses.export_chunk(rows, "csv")
+
+
+def measure(label, body):
+    started = time.perf_counter()
+    header, first_rows, size = len(responses.export_header("csv")), None, 0
+    for chunk in body():
+        size += len(chunk)
+        if first_rows is None and size > header:
+            first_rows = time.perf_counter() - started
+    elapsed = time.perf_counter() - started
+
+    # Separate pass: tracing every allocation would distort the timings above
+    tracemalloc.start()
+    for chunk in body():
+        pass
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f"  {label:<9} first rows {first_rows * 1000:8.1f}ms  total {elapsed:6.2f}s  "
+          f"peak {peak / 2**20:7.1f} MiB  ({size / 2**20:.0f} MiB of CSV)")
+
+
+if __name__ == "__main__":
+    for rows in (ROWS // 10, ROWS):
+        print(f"=== CSV export of {rows} rows ===")
+        reset(rows)
+        measure("streamed", streamed)
+        measure("buffered", buffered)
+    reset()
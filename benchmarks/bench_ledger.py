@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""Write throughput on hot accounts: balance updates vs the append-only ledger.
+
+Compares crud.transfer_money, which row-locks sender and recipient, with
+crud.ledger_transfer_money, which locks only the sender and appends entries.
+Workloads:
+  fan-in   many customers paying a couple of merchants
+  hot pair two accounts paying each other
+  spread   random transfers between all accounts
+Then shows what an uncompacted ledger costs ledger_balance reads, and one
+compaction.
+
+Calls the crud functions directly (no HTTP) against the database in
+DATABASE_URL, which must have schema.sql loaded. Use a local Postgres; the
+benchmark creates and deletes its own 09980000xx users.
+
+Usage: DATABASE_URL=postgresql://postgres@localhost/telebirr python benchmarks/bench_ledger.py [workload ...]
+"""
+import os
+import sys
+import time
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from sqlalchemy import text
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+load_dotenv()
+
+from app import crud
+from app.database import engine, SessionLocal
+from app.ledger import LedgerCompactor, LEDGER_COMPACT_INTERVAL, LEDGER_REFRESH_BATCH_SIZE
+
+ACCOUNTS = 64
+MERCHANTS = 2
+OPERATIONS = 4000
+THREADS = 16
+READS = 200
+PHONES = [f"09980000{i:02d}" for i in range(ACCOUNTS)]
+
+TRANSFERS = {
+    "transfer_money": crud.transfer_money,
+    "ledger_transfer_money": crud.ledger_transfer_money,
+}
+
+WORKLOADS = {
+    "fan-in": lambda i: (PHONES[MERCHANTS + i % (ACCOUNTS - MERCHANTS)], PHONES[i % MERCHANTS], 1),
+    "hot pair": lambda i: (PHONES[i % 2], PHONES[1 - i % 2], 1),
+    "spread": lambda i: (PHONES[i % ACCOUNTS], PHONES[(i * 7 + 1) % ACCOUNTS], 1),
+}
+
+
+def reset_accounts(create=True):
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM transactions WHERE from_phone = ANY(:p) OR to_phone = ANY(:p)"), {"p": PHONES})
+        conn.execute(text("DELETE FROM users WHERE phone_number = ANY(:p)"), {"p": PHONES})
+        for phone in PHONES if create else []:
+            conn.execute(
+                text("INSERT INTO users (phone_number, username, password_hash, balance) VALUES (:p, 'bench', '', :b)"),
+                {"p": phone, "b": Decimal("100000000.00")}
+            )
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def timed(fn, *args):
+    db = SessionLocal()
+    try:
+        started = time.perf_counter()
+        ok, result = fn(db, *args)
+        elapsed = time.perf_counter() - started
+    finally:
+        db.close()
+    if not ok:
+        raise RuntimeError(result)
+    return elapsed
+
+
+def bench_workload(name):
+    print(f"=== {name} ({OPERATIONS} transfers, {THREADS} threads, compacting every {LEDGER_COMPACT_INTERVAL}s) ===")
+    for label, transfer in TRANSFERS.items():
+        reset_accounts()
+        # As in the app: debits read ledger_balance, which sums the entries since the last snapshot
+        compactor = LedgerCompactor(LEDGER_COMPACT_INTERVAL, LEDGER_REFRESH_BATCH_SIZE)
+        compactor.start()
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=THREADS) as pool:
+            samples = list(pool.map(lambda i: timed(transfer, *WORKLOADS[name](i)), range(OPERATIONS)))
+        elapsed = time.perf_counter() - started
+        compactor.stop()
+        ms = [s * 1000 for s in samples]
+        print(f"  {label:<22} {OPERATIONS / elapsed:8.1f} ops/s  p50={statistics.median(ms):6.2f}ms  p99={percentile(ms, 99):7.2f}ms")
+
+
+def bench_reads():
+    """ledger_balance of a merchant with the fan-in entries uncompacted, then compacted"""
+    merchant = PHONES[0]
+    print("=== ledger_balance reads ===")
+
+    def read_cost():
+        with engine.connect() as conn:
+            started = time.perf_counter()
+            for _ in range(READS):
+                conn.execute(crud.LEDGER_BALANCE_SQL, {"phone": merchant}).scalar_one()
+            return (time.perf_counter() - started) / READS * 1000
+
+    with engine.connect() as conn:
+        entries = conn.execute(text("SELECT count(*) FROM ledger_entries WHERE account = :p"), {"p": merchant}).scalar()
+    print(f"  {'uncompacted':<22} {read_cost():6.3f}ms per read over {entries} entries")
+    with engine.connect() as conn:
+        started = time.perf_counter()
+        accounts = crud.compact_ledger(conn)
+        conn.commit()
+        compacted = time.perf_counter() - started
+        crud.refresh_user_balances(conn, accounts)
+        conn.commit()
+    print(f"  {'compaction':<22} {compacted * 1000:6.1f}ms for {len(accounts)} accounts")
+    print(f"  {'compacted':<22} {read_cost():6.3f}ms per read")
+
+
+if __name__ == "__main__":
+    for workload in sys.argv[1:] or list(WORKLOADS):
+        bench_workload(workload)
+    reset_accounts()
+    for i in range(OPERATIONS):
+        timed(crud.ledger_transfer_money, *WORKLOADS["fan-in"](i))
+    bench_reads()
+    reset_accounts(create=False)
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""Response serialization cost per endpoint, before and after orjson.
+
+Builds each endpoint's response from in-memory ORM objects (no database, no
+HTTP) two ways and checks they decode to the same JSON:
+  - before: the handler's hand-formatted dict, validated against the route's
+    response_model and encoded by FastAPI (serialize_response + JSONResponse),
+    as every handler did before responses.json_response
+  - after: the shared builders in app/responses.py encoded once by orjson
+
+Usage: DATABASE_URL=postgresql://postgres@localhost/telebirr python benchmarks/bench_serialization.py
+"""
+import json
+import os
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+from decimal import Decimal
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+load_dotenv()
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+from app import crud, models, responses, schemas
+
+REPEAT = 2000
+NOW = datetime(2026, 1, 1, 12, 0, 0, 123456)
+
+
+def user():
+    return models.User(phone_number="0911111111", username="Abebe", password_hash="", balance=Decimal("15230.50"))
+
+
+def equb_accounts(count):
+    return [models.EqubAccount(id=uuid.uuid4(), phone_number="0911111111", amount=Decimal("500.00") + i,
+                               deposit_date=NOW - timedelta(days=30), maturity_date=NOW + timedelta(days=i - count // 2),
+                               can_withdraw=False, is_active=True) for i in range(count)]
+
+
+def transactions(count):
+    return [models.Transaction(id=uuid.uuid4(), from_phone="0911111111", to_phone=f"09220000{i % 100:02d}",
+                               amount=Decimal(i % 500 + 1) / 4, transaction_type=models.TransactionType.TRANSFER,
+                               status=models.TransactionStatus.COMPLETED, created_at=NOW - timedelta(seconds=i))
+            for i in range(count)]
+
+
+def batch_result(count):
+    return crud.BatchTransferResult(Decimal("9000.00"), [
+        crud.BatchItemResult(i, f"09220{i:05d}", Decimal("12.50"), uuid.uuid4() if i % 10 else None,
+                             None if i % 10 else "Recipient not found") for i in range(count)])
+
+
+# Handler code as it was before the shared builders
+def legacy_balance(user, accounts):
+    return {
+        "success": True,
+        "balance": f"{user.balance:.2f}",
+        "equbAccounts": [{
+            "id": str(account.id),
+            "phoneNumber": account.phone_number,
+            "amount": f"{account.amount:.2f}",
+            "depositDate": account.deposit_date.isoformat(),
+            "maturityDate": account.maturity_date.isoformat(),
+            "canWithdraw": crud.equb_withdrawable(account),
+            "isActive": account.is_active
+        } for account in accounts]
+    }
+
+
+def legacy_history(page):
+    return {
+        "success": True,
+        "transactions": [{
+            "id": str(tx.id),
+            "fromPhone": tx.from_phone,
+            "toPhone": tx.to_phone,
+            "amount": f"{tx.amount:.2f}",
+            "transactionType": tx.transaction_type.value,
+            "status": tx.status.value,
+            "createdAt": tx.created_at.isoformat()
+        } for tx in page.transactions],
+        "nextCursor": page.next_cursor
+    }
+
+
+def legacy_batch(result):
+    items = [{
+        "index": item.index,
+        "recipientPhone": item.to_phone,
+        "amount": f"{item.amount:.2f}",
+        "status": "FAILED" if item.error else "COMPLETED",
+        "transactionId": str(item.transaction_id) if item.transaction_id else None,
+        "error": item.error
+    } for item in result.items]
+    failed = sum(1 for item in result.items if item.error)
+    return {"success": failed == 0, "message": "Batch processed", "completed": len(items) - failed,
+            "failed": failed, "newBalance": f"{result.new_balance:.2f}", "results": items}
+
+
+def legacy_transaction(result):
+    return {"success": True, "message": "Money sent successfully",
+            "transactionId": str(result.id), "newBalance": f"{result.new_balance:.2f}"}
+
+
+RESPONSE_FIELDS = {}
+
+
+def fastapi_encode(content, model):
+    # What FastAPI does with a returned dict: validate against response_model
+    # (if any), jsonable_encoder, then JSONResponse's json.dumps
+    if model and model not in RESPONSE_FIELDS:
+        RESPONSE_FIELDS[model] = create_response_field(name="response", type_=model)
+    coroutine = serialize_response(field=RESPONSE_FIELDS.get(model), response_content=content, is_coroutine=True)
+    try:
+        coroutine.send(None)  # never suspends with is_coroutine=True; skips event loop overhead
+    except StopIteration as done:
+        return JSONResponse(done.value).body
+
+
+def per_call_us(fn):
+    fn()
+    started = time.perf_counter()
+    for _ in range(REPEAT):
+        fn()
+    return (time.perf_counter() - started) / REPEAT * 1e6
+
+
+def compare(label, before, after):
+    assert json.loads(before()) == json.loads(after()), label
+    before_us, after_us = per_call_us(before), per_call_us(after)
+    print(f"  {label:<36} {before_us:9.1f}us {after_us:9.1f}us  {before_us / after_us:5.1f}x")
+
+
+if __name__ == "__main__":
+    the_user = user()
+    accounts = equb_accounts(20)
+    print(f"=== per response, mean of {REPEAT} ===")
+    print(f"  {'endpoint':<36} {'before':>11} {'after':>11}")
+
+    compare("/user/balance (20 equb accounts)",
+            lambda: fastapi_encode(legacy_balance(the_user, accounts), schemas.BalanceResponse),
+            lambda: responses.balance_snapshot(the_user, accounts)[0])
+    for size in (crud.TRANSACTION_PAGE_SIZE, crud.MAX_TRANSACTION_PAGE_SIZE):
+        page = crud.TransactionPage(transactions(size), "cursor")
+        compare(f"/user/transactions ({size} rows)",
+                lambda: fastapi_encode(legacy_history(page), None),
+                lambda: responses.json_response(responses.transaction_history_response(page)).body)
+    result = batch_result(1000)
+    compare("/transactions/batch-send (1000 items)",
+            lambda: fastapi_encode(legacy_batch(result), schemas.BatchTransferResponse),
+            lambda: responses.json_response(responses.batch_transfer_response(result)).body)
+    transfer = crud.TransferResult(uuid.uuid4(), Decimal("989.50"))
+    compare("/transactions/send-money",
+            lambda: fastapi_encode(legacy_transaction(transfer), schemas.TransactionResponse),
+            lambda: responses.json_response(responses.transaction_response("Money sent successfully", transfer)).body)
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""Page latency of /user/transactions history as a user's history grows.
+
+Gives one user ROWS transactions (half sent, half received, plus equb rows
+to themselves) and times fetching a page at several depths with the keyset
+query in crud.get_user_transactions. For comparison it also times the old
+OR query for the first page and an OFFSET query at the same depths.
+
+Calls crud directly (no HTTP) against the database in DATABASE_URL, which
+must have schema.sql loaded. Use a local Postgres; the benchmark creates and
+deletes its own 09970000xx users and their rows.
+
+Usage: DATABASE_URL=postgresql://postgres@localhost/telebirr python benchmarks/bench_transaction_pages.py [ROWS]
+"""
+import os
+import sys
+import time
+import statistics
+from sqlalchemy import text
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+load_dotenv()
+
+from app import crud, models
+from app.database import engine, SessionLocal
+
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+REPEAT = 20
+USER = "0997000000"
+PEERS = [f"09970000{i:02d}" for i in range(1, 21)]
+PHONES = [USER] + PEERS
+
+
+def reset(create=True):
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM transactions WHERE from_phone = ANY(:p) OR to_phone = ANY(:p)"), {"p": PHONES})
+        conn.execute(text("DELETE FROM users WHERE phone_number = ANY(:p)"), {"p": PHONES})
+        if not create:
+            return
+        for phone in PHONES:
+            conn.execute(text("INSERT INTO users (phone_number, username, password_hash, balance) VALUES (:p, 'bench', '', 0)"), {"p": phone})
+        # One row a second going back in time; every 10th is an equb row to oneself
+        conn.execute(text("""
+            INSERT INTO transactions (from_phone, to_phone, amount, transaction_type, status, created_at)
+            SELECT CASE WHEN n % 10 = 0 OR n % 2 = 0 THEN :user ELSE (:peers)[1 + n % 20] END,
+                   CASE WHEN n % 10 = 0 OR n % 2 = 1 THEN :user ELSE (:peers)[1 + n % 20] END,
+                   1 + n % 500,
+                   (CASE WHEN n % 10 = 0 THEN 'EQUB_DEPOSIT' ELSE 'TRANSFER' END)::transaction_type,
+                   'COMPLETED',
+                   TIMESTAMP '2026-01-01' - n * INTERVAL '1 second'
+            FROM generate_series(1, :rows) AS n
+        """), {"user": USER, "peers": PEERS, "rows": ROWS})
+    with engine.connect() as conn:
+        conn.execution_options(isolation_level="AUTOCOMMIT").execute(text("VACUUM ANALYZE transactions"))
+
+
+def cursor_at(depth):
+    """Cursor of the row just before `depth` (setup only, not timed)"""
+    if depth == 0:
+        return None
+    with engine.connect() as conn:
+        row = conn.execute(text("""
+            SELECT created_at, id FROM transactions WHERE from_phone = :p OR to_phone = :p
+            ORDER BY created_at DESC, id DESC OFFSET :o LIMIT 1
+        """), {"p": USER, "o": depth - 1}).one()
+    return crud.encode_transaction_cursor(row)
+
+
+def median_ms(fn):
+    samples = []
+    db = SessionLocal()
+    try:
+        for _ in range(REPEAT):
+            started = time.perf_counter()
+            fn(db)
+            samples.append((time.perf_counter() - started) * 1000)
+    finally:
+        db.close()
+    return statistics.median(samples)
+
+
+def legacy_page(db, offset):
+    return db.query(models.Transaction).filter(
+        (models.Transaction.from_phone == USER) | (models.Transaction.to_phone == USER)
+    ).order_by(models.Transaction.created_at.desc()).offset(offset).limit(crud.TRANSACTION_PAGE_SIZE).all()
+
+
+if __name__ == "__main__":
+    print(f"Loading {ROWS} transactions for {USER}...")
+    reset()
+    print(f"=== page of {crud.TRANSACTION_PAGE_SIZE}, median of {REPEAT} ===")
+    print(f"  {'depth':>9}  {'keyset':>10}  {'OR + OFFSET':>12}")
+    for depth in (0, 1_000, 100_000, ROWS // 2, ROWS - crud.TRANSACTION_PAGE_SIZE):
+        cursor = cursor_at(depth)
+        keyset = median_ms(lambda db: crud.get_user_transactions(db, USER, cursor))
+        legacy = median_ms(lambda db: legacy_page(db, depth))
+        print(f"  {depth:>9}  {keyset:8.2f}ms  {legacy:10.2f}ms")
+    reset(create=False)
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""Single transfers: one COMMIT each vs group commits through the pipeline.
+
+Runs the same random transfers between many accounts with crud.transfer_money
+called from every thread (one transaction and fsync per transfer), then
+through app.transfer_pipeline with several group sizes and delays. Reports
+transfers/s, COMMITs/s, the latency the callers saw (including the wait for
+their group) and the average group size.
+
+Calls the crud functions directly (no HTTP) against the database in
+DATABASE_URL, which must have schema.sql loaded. Use a local Postgres with
+the default synchronous_commit=on, or there is no fsync to share; the
+benchmark creates and deletes its own 09910000xx users.
+
+Usage: DATABASE_URL=postgresql://postgres@localhost/telebirr python benchmarks/bench_transfer_pipeline.py [threads ...]
+"""
+import os
+import sys
+import time
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from sqlalchemy import text
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+load_dotenv()
+
+from app import crud
+from app.database import engine, SessionLocal
+from app.transfer_pipeline import TransferPipeline
+
+ACCOUNTS = 100
+OPERATIONS = 4000
+THREAD_COUNTS = [16, 64]
+# (max group size, max delay in ms)
+PIPELINES = [(16, 0), (64, 0), (64, 2), (256, 5)]
+PHONES = [f"09910000{i:02d}" for i in range(ACCOUNTS)]
+
+
+def reset_accounts(create=True):
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM transactions WHERE from_phone = ANY(:p) OR to_phone = ANY(:p)"), {"p": PHONES})
+        conn.execute(text("DELETE FROM users WHERE phone_number = ANY(:p)"), {"p": PHONES})
+        for phone in PHONES if create else []:
+            conn.execute(
+                text("INSERT INTO users (phone_number, username, password_hash, balance) VALUES (:p, 'bench', '', :b)"),
+                {"p": phone, "b": Decimal("100000000.00")}
+            )
+
+
+def commits():
+    with engine.connect() as conn:
+        return conn.execute(text("SELECT xact_commit FROM pg_stat_database WHERE datname = current_database()")).scalar()
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def job(i):
+    return PHONES[i % ACCOUNTS], PHONES[(i * 7 + 1) % ACCOUNTS], 1
+
+
+def timed(transfer, i):
+    db = SessionLocal()
+    try:
+        started = time.perf_counter()
+        ok, result = transfer(db, *job(i))
+        elapsed = time.perf_counter() - started
+    finally:
+        db.close()
+    if not ok:
+        raise RuntimeError(result)
+    return elapsed
+
+
+def bench(label, transfer, threads, pipeline=None):
+    reset_accounts()
+    committed = commits()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        samples = list(pool.map(lambda i: timed(transfer, i), range(OPERATIONS)))
+    elapsed = time.perf_counter() - started
+    # pg_stat_database is flushed by each backend about once a second
+    time.sleep(1.1)
+    committed = commits() - committed
+    ms = [s * 1000 for s in samples]
+    groups = f"  avg group={OPERATIONS / pipeline.counters['groups']:5.1f}" if pipeline else ""
+    print(f"  {label:<26} {OPERATIONS / elapsed:8.1f} transfers/s {committed / elapsed:8.1f} commits/s  "
+          f"p50={statistics.median(ms):6.2f}ms  p99={percentile(ms, 99):7.2f}ms{groups}")
+
+
+if __name__ == "__main__":
+    for threads in [int(arg) for arg in sys.argv[1:]] or THREAD_COUNTS:
+        print(f"=== {OPERATIONS} transfers between {ACCOUNTS} accounts, {threads} threads ===")
+        bench("transfer_money", crud.transfer_money, threads)
+        for size, delay in PIPELINES:
+            pipeline = TransferPipeline(size, delay / 1000)
+            pipeline.start()
+            bench(f"pipeline size={size} delay={delay}ms", pipeline.transfer, threads, pipeline)
+            pipeline.stop()
+    reset_accounts(create=False)
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""Request validation throughput of app/schemas.py, before and after the
+move to annotated types checked in pydantic-core.
+
+Validates the same request bodies (dicts, as FastAPI passes them) with the
+current models and with copies of the previous @validator / constr models,
+and checks both accept and reject the same inputs.
+
+Usage: DATABASE_URL=postgresql://postgres@localhost/telebirr python benchmarks/bench_validation.py
+"""
+import os
+import re
+import sys
+import time
+import uuid
+import warnings
+from typing import List
+from dotenv import load_dotenv
+from pydantic import BaseModel, ValidationError, PydanticDeprecatedSince20, constr, PositiveFloat, validator
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+load_dotenv()
+
+from app import schemas
+
+REPEAT = 20000
+BATCH_ITEMS = 1000
+
+warnings.filterwarnings("ignore", category=PydanticDeprecatedSince20)  # the legacy models below
+
+
+# The request models as they were before the annotated types
+class LegacySignupRequest(BaseModel):
+    phoneNumber: constr(min_length=10, max_length=10)
+    username: constr(min_length=2, max_length=50)
+    password: constr(min_length=6, max_length=6)
+
+    @validator('phoneNumber')
+    def validate_phone(cls, v):
+        if not re.match(r'^09[0-9]{8}$', v):
+            raise ValueError('Phone number must be in format 09XXXXXXXX')
+        return v
+
+    @validator('password')
+    def validate_password(cls, v):
+        if not re.match(r'^[a-zA-Z0-9]{6}$', v):
+            raise ValueError('Password must be exactly 6 alphanumeric characters')
+        return v
+
+
+class LegacyLoginRequest(BaseModel):
+    phoneNumber: constr(min_length=10, max_length=10)
+    password: constr(min_length=6, max_length=6)
+
+    @validator('phoneNumber')
+    def validate_phone(cls, v):
+        if not re.match(r'^09[0-9]{8}$', v):
+            raise ValueError('Phone number must be in format 09XXXXXXXX')
+        return v
+
+
+class LegacySendMoneyRequest(BaseModel):
+    senderPhone: constr(min_length=10, max_length=10)
+    recipientPhone: constr(min_length=10, max_length=10)
+    amount: PositiveFloat
+
+    @validator('senderPhone', 'recipientPhone')
+    def validate_phone(cls, v):
+        if not re.match(r'^09[0-9]{8}$', v):
+            raise ValueError('Phone number must be in format 09XXXXXXXX')
+        return v
+
+    @validator('amount')
+    def validate_amount(cls, v):
+        if v > 100000:
+            raise ValueError('Maximum transfer amount is 100,000 Birr')
+        if v < 1:
+            raise ValueError('Minimum transfer amount is 1 Birr')
+        return v
+
+
+class LegacyBatchTransferItem(BaseModel):
+    recipientPhone: constr(min_length=10, max_length=10)
+    amount: PositiveFloat
+
+    @validator('recipientPhone')
+    def validate_recipient_phone(cls, v):
+        if not re.match(r'^09[0-9]{8}$', v):
+            raise ValueError('Recipient phone number must be in format 09XXXXXXXX')
+        return v
+
+    @validator('amount')
+    def validate_amount(cls, v):
+        if v > 100000:
+            raise ValueError('Maximum transfer amount is 100,000 Birr')
+        if v < 1:
+            raise ValueError('Minimum transfer amount is 1 Birr')
+        return v
+
+
+class LegacyBatchTransferRequest(BaseModel):
+    senderPhone: constr(min_length=10, max_length=10)
+    transfers: List[LegacyBatchTransferItem]
+
+    @validator('senderPhone')
+    def validate_sender_phone(cls, v):
+        if not re.match(r'^09[0-9]{8}$', v):
+            raise ValueError('Sender phone number must be in format 09XXXXXXXX')
+        return v
+
+    @validator('transfers')
+    def validate_transfers(cls, v):
+        if not v:
+            raise ValueError('At least one transfer is required')
+        if len(v) > schemas.MAX_BATCH_TRANSFER_ITEMS:
+            raise ValueError(f'Maximum {schemas.MAX_BATCH_TRANSFER_ITEMS} transfers per batch')
+        return v
+
+
+class LegacyEqubDepositRequest(BaseModel):
+    phoneNumber: constr(min_length=10, max_length=10)
+    amount: PositiveFloat
+    durationMonths: int = 1
+
+    @validator('phoneNumber')
+    def validate_phone(cls, v):
+        if not re.match(r'^09[0-9]{8}$', v):
+            raise ValueError('Phone number must be in format 09XXXXXXXX')
+        return v
+
+    @validator('amount')
+    def validate_amount(cls, v):
+        if v < 500:
+            raise ValueError('Minimum equb deposit is 500 Birr')
+        if v > 50000:
+            raise ValueError('Maximum equb deposit is 50,000 Birr')
+        return v
+
+    @validator('durationMonths')
+    def validate_duration(cls, v):
+        if v != 1:
+            raise ValueError('Equb duration must be exactly 1 month')
+        return v
+
+
+class LegacyEqubWithdrawRequest(BaseModel):
+    phoneNumber: constr(min_length=10, max_length=10)
+    equbAccountId: str
+
+    @validator('phoneNumber')
+    def validate_phone(cls, v):
+        if not re.match(r'^09[0-9]{8}$', v):
+            raise ValueError('Phone number must be in format 09XXXXXXXX')
+        return v
+
+    @validator('equbAccountId')
+    def validate_uuid(cls, v):
+        try:
+            uuid.UUID(v)
+        except ValueError:
+            raise ValueError('Invalid equb account ID format')
+        return v
+
+
+# (label, legacy model, current model, valid body, invalid bodies)
+CASES = [
+    ("SignupRequest", LegacySignupRequest, schemas.SignupRequest,
+     {"phoneNumber": "0911111111", "username": "Abebe", "password": "abc123"},
+     [{"phoneNumber": "0811111111", "username": "Abebe", "password": "abc123"},
+      {"phoneNumber": "0911111111", "username": "Abebe", "password": "abc_12"}]),
+    ("LoginRequest", LegacyLoginRequest, schemas.LoginRequest,
+     {"phoneNumber": "0911111111", "password": "abc123"},
+     [{"phoneNumber": "091111111", "password": "abc123"}]),
+    ("SendMoneyRequest", LegacySendMoneyRequest, schemas.SendMoneyRequest,
+     {"senderPhone": "0911111111", "recipientPhone": "0922222222", "amount": 150.25},
+     [{"senderPhone": "0911111111", "recipientPhone": "0922222222", "amount": 100000.5},
+      {"senderPhone": "0911111111", "recipientPhone": "0922222222", "amount": 0.5},
+      {"senderPhone": "0911111111", "recipientPhone": "0922222222", "amount": "inf"}]),
+    ("EqubDepositRequest", LegacyEqubDepositRequest, schemas.EqubDepositRequest,
+     {"phoneNumber": "0911111111", "amount": 500, "durationMonths": 1},
+     [{"phoneNumber": "0911111111", "amount": 499.99}, {"phoneNumber": "0911111111", "amount": 500, "durationMonths": 2}]),
+    ("EqubWithdrawRequest", LegacyEqubWithdrawRequest, schemas.EqubWithdrawRequest,
+     {"phoneNumber": "0911111111", "equbAccountId": str(uuid.uuid4())},
+     [{"phoneNumber": "0911111111", "equbAccountId": "not-a-uuid"}]),
+    (f"BatchTransferRequest ({BATCH_ITEMS} items)", LegacyBatchTransferRequest, schemas.BatchTransferRequest,
+     {"senderPhone": "0911111111",
+      "transfers": [{"recipientPhone": f"0922{i:06d}", "amount": 10 + i % 90} for i in range(BATCH_ITEMS)]},
+     [{"senderPhone": "0911111111", "transfers": []}]),
+]
+
+
+def accepts(model, body):
+    try:
+        model.model_validate(body)
+        return True
+    except ValidationError:
+        return False
+
+
+def per_second(model, body, repeat):
+    validate = model.model_validate
+    started = time.perf_counter()
+    for _ in range(repeat):
+        validate(body)
+    return repeat / (time.perf_counter() - started)
+
+
+if __name__ == "__main__":
+    print("=== validations per second (valid bodies) ===")
+    print(f"  {'model':<36} {'before':>11} {'after':>11}")
+    for label, legacy, current, valid, invalid in CASES:
+        for body in [valid] + invalid:
+            assert accepts(legacy, body) == accepts(current, body), (label, body)
+        repeat = max(20, REPEAT // len(valid.get("transfers", [None])))
+        before, after = per_second(legacy, valid, repeat), per_second(current, valid, repeat)
+        print(f"  {label:<36} {before:9.0f}/s {after:9.0f}/s  {after / before:5.1f}x")
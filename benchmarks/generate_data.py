@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""Bulk-load a production-sized synthetic dataset with COPY.
+
+Writes --users users, --transactions transfers and --equb equb accounts
+(each with its EQUB_DEPOSIT row, and an EQUB_WITHDRAWAL row once withdrawn)
+shaped like real traffic:
+  - senders follow a power law: rank = users * u**3, so the most active 1%
+    of users send about a fifth of all transfers
+  - the first --merchants users are merchant hot accounts that receive
+    MERCHANT_SHARE of all transfers, themselves skewed towards a few
+  - amounts and balances are log-normal, balances scaled up for the most
+    active senders; they are drawn on their own, not summed from the history
+  - equb deposits are spread over the last --days days and mature a month
+    later, so some are pending, some await the scheduler, some are
+    withdrawable and most matured ones are withdrawn
+  - transfers are spread uniformly over the last --days days; a few are
+    FAILED or PENDING
+
+Everything is loaded in one transaction with the NOTIFY trigger on
+transactions switched off, then analyzed. All users have the password
+PASSWORD, hashed at BCRYPT_ROUNDS. Phone numbers are --prefix followed by
+the user number; earlier rows with that prefix are deleted first (--drop
+deletes them and stops).
+
+--trace also writes a request trace for benchmarks/replay.py against this
+data: Poisson arrivals at --trace-rps with the same sender and merchant
+skew, mostly balance polls and history pages, then transfers.
+
+Usage: DATABASE_URL=postgresql://postgres@localhost/telebirr python benchmarks/generate_data.py \\
+           [--users 1000000] [--transactions 5000000] [--equb 200000] [--trace trace.ndjson]
+"""
+import argparse
+import io
+import json
+import os
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+from sqlalchemy import text
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+load_dotenv()
+
+from app.database import engine
+from app.hashing import get_password_hash
+
+PASSWORD = "synth1"
+SENDER_SKEW = 3
+MERCHANT_SHARE = 0.3
+EQUB_MONTH = timedelta(days=30)
+COPY_ROWS = 100_000  # rows per COPY chunk
+
+# Trace mix: (weight, request kind)
+TRACE_MIX = [(45, "balance"), (20, "history"), (20, "send"), (7, "check"), (5, "login"), (2, "equb_deposit"), (1, "equb_withdraw")]
+
+
+class Dataset:
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.now = datetime.utcnow().replace(microsecond=0)
+        self.digits = 10 - len(args.prefix)
+        self.withdrawable = []  # (equb id, owner) sample for the trace
+
+    def phone(self, n):
+        return f"{self.args.prefix}{n:0{self.digits}d}"
+
+    def sender(self):
+        merchants = self.args.merchants
+        return merchants + int((self.args.users - merchants) * self.rng.random() ** SENDER_SKEW)
+
+    def recipient(self, sender):
+        if self.rng.random() < MERCHANT_SHARE:
+            return int(self.args.merchants * self.rng.random() ** SENDER_SKEW)
+        recipient = sender
+        while recipient == sender:
+            recipient = self.rng.randrange(self.args.merchants, self.args.users)
+        return recipient
+
+    def amount(self, median, low, high):
+        return min(high, max(low, round(self.rng.lognormvariate(0, 1.2) * median, 2)))
+
+    def moment(self):
+        return self.now - timedelta(seconds=self.rng.random() * self.args.days * 86400)
+
+    def users(self, password_hash):
+        for n in range(self.args.users):
+            merchant = n < self.args.merchants
+            if merchant:
+                balance = self.amount(200_000, 0, 10**9)
+            else:
+                # Scaled by how often this rank sends relative to the average user
+                rank = (n - self.args.merchants + 1) / (self.args.users - self.args.merchants)
+                balance = self.amount(1500, 0, 10**9) * max(1, rank ** (1 / SENDER_SKEW - 1) / SENDER_SKEW)
+            created = self.now - timedelta(days=self.args.days + self.rng.random() * 365)
+            yield (self.phone(n), f"{'Merchant' if merchant else 'User'} {n}", password_hash, f"{balance:.2f}", created)
+
+    def equb_accounts(self):
+        self.equb_rows = []
+        for _ in range(self.args.equb):
+            account_id, owner = uuid.uuid4(), self.phone(self.sender())
+            amount, deposited = self.amount(2000, 500, 50000), self.moment()
+            matures = deposited + EQUB_MONTH
+            matured, roll = matures <= self.now, self.rng.random()
+            withdrawn = matured and roll < 0.7
+            can_withdraw = matured and roll < 0.9  # the rest is waiting for the maturity scheduler
+            if matured and not withdrawn and len(self.withdrawable) < 10000:
+                self.withdrawable.append((str(account_id), owner))
+            self.equb_rows.append((account_id, owner, amount, deposited, matures, withdrawn))
+            yield (account_id, owner, f"{amount:.2f}", deposited, matures, can_withdraw, not withdrawn, deposited)
+
+    def transactions(self):
+        statuses = ["COMPLETED"] * 197 + ["FAILED"] * 2 + ["PENDING"]
+        for _ in range(self.args.transactions):
+            sender = self.sender()
+            yield (self.phone(sender), self.phone(self.recipient(sender)), f"{self.amount(300, 1, 100000):.2f}",
+                   "TRANSFER", self.rng.choice(statuses), None, self.moment())
+        for account_id, owner, amount, deposited, matures, withdrawn in self.equb_rows:
+            yield (owner, owner, f"{amount:.2f}", "EQUB_DEPOSIT", "COMPLETED", account_id, deposited)
+            if withdrawn:
+                withdrawn_at = min(self.now, matures + timedelta(seconds=self.rng.random() * 7 * 86400))
+                yield (owner, owner, f"{amount:.2f}", "EQUB_WITHDRAWAL", "COMPLETED", account_id, withdrawn_at)
+
+    def trace(self, path):
+        kinds = [kind for weight, kind in TRACE_MIX for _ in range(weight)]
+        at = 0.0
+        with open(path, "w") as f:
+            for _ in range(self.args.trace_requests):
+                at += self.rng.expovariate(self.args.trace_rps)
+                sender = self.sender()
+                request = self.trace_request(self.rng.choice(kinds), sender)
+                f.write(json.dumps({"ts": round(at, 6), **request}) + "\n")
+
+    def trace_request(self, kind, sender):
+        phone = self.phone(sender)
+        if kind == "balance":
+            return {"method": "GET", "path": "/user/balance", "query": {"phoneNumber": phone}}
+        if kind == "history":
+            return {"method": "GET", "path": "/user/transactions", "query": {"phoneNumber": phone, "limit": 20}}
+        if kind == "send":
+            return {"method": "POST", "path": "/transactions/send-money",
+                    "json": {"senderPhone": phone, "recipientPhone": self.phone(self.recipient(sender)),
+                             "amount": self.amount(300, 1, 1000)}}
+        if kind == "check":
+            return {"method": "GET", "path": "/user/check-phone", "query": {"phoneNumber": self.phone(self.recipient(sender))}}
+        if kind == "login":
+            return {"method": "POST", "path": "/auth/login", "json": {"phoneNumber": phone, "password": PASSWORD}}
+        if kind == "equb_withdraw" and self.withdrawable:
+            account_id, owner = self.withdrawable.pop()
+            return {"method": "POST", "path": "/equb/withdraw", "json": {"phoneNumber": owner, "equbAccountId": account_id}}
+        return {"method": "POST", "path": "/equb/deposit",
+                "json": {"phoneNumber": phone, "amount": self.amount(800, 500, 5000), "durationMonths": 1}}
+
+
+def copy_rows(cursor, table, columns, rows):
+    """COPY rows (tuples, None for NULL) into table, COPY_ROWS at a time"""
+    count, buffer = 0, io.StringIO()
+    statement = f"COPY {table} ({', '.join(columns)}) FROM STDIN"
+    for row in rows:
+        buffer.write("\t".join("\\N" if value is None else str(value) for value in row))
+        buffer.write("\n")
+        count += 1
+        if count % COPY_ROWS == 0:
+            buffer.seek(0)
+            cursor.copy_expert(statement, buffer)
+            buffer = io.StringIO()
+    buffer.seek(0)
+    cursor.copy_expert(statement, buffer)
+    return count
+
+
+def drop(prefix):
+    pattern = {"pattern": prefix + "%"}
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM transactions WHERE from_phone LIKE :pattern OR to_phone LIKE :pattern"), pattern)
+    # equb_account_id has no index: each equb row deleted scans transactions
+    # for references, which is only quick once the dead rows are vacuumed
+    with engine.connect() as conn:
+        conn.execution_options(isolation_level="AUTOCOMMIT").execute(text("VACUUM transactions"))
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM equb_accounts WHERE phone_number LIKE :pattern"), pattern)
+        conn.execute(text("DELETE FROM users WHERE phone_number LIKE :pattern"), pattern)
+
+
+def load(dataset):
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        # Per-row pg_notify for millions of historical rows would only flood listeners
+        cursor.execute("ALTER TABLE transactions DISABLE TRIGGER transactions_completed_notify")
+        # Rebuilding the secondary indexes once is cheaper than maintaining them
+        # row by row; the definitions are read back so they match schema.sql
+        cursor.execute("""
+            SELECT indexname, indexdef FROM pg_indexes
+            WHERE tablename IN ('equb_accounts', 'transactions') AND indexname LIKE 'idx\\_%'
+        """)
+        indexes = cursor.fetchall()
+        for name, _ in indexes:
+            cursor.execute(f"DROP INDEX {name}")
+        for table, columns, rows in [
+            ("users", ("phone_number", "username", "password_hash", "balance", "created_at"),
+             dataset.users(get_password_hash(PASSWORD))),
+            ("equb_accounts", ("id", "phone_number", "amount", "deposit_date", "maturity_date", "can_withdraw", "is_active", "created_at"),
+             dataset.equb_accounts()),
+            ("transactions", ("from_phone", "to_phone", "amount", "transaction_type", "status", "equb_account_id", "created_at"),
+             dataset.transactions()),
+        ]:
+            started = time.perf_counter()
+            count = copy_rows(cursor, table, columns, rows)
+            print(f"  {table:<14} {count:>10} rows in {time.perf_counter() - started:6.1f}s")
+        started = time.perf_counter()
+        for _, definition in indexes:
+            cursor.execute(definition)
+        print(f"  {len(indexes)} indexes rebuilt in {time.perf_counter() - started:6.1f}s")
+        cursor.execute("ALTER TABLE transactions ENABLE TRIGGER transactions_completed_notify")
+        connection.commit()
+    finally:
+        connection.close()
+    with engine.connect() as conn:
+        conn.execution_options(isolation_level="AUTOCOMMIT").execute(text("VACUUM ANALYZE users, equb_accounts, transactions"))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Load a synthetic TeleBirr dataset")
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--transactions", type=int, default=5_000_000, help="transfers, besides the equb rows")
+    parser.add_argument("--equb", type=int, default=200_000, help="equb accounts")
+    parser.add_argument("--merchants", type=int, default=200, help="hot merchant accounts")
+    parser.add_argument("--days", type=int, default=90, help="history spread over this many days")
+    parser.add_argument("--prefix", default="096", help="phone number prefix of the generated users")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--drop", action="store_true", help="only delete the users with --prefix and their rows")
+    parser.add_argument("--trace", help="also write a request trace (NDJSON) for benchmarks/replay.py")
+    parser.add_argument("--trace-requests", type=int, default=100_000)
+    parser.add_argument("--trace-rps", type=float, default=500, help="mean request rate of the trace")
+    args = parser.parse_args()
+    if not (args.prefix.startswith("09") and args.prefix.isdigit() and len(args.prefix) < 10):
+        parser.error("--prefix must be digits starting with 09")
+    if args.users > 10 ** (10 - len(args.prefix)) or args.users <= args.merchants:
+        parser.error("--users must fit the --prefix and exceed --merchants")
+    return args
+
+
+def main():
+    args = parse_args()
+    drop(args.prefix)
+    if args.drop:
+        return
+    dataset = Dataset(args)
+    print(f"=== loading {args.users} users, {args.transactions} transfers, {args.equb} equb accounts ===")
+    load(dataset)
+    if args.trace:
+        dataset.trace(args.trace)
+        print(f"  trace: {args.trace_requests} requests over {args.trace_requests / args.trace_rps:.0f}s in {args.trace}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+"""Load test: concurrent scenarios against a running API, with per-endpoint
+throughput, p50/p95/p99 latency and error rates.
+
+Starts the app under gunicorn on a local port (or uses --url), seeds
+--users users directly in the database, then runs each scenario for
+--duration seconds with --concurrency client threads:
+
+  auth       signup of a new user followed by its login (bcrypt bound)
+  transfers  send-money between --hot accounts, so every transfer
+             contends for the same few row locks
+  balance    /user/balance polling with If-None-Match, as the app does
+  history    /user/transactions paged through nextCursor, --pages deep
+  mixed      balance 60%, history 25%, transfers 15% at once
+
+Results go to --out as JSON (commit, settings, and per scenario and
+endpoint: count, statuses, error rate, req/s, p50/p95/p99/max ms). Pass a
+previous file as --compare to print the change per endpoint.
+
+Uses the database in DATABASE_URL, which must have schema.sql loaded. Use a
+local Postgres; seeded users are 0993xxxxxx, signed-up ones 0994xxxxxx, and
+both are deleted afterwards (--keep to leave them).
+
+Usage: DATABASE_URL=postgresql://postgres@localhost/telebirr python benchmarks/loadtest.py \\
+           [--scenarios auth,transfers,balance,history,mixed] [--duration 20] [--concurrency 32] \\
+           [--workers 4] [--out loadtest.json] [--compare previous.json]
+"""
+import argparse
+import itertools
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+import requests
+from sqlalchemy import text
+from dotenv import load_dotenv
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+load_dotenv()
+
+from app.database import engine
+from app.hashing import get_password_hash
+
+SEEDED_PREFIX = "0993"
+SIGNUP_PREFIX = "0994"
+PASSWORD = "load12"
+SEEDED_HISTORY = 200  # transactions given to each history user
+
+
+def phone(prefix, n):
+    return f"{prefix}{n:06d}"
+
+
+class Recorder:
+    """Latencies and statuses per endpoint for one client thread"""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(Counter)
+
+    def call(self, session, label, method, url, started=None, **kwargs):
+        # started: when the request was due, if it may be sent late
+        started = started or time.perf_counter()
+        try:
+            response = session.request(method, url, timeout=60, **kwargs)
+            status = response.status_code
+        except requests.RequestException:
+            response, status = None, "connection error"
+        self.latencies[label].append(time.perf_counter() - started)
+        self.statuses[label][status] += 1
+        return response
+
+    def merge(self, other):
+        for label, samples in other.latencies.items():
+            self.latencies[label].extend(samples)
+            self.statuses[label].update(other.statuses[label])
+
+
+class LoadTest:
+    def __init__(self, args):
+        self.args = args
+        self.base_url = args.url
+        self.seeded = [phone(SEEDED_PREFIX, n) for n in range(args.users)]
+        self.hot = self.seeded[:args.hot]
+        self.history_users = self.seeded[:min(args.users, 100)]
+        self.signups = itertools.count()
+        self.etags = {}  # last ETag seen per user, shared by all clients
+
+    # Scenarios: one iteration each, recorded as "METHOD /path"
+    def auth(self, session, recorder, rng):
+        user = {"phoneNumber": phone(SIGNUP_PREFIX, next(self.signups)), "username": "Load Test", "password": PASSWORD}
+        recorder.call(session, "POST /auth/signup", "POST", f"{self.base_url}/auth/signup", json=user)
+        recorder.call(session, "POST /auth/login", "POST", f"{self.base_url}/auth/login",
+                      json={"phoneNumber": user["phoneNumber"], "password": PASSWORD})
+
+    def transfers(self, session, recorder, rng):
+        sender, recipient = rng.sample(self.hot, 2)
+        recorder.call(session, "POST /transactions/send-money", "POST", f"{self.base_url}/transactions/send-money",
+                      json={"senderPhone": sender, "recipientPhone": recipient, "amount": 1})
+
+    def balance(self, session, recorder, rng):
+        phone_number = rng.choice(self.seeded)
+        # Like the app: send back the last ETag seen for this user
+        etag = self.etags.get(phone_number)
+        headers = {"If-None-Match": etag} if etag else {}
+        response = recorder.call(session, "GET /user/balance", "GET", f"{self.base_url}/user/balance",
+                                 params={"phoneNumber": phone_number}, headers=headers)
+        if response is not None and "ETag" in response.headers:
+            self.etags[phone_number] = response.headers["ETag"]
+
+    def history(self, session, recorder, rng):
+        params = {"phoneNumber": rng.choice(self.history_users), "limit": 50}
+        for _ in range(self.args.pages):
+            response = recorder.call(session, "GET /user/transactions", "GET", f"{self.base_url}/user/transactions", params=params)
+            cursor = response.json().get("nextCursor") if response is not None and response.status_code == 200 else None
+            if not cursor:
+                break
+            params = {**params, "cursor": cursor}
+
+    def mixed(self, session, recorder, rng):
+        roll = rng.random()
+        if roll < 0.6:
+            self.balance(session, recorder, rng)
+        elif roll < 0.85:
+            self.history(session, recorder, rng)
+        else:
+            self.transfers(session, recorder, rng)
+
+    def run_scenario(self, name):
+        step = getattr(self, name)
+        deadline = time.perf_counter() + self.args.duration
+        recorders = []
+
+        def client(seed):
+            rng = random.Random(seed)
+            recorder = Recorder()
+            recorders.append(recorder)
+            with requests.Session() as session:
+                while time.perf_counter() < deadline:
+                    step(session, recorder, rng)
+
+        started = time.perf_counter()
+        threads = [threading.Thread(target=client, args=(seed,)) for seed in range(self.args.concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        total = Recorder()
+        for recorder in recorders:
+            total.merge(recorder)
+        return summarize(total, elapsed)
+
+    def seed(self):
+        password_hash = get_password_hash(PASSWORD)
+        with engine.begin() as conn:
+            conn.execute(text("""
+                INSERT INTO users (phone_number, username, password_hash, balance)
+                SELECT :prefix || lpad(n::text, 6, '0'), 'Load Test', :hash, 1000000000
+                FROM generate_series(0, :users - 1) AS n
+            """), {"prefix": SEEDED_PREFIX, "hash": password_hash, "users": self.args.users})
+            conn.execute(text("""
+                INSERT INTO transactions (from_phone, to_phone, amount, transaction_type, status, created_at)
+                SELECT u.phone_number, :peer, 1, 'TRANSFER', 'COMPLETED', now() - n * INTERVAL '1 minute'
+                FROM unnest(CAST(:users AS varchar[])) AS u(phone_number), generate_series(1, :rows) AS n
+            """), {"users": self.history_users, "peer": self.seeded[-1], "rows": SEEDED_HISTORY})
+        with engine.connect() as conn:
+            conn.execution_options(isolation_level="AUTOCOMMIT").execute(text("ANALYZE users; ANALYZE transactions"))
+
+    def cleanup(self):
+        patterns = {"seeded": SEEDED_PREFIX + "%", "signups": SIGNUP_PREFIX + "%"}
+        with engine.begin() as conn:
+            conn.execute(text("""
+                DELETE FROM transactions WHERE from_phone LIKE :seeded OR to_phone LIKE :seeded
+                                            OR from_phone LIKE :signups OR to_phone LIKE :signups
+            """), patterns)
+            conn.execute(text("DELETE FROM equb_accounts WHERE phone_number LIKE :seeded OR phone_number LIKE :signups"), patterns)
+            conn.execute(text("DELETE FROM users WHERE phone_number LIKE :seeded OR phone_number LIKE :signups"), patterns)
+
+
+def percentile(ordered, fraction):
+    # Nearest rank
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)] if ordered else None
+
+
+def summarize(recorder, elapsed):
+    endpoints = {}
+    for label, samples in sorted(recorder.latencies.items()):
+        ordered = sorted(samples)
+        statuses = recorder.statuses[label]
+        errors = sum(count for status, count in statuses.items() if not isinstance(status, int) or status >= 400)
+        endpoints[label] = {
+            "count": len(ordered),
+            "throughput": round(len(ordered) / elapsed, 1),
+            "errors": errors,
+            "errorRate": round(errors / len(ordered), 4),
+            "p50Ms": round(percentile(ordered, 0.50) * 1000, 2),
+            "p95Ms": round(percentile(ordered, 0.95) * 1000, 2),
+            "p99Ms": round(percentile(ordered, 0.99) * 1000, 2),
+            "maxMs": round(ordered[-1] * 1000, 2),
+            "statuses": {str(status): count for status, count in sorted(statuses.items(), key=str)},
+        }
+    count = sum(endpoint["count"] for endpoint in endpoints.values())
+    return {"seconds": round(elapsed, 2), "requests": count, "throughput": round(count / elapsed, 1), "endpoints": endpoints}
+
+
+def print_scenario(name, result, previous=None):
+    print(f"=== {name}: {result['requests']} requests, {result['throughput']} req/s ===")
+    print(f"  {'endpoint':<32} {'req/s':>8} {'p50':>9} {'p95':>9} {'p99':>9} {'errors':>8}")
+    for label, endpoint in result["endpoints"].items():
+        print(f"  {label:<32} {endpoint['throughput']:8.1f} {endpoint['p50Ms']:7.2f}ms {endpoint['p95Ms']:7.2f}ms "
+              f"{endpoint['p99Ms']:7.2f}ms {endpoint['errorRate']:7.2%}")
+        before = (previous or {}).get("endpoints", {}).get(label)
+        if before:
+            print(f"  {'  vs --compare':<32} {change(before['throughput'], endpoint['throughput']):>8} "
+                  f"{change(before['p50Ms'], endpoint['p50Ms']):>9} {change(before['p95Ms'], endpoint['p95Ms']):>9} "
+                  f"{change(before['p99Ms'], endpoint['p99Ms']):>9}")
+
+
+def change(before, after):
+    return f"{(after - before) / before:+.0%}" if before else "n/a"
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+
+def start_server(args):
+    env = {**os.environ, "RATE_LIMIT_ENABLED": "false", "WEB_CONCURRENCY": str(args.workers)}
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "app.main:app", "-k", "uvicorn.workers.UvicornWorker",
+         "-w", str(args.workers), "--bind", f"127.0.0.1:{args.port}"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            if requests.get(f"{args.url}/health", timeout=2).status_code == 200:
+                return server
+        except requests.RequestException:
+            pass
+        if server.poll() is not None:
+            break
+        time.sleep(0.5)
+    server.terminate()
+    raise SystemExit("Server did not become healthy")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Load test the TeleBirr API")
+    parser.add_argument("--scenarios", default="auth,transfers,balance,history,mixed")
+    parser.add_argument("--duration", type=float, default=20, help="seconds per scenario")
+    parser.add_argument("--concurrency", type=int, default=32, help="client threads")
+    parser.add_argument("--users", type=int, default=10000, help="users seeded before the run")
+    parser.add_argument("--hot", type=int, default=10, help="accounts the transfer storm runs between")
+    parser.add_argument("--pages", type=int, default=3, help="history pages followed per iteration")
+    parser.add_argument("--workers", type=int, default=4, help="gunicorn workers when starting the server")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--url", help="test this running server instead of starting one")
+    parser.add_argument("--out", default="loadtest.json")
+    parser.add_argument("--compare", help="results file of an earlier run")
+    parser.add_argument("--keep", action="store_true", help="leave the load-test users in the database")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    started_server = args.url is None
+    args.url = args.url or f"http://127.0.0.1:{args.port}"
+    previous = json.load(open(args.compare)) if args.compare else {}
+    test = LoadTest(args)
+    test.cleanup()
+    test.seed()
+    server = start_server(args) if started_server else None
+    try:
+        health = requests.get(f"{args.url}/health", timeout=10).json()
+        results = {
+            "startedAt": datetime.now(timezone.utc).isoformat(),
+            "commit": git_commit(),
+            "settings": {
+                **{key: value for key, value in vars(args).items() if key not in ("out", "compare", "keep")},
+                "dbMode": health.get("dbMode"), "crudMode": health.get("crudMode"),
+                "bcryptRounds": int(os.getenv("BCRYPT_ROUNDS", "12"))
+            },
+            "scenarios": {}
+        }
+        for name in args.scenarios.split(","):
+            results["scenarios"][name] = test.run_scenario(name)
+            print_scenario(name, results["scenarios"][name], previous.get("scenarios", {}).get(name))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        if not args.keep:
+            test.cleanup()
+
+    with open(args.out, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
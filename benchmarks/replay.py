@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""Replay a recorded request trace against the API.
+
+The trace is NDJSON, one request per line:
+  {"ts": 12.5, "method": "GET", "path": "/user/balance", "query": {"phoneNumber": "0960000001"}}
+  {"ts": 12.6, "method": "POST", "path": "/transactions/send-money", "json": {...}, "headers": {...}}
+ts is in seconds (epoch or relative, only the differences matter); query,
+json and headers are optional. benchmarks/generate_data.py --trace writes
+one for its synthetic users.
+
+Requests are sent at their recorded offsets divided by --speed (2 replays
+twice as fast; 0 sends them back to back) from up to --concurrency threads.
+Latency is counted from when a request was due, so a server falling behind
+shows up as latency instead of slowing the replay down. Reports and writes
+per-endpoint results like benchmarks/loadtest.py, and --compare diffs them
+with an earlier run.
+
+Usage: DATABASE_URL=postgresql://postgres@localhost/telebirr python benchmarks/replay.py TRACE \\
+           [--url http://localhost:8000] [--speed 1] [--concurrency 64] [--out replay.json] [--compare previous.json]
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import requests
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+load_dotenv()
+
+from loadtest import Recorder, summarize, print_scenario, git_commit
+
+
+class Replayer:
+    def __init__(self, args):
+        self.args = args
+        self.local = threading.local()
+        self.recorders = []
+        self.in_flight = threading.BoundedSemaphore(args.concurrency * 4)
+        self.max_lag = 0.0
+
+    def client(self):
+        # One session and recorder per pool thread
+        if not hasattr(self.local, "session"):
+            self.local.session, self.local.recorder = requests.Session(), Recorder()
+            self.recorders.append(self.local.recorder)
+        return self.local.session, self.local.recorder
+
+    def send(self, request, due):
+        try:
+            session, recorder = self.client()
+            if due is not None:
+                self.max_lag = max(self.max_lag, time.perf_counter() - due)
+            recorder.call(session, f"{request['method']} {request['path']}", request["method"],
+                          self.args.url + request["path"], started=due, params=request.get("query"),
+                          json=request.get("json"), headers=request.get("headers"))
+        finally:
+            self.in_flight.release()
+
+    def run(self, trace):
+        first, started = None, time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.args.concurrency) as pool:
+            for line in trace:
+                if not line.strip():
+                    continue
+                request = json.loads(line)
+                first = request["ts"] if first is None else first
+                due = None
+                if self.args.speed > 0:
+                    due = started + (request["ts"] - first) / self.args.speed
+                    delay = due - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                self.in_flight.acquire()
+                pool.submit(self.send, request, due)
+        elapsed = time.perf_counter() - started
+
+        total = Recorder()
+        for recorder in self.recorders:
+            total.merge(recorder)
+        return {**summarize(total, elapsed), "maxLagMs": round(self.max_lag * 1000, 2)}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Replay a request trace against the TeleBirr API")
+    parser.add_argument("trace", help="NDJSON request trace")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--speed", type=float, default=1, help="replay speed; 0 sends as fast as possible")
+    parser.add_argument("--concurrency", type=int, default=64, help="requests in flight at most")
+    parser.add_argument("--out", default="replay.json")
+    parser.add_argument("--compare", help="results file of an earlier replay")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    previous = json.load(open(args.compare)) if args.compare else {}
+    started_at = datetime.now(timezone.utc).isoformat()
+    with open(args.trace) as trace:
+        result = Replayer(args).run(trace)
+    print_scenario(f"replay of {args.trace} at {args.speed}x", result, previous.get("result"))
+    print(f"  dispatched at most {result['maxLagMs']:.1f}ms late")
+
+    settings = {key: value for key, value in vars(args).items() if key not in ("out", "compare")}
+    with open(args.out, "w") as f:
+        json.dump({"startedAt": started_at, "commit": git_commit(), "settings": settings, "result": result}, f, indent=2)
+    print(f"Results written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -10,6 +10,7 @@ CREATE TABLE users (
     username VARCHAR(100) NOT NULL,
     password_hash VARCHAR(255) NOT NULL,
     balance DECIMAL(15,2) DEFAULT 0.00 CHECK (balance >= 0),
+    credit_shards SMALLINT NOT NULL DEFAULT 0 CHECK (credit_shards BETWEEN 0 AND 64),  -- see balance_shards
     is_active BOOLEAN DEFAULT TRUE,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
@@ -75,8 +76,13 @@ CREATE INDEX idx_users_active ON users(is_active);
 CREATE INDEX idx_equb_phone ON equb_accounts(phone_number);
 CREATE INDEX idx_equb_active ON equb_accounts(is_active);
 CREATE INDEX idx_equb_maturity ON equb_accounts(maturity_date);
-CREATE INDEX idx_transactions_from ON transactions(from_phone);
-CREATE INDEX idx_transactions_to ON transactions(to_phone);
+-- Accounts still waiting for the maturity scheduler, oldest maturity first
+CREATE INDEX idx_equb_pending_maturity ON equb_accounts(maturity_date) WHERE can_withdraw = FALSE AND is_active = TRUE;
+-- Transaction history pages are read newest-first per side (crud.transaction_page_query).
+-- Existing databases: create these with CREATE INDEX CONCURRENTLY, then drop
+-- idx_transactions_from / idx_transactions_to, which they make redundant.
+CREATE INDEX idx_transactions_from_created ON transactions(from_phone, created_at, id);
+CREATE INDEX idx_transactions_to_created ON transactions(to_phone, created_at, id);
 CREATE INDEX idx_transactions_type ON transactions(transaction_type);
 CREATE INDEX idx_transactions_status ON transactions(status);
 CREATE INDEX idx_transactions_date ON transactions(created_at);
@@ -104,24 +110,61 @@ CREATE TRIGGER update_equb_updated_at BEFORE UPDATE ON equb_accounts
 CREATE TRIGGER update_transactions_updated_at BEFORE UPDATE ON transactions
     FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
 
--- Function to automatically enable equb withdrawals when mature
-CREATE OR REPLACE FUNCTION check_equb_maturity()
+-- Push events for GET /user/events (app/events.py). Every worker LISTENs on
+-- telebirr_events; Postgres delivers a NOTIFY only when the writing
+-- transaction commits, so rolled-back transfers never reach clients. Payloads
+-- are sent to clients as is. A balance event carries the new balance only for
+-- an unsharded account: a sharded one's total also depends on shard credits
+-- other transactions have not committed yet, so its events carry no amount
+-- and clients refetch /user/balance.
+CREATE OR REPLACE FUNCTION notify_balance_change()
 RETURNS TRIGGER AS $$
 BEGIN
-    UPDATE equb_accounts 
-    SET can_withdraw = TRUE 
-    WHERE maturity_date <= CURRENT_TIMESTAMP 
-    AND is_active = TRUE 
-    AND can_withdraw = FALSE;
+    PERFORM pg_notify('telebirr_events', json_strip_nulls(json_build_object(
+        'event', 'balance',
+        'phoneNumber', NEW.phone_number,
+        'balance', CASE WHEN NEW.credit_shards = 0 THEN NEW.balance::text END
+    ))::text);
     RETURN NULL;
 END;
-$$ LANGUAGE plpgsql;
+$$ language 'plpgsql';
+
+CREATE OR REPLACE FUNCTION notify_transaction_completed()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM pg_notify('telebirr_events', json_build_object(
+        'event', 'transaction',
+        'id', NEW.id::text,
+        'fromPhone', NEW.from_phone,
+        'toPhone', NEW.to_phone,
+        'amount', NEW.amount::text,
+        'transactionType', NEW.transaction_type,
+        'status', NEW.status,
+        'createdAt', to_char(NEW.created_at, 'YYYY-MM-DD"T"HH24:MI:SS.US')
+    )::text);
+    RETURN NULL;
+END;
+$$ language 'plpgsql';
+
+CREATE TRIGGER users_balance_notify AFTER UPDATE OF balance ON users
+    FOR EACH ROW WHEN (OLD.balance IS DISTINCT FROM NEW.balance)
+    EXECUTE FUNCTION notify_balance_change();
 
--- Trigger to check equb maturity on insert/update
-CREATE TRIGGER equb_maturity_check
-    AFTER INSERT OR UPDATE ON equb_accounts
-    FOR EACH STATEMENT
-    EXECUTE FUNCTION check_equb_maturity();
+CREATE TRIGGER transactions_completed_notify AFTER INSERT ON transactions
+    FOR EACH ROW WHEN (NEW.status = 'COMPLETED')
+    EXECUTE FUNCTION notify_transaction_completed();
+
+CREATE TRIGGER transactions_status_notify AFTER UPDATE OF status ON transactions
+    FOR EACH ROW WHEN (OLD.status IS DISTINCT FROM NEW.status AND NEW.status = 'COMPLETED')
+    EXECUTE FUNCTION notify_transaction_completed();
+
+-- Equb maturity: can_withdraw is flipped in batches by the application's
+-- maturity scheduler (app/scheduler.py), and reads derive it from maturity_date.
+-- The old statement-level trigger updated the whole table after every write to
+-- equb_accounts (and re-fired on its own UPDATE). On existing databases run:
+--   DROP TRIGGER IF EXISTS equb_maturity_check ON equb_accounts;
+--   DROP FUNCTION IF EXISTS check_equb_maturity();
+--   CREATE INDEX CONCURRENTLY idx_equb_pending_maturity ON equb_accounts(maturity_date) WHERE can_withdraw = FALSE AND is_active = TRUE;
 
 -- Function to validate Ethiopian phone numbers
 CREATE OR REPLACE FUNCTION validate_ethiopian_phone(phone VARCHAR(15))
@@ -150,11 +193,26 @@ CREATE OR REPLACE FUNCTION process_money_transfer(
 RETURNS JSONB AS $$
 DECLARE
     sender_balance DECIMAL(15,2);
+    recipient_shards SMALLINT;
+    recipient_shard SMALLINT;
     transaction_id UUID;
     result JSONB;
 BEGIN
     -- Start transaction
     BEGIN
+        SELECT credit_shards INTO recipient_shards
+        FROM users
+        WHERE phone_number = recipient_phone AND is_active = TRUE;
+        
+        -- Lock the sender, and the recipient unless its credits go to shards,
+        -- in phone-number order like TRANSFER_SQL: concurrent debits cannot
+        -- overdraw and opposite-direction transfers cannot deadlock
+        PERFORM 1 FROM users
+        WHERE phone_number = sender_phone
+           OR (phone_number = recipient_phone AND recipient_shards = 0)
+        ORDER BY phone_number
+        FOR NO KEY UPDATE;
+        
         -- Check sender balance
         SELECT balance INTO sender_balance 
         FROM users 
@@ -164,12 +222,16 @@ BEGIN
             RETURN jsonb_build_object('success', false, 'message', 'Sender not found');
         END IF;
         
+        IF sender_balance < transfer_amount THEN
+            sender_balance := sender_balance + consolidate_balance_shards(sender_phone);
+        END IF;
+        
         IF sender_balance < transfer_amount THEN
             RETURN jsonb_build_object('success', false, 'message', 'Insufficient balance');
         END IF;
         
         -- Check recipient exists
-        IF NOT EXISTS (SELECT 1 FROM users WHERE phone_number = recipient_phone AND is_active = TRUE) THEN
+        IF recipient_shards IS NULL THEN
             RETURN jsonb_build_object('success', false, 'message', 'Recipient not found');
         END IF;
         
@@ -180,10 +242,19 @@ BEGIN
         
         -- Update balances
         UPDATE users SET balance = balance - transfer_amount WHERE phone_number = sender_phone;
-        UPDATE users SET balance = balance + transfer_amount WHERE phone_number = recipient_phone;
+        IF recipient_shards > 0 THEN
+            recipient_shard := floor(random() * recipient_shards);
+            UPDATE balance_shards SET balance = balance + transfer_amount
+            WHERE phone_number = recipient_phone AND shard = recipient_shard;
+            IF NOT FOUND THEN
+                RAISE EXCEPTION 'balance shard % of % is missing', recipient_shard, recipient_phone;
+            END IF;
+        ELSE
+            UPDATE users SET balance = balance + transfer_amount WHERE phone_number = recipient_phone;
+        END IF;
         
         -- Get new sender balance
-        SELECT balance INTO sender_balance FROM users WHERE phone_number = sender_phone;
+        SELECT balance + shard_balance(sender_phone) INTO sender_balance FROM users WHERE phone_number = sender_phone;
         
         result := jsonb_build_object(
             'success', true,
@@ -212,6 +283,7 @@ RETURNS JSONB AS $$
 DECLARE
     user_balance DECIMAL(15,2);
     equb_id UUID;
+    equb_deposit_date TIMESTAMP;
     maturity_date TIMESTAMP;
     result JSONB;
 BEGIN
@@ -221,15 +293,20 @@ BEGIN
             RETURN jsonb_build_object('success', false, 'message', 'Minimum deposit is 500 Birr');
         END IF;
         
-        -- Check user balance
+        -- Check user balance, locked until the debit below
         SELECT balance INTO user_balance 
         FROM users 
-        WHERE phone_number = user_phone AND is_active = TRUE;
+        WHERE phone_number = user_phone AND is_active = TRUE
+        FOR NO KEY UPDATE;
         
         IF user_balance IS NULL THEN
             RETURN jsonb_build_object('success', false, 'message', 'User not found');
         END IF;
         
+        IF user_balance < deposit_amount THEN
+            user_balance := user_balance + consolidate_balance_shards(user_phone);
+        END IF;
+        
         IF user_balance < deposit_amount THEN
             RETURN jsonb_build_object('success', false, 'message', 'Insufficient balance');
         END IF;
@@ -240,7 +317,7 @@ BEGIN
         -- Create equb account
         INSERT INTO equb_accounts (phone_number, amount, maturity_date)
         VALUES (user_phone, deposit_amount, maturity_date)
-        RETURNING id INTO equb_id;
+        RETURNING id, deposit_date INTO equb_id, equb_deposit_date;
         
         -- Create transaction record
         INSERT INTO transactions (from_phone, amount, transaction_type, reference_id, equb_account_id, status)
@@ -250,12 +327,14 @@ BEGIN
         UPDATE users SET balance = balance - deposit_amount WHERE phone_number = user_phone;
         
         -- Get new balance
-        SELECT balance INTO user_balance FROM users WHERE phone_number = user_phone;
+        SELECT balance + shard_balance(user_phone) INTO user_balance FROM users WHERE phone_number = user_phone;
         
         result := jsonb_build_object(
             'success', true,
             'message', 'Equb deposit successful',
             'equb_id', equb_id,
+            'amount', deposit_amount,
+            'deposit_date', equb_deposit_date,
             'maturity_date', maturity_date,
             'new_balance', user_balance
         );
@@ -277,28 +356,33 @@ RETURNS JSONB AS $$
 DECLARE
     equb_amount DECIMAL(15,2);
     can_withdraw_flag BOOLEAN;
+    equb_maturity_date TIMESTAMP;
+    transaction_id UUID;
     user_balance DECIMAL(15,2);
     result JSONB;
 BEGIN
     BEGIN
-        -- Check equb account
-        SELECT amount, can_withdraw INTO equb_amount, can_withdraw_flag
+        -- Check equb account; locked, so a concurrent withdrawal of it waits
+        -- and then finds it inactive instead of paying it out again
+        SELECT amount, can_withdraw, maturity_date INTO equb_amount, can_withdraw_flag, equb_maturity_date
         FROM equb_accounts 
         WHERE id = equb_account_id 
         AND phone_number = user_phone 
-        AND is_active = TRUE;
+        AND is_active = TRUE
+        FOR UPDATE;
         
         IF equb_amount IS NULL THEN
             RETURN jsonb_build_object('success', false, 'message', 'Equb account not found');
         END IF;
         
-        IF NOT can_withdraw_flag THEN
+        IF NOT can_withdraw_flag AND equb_maturity_date > CURRENT_TIMESTAMP THEN
             RETURN jsonb_build_object('success', false, 'message', 'Equb not yet mature for withdrawal');
         END IF;
         
         -- Create transaction record
         INSERT INTO transactions (to_phone, amount, transaction_type, reference_id, equb_account_id, status)
-        VALUES (user_phone, equb_amount, 'EQUB_WITHDRAWAL', generate_transaction_ref(), equb_account_id, 'COMPLETED');
+        VALUES (user_phone, equb_amount, 'EQUB_WITHDRAWAL', generate_transaction_ref(), equb_account_id, 'COMPLETED')
+        RETURNING id INTO transaction_id;
         
         -- Update user balance
         UPDATE users SET balance = balance + equb_amount WHERE phone_number = user_phone;
@@ -307,11 +391,12 @@ BEGIN
         UPDATE equb_accounts SET is_active = FALSE WHERE id = equb_account_id;
         
         -- Get new balance
-        SELECT balance INTO user_balance FROM users WHERE phone_number = user_phone;
+        SELECT balance + shard_balance(user_phone) INTO user_balance FROM users WHERE phone_number = user_phone;
         
         result := jsonb_build_object(
             'success', true,
             'message', 'Equb withdrawal successful',
+            'transaction_id', transaction_id,
             'amount', equb_amount,
             'new_balance', user_balance
         );
@@ -324,6 +409,363 @@ BEGIN
 END;
 $$ LANGUAGE plpgsql;
 
+-- Sharded credits for hot accounts. A merchant paid by many customers at
+-- once serializes every transfer on its users row. With credit_shards = N
+-- (set_credit_shards), credits to it go to one of its N balance_shards rows
+-- at random and its users row is not locked; the balance is users.balance
+-- plus the shards (shard_balance). Debits still go to users.balance: when it
+-- does not cover one, consolidate_balance_shards moves the shards into it
+-- first. Shard rows are never deleted while the account exists, so a credit
+-- that read the old shard count always finds its row; rows above the current
+-- count are drained by the next consolidation.
+--
+-- Transfers lock users rows FOR NO KEY UPDATE so the FOR KEY SHARE locks that
+-- transactions' foreign keys take on a merchant row do not wait for its
+-- debits. Existing databases:
+--   ALTER TABLE users ADD COLUMN credit_shards SMALLINT NOT NULL DEFAULT 0 CHECK (credit_shards BETWEEN 0 AND 64);
+-- then create the table, functions and trigger below and re-create
+-- notify_balance_change above.
+CREATE TABLE balance_shards (
+    phone_number VARCHAR(15) NOT NULL REFERENCES users(phone_number) ON DELETE CASCADE,
+    shard SMALLINT NOT NULL,
+    balance DECIMAL(15,2) NOT NULL DEFAULT 0.00 CHECK (balance >= 0),
+    PRIMARY KEY (phone_number, shard)
+);
+
+CREATE OR REPLACE FUNCTION shard_balance(p_phone VARCHAR(15))
+RETURNS DECIMAL(15,2) AS $$
+    SELECT COALESCE(sum(balance), 0) FROM balance_shards WHERE phone_number = p_phone
+$$ LANGUAGE sql STABLE;
+
+-- Moves the account's shards into users.balance and returns the amount moved.
+-- Shards that a credit is writing right now are skipped rather than waited
+-- for: that credit may itself be waiting for this account's users row (the
+-- transactions foreign key), so waiting could deadlock. They are picked up
+-- by a later consolidation.
+CREATE OR REPLACE FUNCTION consolidate_balance_shards(p_phone VARCHAR(15))
+RETURNS DECIMAL(15,2) AS $$
+DECLARE
+    drained SMALLINT[];
+    moved DECIMAL(15,2);
+BEGIN
+    -- Same lock order as a debit: the users row first, then its shards
+    PERFORM 1 FROM users WHERE phone_number = p_phone FOR NO KEY UPDATE;
+
+    SELECT array_agg(shard), COALESCE(sum(balance), 0) INTO drained, moved
+    FROM (
+        SELECT shard, balance FROM balance_shards
+        WHERE phone_number = p_phone AND balance > 0
+        FOR UPDATE SKIP LOCKED
+    ) locked;
+
+    IF moved > 0 THEN
+        UPDATE balance_shards SET balance = 0 WHERE phone_number = p_phone AND shard = ANY(drained);
+        UPDATE users SET balance = balance + moved WHERE phone_number = p_phone;
+    END IF;
+    RETURN moved;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Enables (shards > 0), resizes or disables (0) sharded credits for one account
+CREATE OR REPLACE FUNCTION set_credit_shards(p_phone VARCHAR(15), shards INTEGER)
+RETURNS BOOLEAN AS $$
+BEGIN
+    UPDATE users SET credit_shards = shards WHERE phone_number = p_phone;
+    IF NOT FOUND THEN
+        RETURN FALSE;
+    END IF;
+
+    INSERT INTO balance_shards (phone_number, shard)
+    SELECT p_phone, generate_series(0, shards - 1)
+    ON CONFLICT DO NOTHING;
+
+    IF shards = 0 THEN
+        PERFORM consolidate_balance_shards(p_phone);
+    END IF;
+    RETURN TRUE;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Balance events for credits that land in a shard (draining one is not a
+-- change). They carry no amount, see notify_balance_change.
+CREATE OR REPLACE FUNCTION notify_shard_balance_change()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM pg_notify('telebirr_events', json_build_object(
+        'event', 'balance',
+        'phoneNumber', NEW.phone_number
+    )::text);
+    RETURN NULL;
+END;
+$$ language 'plpgsql';
+
+CREATE TRIGGER balance_shards_notify AFTER UPDATE OF balance ON balance_shards
+    FOR EACH ROW WHEN (NEW.balance > OLD.balance)
+    EXECUTE FUNCTION notify_shard_balance_change();
+
+-- Double-entry ledger (CRUD_MODE=ledger). Every transfer, equb deposit and
+-- equb withdrawal appends entries that sum to zero per transaction_id: the
+-- debited account gets a negative amount, the credited one a positive amount.
+-- Equb deposits are held by the system account 'equb'. A balance is the
+-- account's snapshot plus its entries from the snapshot's horizon on; the
+-- compactor (app/ledger.py) rolls entries into new snapshots and copies the
+-- result into users.balance, which is only a cache in this mode.
+--
+-- Entries carry the id of the transaction that wrote them. A snapshot with
+-- horizon H covers exactly the entries with txid < H: the compactor only
+-- uses horizons at or below the xmin of its own snapshot, and every
+-- transaction below that xmin has finished, so no entry can later appear
+-- under a horizon once it is taken.
+--
+-- Crediting an account appends rows and takes no lock on it. Debits of one
+-- account are serialized by a FOR NO KEY UPDATE lock on its users row, which
+-- does not conflict with the FOR KEY SHARE locks foreign keys take on it.
+--
+-- The triggers below open and close accounts in every CRUD_MODE, but only
+-- one side holds the balances: users.balance, or the ledger once
+-- set_ledger_mode(TRUE) has run. The app calls set_ledger_mode at startup
+-- for its CRUD_MODE, and a switch rebuilds the side it switches to. Stop
+-- the writers of the old mode before starting workers in the new one.
+-- Existing databases: create the tables, functions and triggers below.
+CREATE TABLE ledger_entries (
+    transaction_id UUID NOT NULL,
+    account VARCHAR(15) NOT NULL,       -- phone number, or the system account 'equb'
+    amount DECIMAL(15,2) NOT NULL CHECK (amount <> 0),
+    txid BIGINT NOT NULL DEFAULT txid_current(),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE balance_snapshots (
+    account VARCHAR(15) PRIMARY KEY,
+    balance DECIMAL(15,2) NOT NULL,
+    horizon BIGINT NOT NULL,            -- covers the account's entries with txid < horizon
+    taken_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX idx_ledger_account_txid ON ledger_entries(account, txid);
+-- Entries arrive in nearly increasing txid order; the compactor scans a txid range
+CREATE INDEX idx_ledger_txid ON ledger_entries USING brin(txid);
+CREATE INDEX idx_balance_snapshots_horizon ON balance_snapshots(horizon);
+
+CREATE OR REPLACE FUNCTION ledger_balance(p_account VARCHAR(15))
+RETURNS DECIMAL(15,2) AS $$
+    SELECT COALESCE(s.balance, 0) + COALESCE((
+        SELECT sum(e.amount) FROM ledger_entries e
+        WHERE e.account = p_account AND e.txid >= COALESCE(s.horizon, 0)
+    ), 0)
+    FROM (SELECT p_account AS account) a
+    LEFT JOIN balance_snapshots s ON s.account = a.account
+$$ LANGUAGE sql STABLE;
+
+-- New users open at the balance they were inserted with; deleting a user
+-- deletes its ledger, as it does its equb accounts
+CREATE OR REPLACE FUNCTION ledger_open_account()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO balance_snapshots (account, balance, horizon)
+    VALUES (NEW.phone_number, COALESCE(NEW.balance, 0), 0)
+    ON CONFLICT (account) DO NOTHING;
+    RETURN NULL;
+END;
+$$ language 'plpgsql';
+
+CREATE OR REPLACE FUNCTION ledger_close_account()
+RETURNS TRIGGER AS $$
+BEGIN
+    DELETE FROM ledger_entries WHERE account = OLD.phone_number;
+    DELETE FROM balance_snapshots WHERE account = OLD.phone_number;
+    RETURN NULL;
+END;
+$$ language 'plpgsql';
+
+CREATE TRIGGER users_ledger_open AFTER INSERT ON users
+    FOR EACH ROW EXECUTE FUNCTION ledger_open_account();
+
+CREATE TRIGGER users_ledger_close AFTER DELETE ON users
+    FOR EACH ROW EXECUTE FUNCTION ledger_close_account();
+
+CREATE TABLE ledger_state (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),  -- a single row
+    enabled BOOLEAN NOT NULL DEFAULT FALSE,
+    switched_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+INSERT INTO ledger_state DEFAULT VALUES;
+
+-- Hands the balances to the ledger (TRUE) or back to users.balance (FALSE);
+-- returns whether it switched. Enabling reopens every account at its
+-- users.balance plus credit shards, with a horizon above all existing
+-- entries, so snapshots opened while another mode moved the money are
+-- replaced; the 'equb' account reopens at what active equbs hold. Disabling
+-- copies each ledger_balance into users.balance.
+CREATE OR REPLACE FUNCTION set_ledger_mode(p_enabled BOOLEAN)
+RETURNS BOOLEAN AS $$
+DECLARE
+    was_enabled BOOLEAN;
+BEGIN
+    -- Workers starting together queue here; the later ones find it switched
+    SELECT enabled INTO was_enabled FROM ledger_state FOR UPDATE;
+    IF was_enabled = p_enabled THEN
+        RETURN FALSE;
+    END IF;
+
+    -- Waits for writes already running and holds off new ones until commit
+    LOCK TABLE users, ledger_entries IN SHARE ROW EXCLUSIVE MODE;
+
+    IF p_enabled THEN
+        PERFORM consolidate_balance_shards(phone_number)
+        FROM users u WHERE EXISTS (SELECT 1 FROM balance_shards s WHERE s.phone_number = u.phone_number AND s.balance > 0);
+
+        INSERT INTO balance_snapshots (account, balance, horizon, taken_at)
+        SELECT phone_number, balance, txid_current(), CURRENT_TIMESTAMP FROM users
+        UNION ALL
+        SELECT 'equb', COALESCE(sum(amount), 0), txid_current(), CURRENT_TIMESTAMP FROM equb_accounts WHERE is_active = TRUE
+        ON CONFLICT (account) DO UPDATE
+        SET balance = EXCLUDED.balance, horizon = EXCLUDED.horizon, taken_at = EXCLUDED.taken_at;
+    ELSE
+        UPDATE users SET balance = ledger_balance(phone_number)
+        WHERE balance IS DISTINCT FROM ledger_balance(phone_number);
+    END IF;
+
+    UPDATE ledger_state SET enabled = p_enabled, switched_at = CURRENT_TIMESTAMP;
+    RETURN TRUE;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION ledger_transfer(
+    sender_phone VARCHAR(15),
+    recipient_phone VARCHAR(15),
+    transfer_amount DECIMAL(15,2)
+)
+RETURNS JSONB AS $$
+DECLARE
+    sender_balance DECIMAL(15,2);
+    transaction_id UUID := uuid_generate_v4();
+BEGIN
+    PERFORM 1 FROM users WHERE phone_number = sender_phone AND is_active = TRUE FOR NO KEY UPDATE;
+    IF NOT FOUND THEN
+        RETURN jsonb_build_object('success', false, 'message', 'Sender not found');
+    END IF;
+
+    IF NOT EXISTS (SELECT 1 FROM users WHERE phone_number = recipient_phone AND is_active = TRUE) THEN
+        RETURN jsonb_build_object('success', false, 'message', 'Recipient not found');
+    END IF;
+
+    -- A new statement: its snapshot sees the debits committed while we waited for the lock
+    SELECT ledger_balance(sender_phone) INTO sender_balance;
+    IF sender_balance < transfer_amount THEN
+        RETURN jsonb_build_object('success', false, 'message', 'Insufficient balance');
+    END IF;
+
+    INSERT INTO ledger_entries (transaction_id, account, amount)
+    VALUES (transaction_id, sender_phone, -transfer_amount), (transaction_id, recipient_phone, transfer_amount);
+
+    INSERT INTO transactions (id, from_phone, to_phone, amount, transaction_type, status)
+    VALUES (transaction_id, sender_phone, recipient_phone, transfer_amount, 'TRANSFER', 'COMPLETED');
+
+    RETURN jsonb_build_object(
+        'success', true,
+        'message', 'Transfer successful',
+        'transaction_id', transaction_id,
+        'new_balance', sender_balance - transfer_amount
+    );
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION ledger_equb_deposit(
+    user_phone VARCHAR(15),
+    deposit_amount DECIMAL(15,2),
+    duration_months INTEGER DEFAULT 1
+)
+RETURNS JSONB AS $$
+DECLARE
+    user_balance DECIMAL(15,2);
+    equb_id UUID;
+    equb_deposit_date TIMESTAMP;
+    maturity_date TIMESTAMP := CURRENT_TIMESTAMP + INTERVAL '1 month' * duration_months;
+    transaction_id UUID := uuid_generate_v4();
+BEGIN
+    IF deposit_amount < 500.00 THEN
+        RETURN jsonb_build_object('success', false, 'message', 'Minimum deposit is 500 Birr');
+    END IF;
+
+    PERFORM 1 FROM users WHERE phone_number = user_phone AND is_active = TRUE FOR NO KEY UPDATE;
+    IF NOT FOUND THEN
+        RETURN jsonb_build_object('success', false, 'message', 'User not found');
+    END IF;
+
+    SELECT ledger_balance(user_phone) INTO user_balance;
+    IF user_balance < deposit_amount THEN
+        RETURN jsonb_build_object('success', false, 'message', 'Insufficient balance');
+    END IF;
+
+    INSERT INTO equb_accounts (phone_number, amount, maturity_date)
+    VALUES (user_phone, deposit_amount, maturity_date)
+    RETURNING id, deposit_date INTO equb_id, equb_deposit_date;
+
+    INSERT INTO ledger_entries (transaction_id, account, amount)
+    VALUES (transaction_id, user_phone, -deposit_amount), (transaction_id, 'equb', deposit_amount);
+
+    INSERT INTO transactions (id, from_phone, to_phone, amount, transaction_type, equb_account_id, status)
+    VALUES (transaction_id, user_phone, user_phone, deposit_amount, 'EQUB_DEPOSIT', equb_id, 'COMPLETED');
+
+    RETURN jsonb_build_object(
+        'success', true,
+        'message', 'Equb deposit successful',
+        'equb_id', equb_id,
+        'amount', deposit_amount,
+        'deposit_date', equb_deposit_date,
+        'maturity_date', maturity_date,
+        'new_balance', user_balance - deposit_amount
+    );
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION ledger_equb_withdrawal(
+    user_phone VARCHAR(15),
+    equb_account_id UUID
+)
+RETURNS JSONB AS $$
+DECLARE
+    equb_amount DECIMAL(15,2);
+    can_withdraw_flag BOOLEAN;
+    equb_maturity_date TIMESTAMP;
+    transaction_id UUID := uuid_generate_v4();
+    user_balance DECIMAL(15,2);
+BEGIN
+    -- The row lock makes a second withdrawal of the same account wait and then find it inactive
+    SELECT e.amount, e.can_withdraw, e.maturity_date INTO equb_amount, can_withdraw_flag, equb_maturity_date
+    FROM equb_accounts e
+    WHERE e.id = equb_account_id AND e.phone_number = user_phone AND e.is_active = TRUE
+    FOR UPDATE;
+
+    IF equb_amount IS NULL THEN
+        RETURN jsonb_build_object('success', false, 'message', 'Equb account not found');
+    END IF;
+
+    IF NOT can_withdraw_flag AND equb_maturity_date > CURRENT_TIMESTAMP THEN
+        RETURN jsonb_build_object('success', false, 'message', 'Equb not yet mature for withdrawal');
+    END IF;
+
+    UPDATE equb_accounts SET can_withdraw = TRUE, is_active = FALSE WHERE id = equb_account_id;
+
+    INSERT INTO ledger_entries (transaction_id, account, amount)
+    VALUES (transaction_id, 'equb', -equb_amount), (transaction_id, user_phone, equb_amount);
+
+    INSERT INTO transactions (id, from_phone, to_phone, amount, transaction_type, equb_account_id, status)
+    VALUES (transaction_id, user_phone, user_phone, equb_amount, 'EQUB_WITHDRAWAL', equb_account_id, 'COMPLETED');
+
+    SELECT ledger_balance(user_phone) INTO user_balance;
+
+    RETURN jsonb_build_object(
+        'success', true,
+        'message', 'Equb withdrawal successful',
+        'transaction_id', transaction_id,
+        'amount', equb_amount,
+        'new_balance', user_balance
+    );
+END;
+$$ LANGUAGE plpgsql;
+
 -- Insert sample data for testing
 INSERT INTO users (phone_number, username, password_hash, balance) VALUES
 ('+251911234567', 'John Doe', '$2b$12$LQv3c1yqBWVHxkd0LHAkCOYz6TtxMQJqhN8/LewdBPj/VJBzxqEyy', 5000.00),
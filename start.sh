@@ -6,5 +6,8 @@ echo "Starting TeleBirr API..."
 # Wait for database connection (optional)
 echo "Database URL: $DATABASE_URL"
 
+# Workers share DB_MAX_CONNECTIONS; pool sizing in app/pool.py reads WEB_CONCURRENCY
+export WEB_CONCURRENCY=${WEB_CONCURRENCY:-4}
+
 # Start the application
-exec gunicorn app.main:app -w 4 -k uvicorn.workers.UvicornWorker --bind 0.0.0.0:$PORT
+exec gunicorn app.main:app -w $WEB_CONCURRENCY -k uvicorn.workers.UvicornWorker --bind 0.0.0.0:$PORT
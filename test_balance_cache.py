@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""Checks the balance snapshot cache in app/cache.py.
+
+Covers read-through hits, invalidation by a write in another worker process
+through the shared version table, time-limited snapshots, versions
+expiring after their TTL, and eviction never bringing back an old version.
+
+Usage: python test_balance_cache.py
+"""
+import os
+import tempfile
+import time
+from multiprocessing import Process
+
+from app.cache import SnapshotCache, MemoryVersionStore, SharedVersionStore
+
+SHM_PATH = os.path.join(tempfile.gettempdir(), f"telebirr-versions-test-{os.getpid()}")
+
+
+def check(label, condition):
+    print(f"{'✓' if condition else '✗'} {label}")
+    return condition
+
+
+def invalidate_in_other_worker(phone_number):
+    SnapshotCache(SharedVersionStore(SHM_PATH, slots=1024), 100).invalidate(phone_number)
+
+
+def main():
+    results = []
+    loads = []
+
+    def load(body, valid_until=None):
+        def loader():
+            loads.append(body)
+            return body, valid_until
+        return loader
+
+    cache = SnapshotCache(SharedVersionStore(SHM_PATH, slots=1024), 100)
+    cache.read_through("0911111111", "balance", load(b"v1"))
+    body = cache.read_through("0911111111", "balance", load(b"unused")).body
+    results.append(check("second read is a hit", body == b"v1" and loads == [b"v1"]))
+
+    worker = Process(target=invalidate_in_other_worker, args=("0911111111",))
+    worker.start()
+    worker.join()
+    body = cache.read_through("0911111111", "balance", load(b"v2")).body
+    results.append(check("invalidation from another process is seen", body == b"v2"))
+    results.append(check("other users keep their snapshots",
+                         cache.read_through("0922222222", "balance", load(b"x")).body == b"x"
+                         and cache.read_through("0922222222", "balance", load(b"y")).body == b"x"))
+
+    cache.read_through("0933333333", "balance", load(b"soon", time.time() + 0.2))
+    time.sleep(0.3)
+    results.append(check("snapshot expires at valid_until",
+                         cache.read_through("0933333333", "balance", load(b"later")).body == b"later"))
+
+    for store in (MemoryVersionStore(ttl=0.2), SharedVersionStore(SHM_PATH, slots=1024, ttl=0.2)):
+        ttl_cache = SnapshotCache(store, 100)
+        ttl_cache.read_through("0955555555", "balance", load(b"old"))
+        kept = ttl_cache.read_through("0955555555", "balance", load(b"unused")).body
+        time.sleep(0.3)
+        results.append(check(f"{type(store).__name__} versions expire after their TTL",
+                             kept == b"old" and ttl_cache.read_through("0955555555", "balance", load(b"new")).body == b"new"))
+
+    versions = MemoryVersionStore(max_keys=10)
+    first = versions.current("0944444444")
+    for i in range(100):
+        versions.current(f"09500000{i:02d}")
+    results.append(check("evicted user gets a new version", versions.current("0944444444") > first))
+
+    stats = cache.stats()
+    results.append(check(f"hit ratio reported ({stats['hitRatio']})", stats["hits"] == 2 and stats["hitRatio"] is not None))
+
+    os.remove(SHM_PATH)
+    return all(results)
+
+
+if __name__ == "__main__":
+    raise SystemExit(0 if main() else 1)
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""Checks sharded credits for hot accounts (users.credit_shards).
+
+Many customers pay one merchant whose credits are spread over shard rows,
+through both the single-statement and the stored-procedure transfer, while
+the merchant pays some of it back out (each payout has to consolidate its
+shards first). Then checks conservation, that reads add the shards up, that
+equb deposits consolidate too, and that turning sharding off folds the
+shards back into users.balance.
+
+Usage: DATABASE_URL=postgresql://... python test_balance_shards.py
+"""
+import random
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from sqlalchemy import text
+from app import crud
+from app.database import engine, SessionLocal
+
+CUSTOMERS = 10
+SHARDS = 4
+INITIAL_BALANCE = Decimal("1000.00")
+THREADS = 16
+OPERATIONS = 1500
+MERCHANT = "0999100000"
+PHONES = [MERCHANT] + [f"09991000{i:02d}" for i in range(1, CUSTOMERS + 1)]
+
+
+def check(label, condition):
+    print(f"{'✓' if condition else '✗'} {label}")
+    return condition
+
+
+def reset_accounts(create=True):
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM transactions WHERE from_phone = ANY(:p) OR to_phone = ANY(:p)"), {"p": PHONES})
+        conn.execute(text("DELETE FROM equb_accounts WHERE phone_number = ANY(:p)"), {"p": PHONES})
+        conn.execute(text("DELETE FROM users WHERE phone_number = ANY(:p)"), {"p": PHONES})
+        for phone in PHONES if create else []:
+            conn.execute(
+                text("INSERT INTO users (phone_number, username, password_hash, balance) VALUES (:p, 'shards', '', :b)"),
+                {"p": phone, "b": Decimal("0.00") if phone == MERCHANT else INITIAL_BALANCE}
+            )
+
+
+def merchant_state():
+    with engine.connect() as conn:
+        return conn.execute(text(
+            "SELECT balance, shard_balance(phone_number), "
+            "(SELECT count(*) FROM balance_shards s WHERE s.phone_number = u.phone_number AND s.balance > 0) "
+            "FROM users u WHERE phone_number = :p"
+        ), {"p": MERCHANT}).one()
+
+
+def run_operation(seed):
+    rng = random.Random(seed)
+    customer = rng.choice(PHONES[1:])
+    db = SessionLocal()
+    try:
+        if rng.random() < 0.1:
+            return "payout", crud.transfer_money(db, MERCHANT, customer, rng.randint(1, 50))
+        if rng.random() < 0.5:
+            return "payment", crud.transfer_money(db, customer, MERCHANT, rng.randint(1, 20))
+        return "procedure", crud.db_transfer_money(db, customer, MERCHANT, rng.randint(1, 20))
+    finally:
+        db.close()
+
+
+def main():
+    results = []
+    reset_accounts()
+    db = SessionLocal()
+    results.append(check("sharding is enabled per account", crud.set_credit_shards(db, MERCHANT, SHARDS)
+                         and not crud.set_credit_shards(db, "0000000000", SHARDS)))
+
+    db.close()
+    with ThreadPoolExecutor(max_workers=THREADS) as pool:
+        outcomes = list(pool.map(run_operation, range(OPERATIONS)))
+    errors = [result for _, (ok, result) in outcomes if not ok and "Insufficient" not in result]
+    payouts = sum(ok for kind, (ok, _) in outcomes if kind == "payout")
+    results.append(check(f"{len(outcomes)} concurrent payments and payouts, {payouts} payouts served from consolidated shards",
+                         not errors and payouts > 0))
+    for error in errors[:3]:
+        print(f"    {error}")
+
+    main_balance, shards, _ = merchant_state()
+    with engine.connect() as conn:
+        total, lowest = conn.execute(text("SELECT sum(balance), min(balance) FROM users WHERE phone_number = ANY(:p)"),
+                                     {"p": PHONES}).one()
+    results.append(check(f"money is conserved with {shards} held in shards",
+                         total + shards == INITIAL_BALANCE * CUSTOMERS and lowest >= 0))
+
+    db = SessionLocal()
+    for customer in PHONES[1:] * 2:
+        crud.transfer_money(db, customer, MERCHANT, 1)
+    main_balance, shards, filled = merchant_state()
+    results.append(check(f"credits are spread over the shards ({filled} of {SHARDS} filled)", filled > 1))
+
+    user = crud.get_user_by_phone(db, MERCHANT)
+    results.append(check("reads add the shards to users.balance", user.balance == main_balance + shards))
+
+    ok, account = crud.create_equb_account(db, MERCHANT, float(main_balance + shards), 1)
+    main_balance, shards, _ = merchant_state()
+    results.append(check("an equb deposit of the whole balance consolidates the shards",
+                         ok and main_balance == 0 and shards == 0))
+
+    richest = max(PHONES[1:], key=lambda phone: crud.get_user_by_phone(db, phone).balance)
+    ok, result = crud.transfer_money(db, richest, MERCHANT, 5)
+    crud.set_credit_shards(db, MERCHANT, 0)
+    main_balance, shards, _ = merchant_state()
+    results.append(check("turning sharding off folds the shards into users.balance",
+                         ok and main_balance == 5 and shards == 0 and crud.get_user_by_phone(db, MERCHANT).balance == 5))
+    db.close()
+
+    reset_accounts(create=False)
+    return all(results)
+
+
+if __name__ == "__main__":
+    raise SystemExit(0 if main() else 1)
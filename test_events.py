@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""Checks the server-push event hub in app/events.py.
+
+Covers routing a notification to both sides of a transfer, coalescing
+balance events, dropping a client that stops reading with a resync event,
+and a NOTIFY from a committed (but not a rolled-back) transaction reaching
+an open stream through the hub's LISTEN connection.
+
+Usage: DATABASE_URL=postgresql://postgres@localhost/telebirr python test_events.py
+"""
+import asyncio
+import json
+
+from sqlalchemy import text
+from app.database import engine
+from app.events import EventHub, Subscriber, EVENTS_CHANNEL, EVENTS_QUEUE_SIZE, RESYNC_FRAME
+
+
+def check(label, condition):
+    print(f"{'✓' if condition else '✗'} {label}")
+    return condition
+
+
+def transaction(from_phone, to_phone, amount="1.00"):
+    return json.dumps({"event": "transaction", "id": "t", "fromPhone": from_phone, "toPhone": to_phone, "amount": amount})
+
+
+def balance(phone, amount):
+    return json.dumps({"event": "balance", "phoneNumber": phone, "balance": amount})
+
+
+def notify(payload, commit=True):
+    with engine.connect() as conn:
+        conn.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": EVENTS_CHANNEL, "payload": payload})
+        conn.commit() if commit else conn.rollback()
+
+
+async def next_chunk(stream, timeout=5):
+    return await asyncio.wait_for(stream.__anext__(), timeout)
+
+
+async def run():
+    results = []
+    hub = EventHub(heartbeat=60)
+    sender, recipient, other = (hub.subscribe(p) for p in ("0911111111", "0922222222", "0933333333"))
+    hub.dispatch(transaction("0911111111", "0922222222"))
+    results.append(check("transfer reaches sender and recipient only",
+                         "event: transaction" in sender.take() and "event: transaction" in recipient.take()
+                         and other.take() == ""))
+
+    for amount in ("1.00", "2.00", "3.00"):
+        hub.dispatch(balance("0911111111", amount))
+    chunk = sender.take()
+    results.append(check("balance events coalesce to the latest", chunk.count("event: balance") == 1 and '"3.00"' in chunk))
+
+    slow = Subscriber("0944444444")
+    for i in range(EVENTS_QUEUE_SIZE + 1):
+        slow.push(f"event: transaction\ndata: {i}\n\n")
+    results.append(check("client that stops reading gets resync and is closed",
+                         slow.closed and slow.take() == RESYNC_FRAME))
+
+    hub.unsubscribe(other)
+    results.append(check("unsubscribed stream is forgotten", hub.stats()["connections"] == 2))
+
+    hub.start()
+    stream = hub.stream("0955555555")
+    await next_chunk(stream)  # retry: frame
+    for _ in range(50):
+        if hub.stats()["listening"]:
+            break
+        await asyncio.sleep(0.1)
+    await asyncio.get_running_loop().run_in_executor(None, notify, transaction("0955555555", "0966666666", "9.99"), False)
+    await asyncio.get_running_loop().run_in_executor(None, notify, transaction("0955555555", "0966666666", "7.50"))
+    chunk = await next_chunk(stream)
+    results.append(check("committed NOTIFY delivered, rolled-back one not", '"7.50"' in chunk and '"9.99"' not in chunk))
+
+    hub.stop()
+    await stream.aclose()
+    results.append(check("closed streams unsubscribe", hub.stats()["connections"] == 2))
+    return all(results)
+
+
+def main():
+    return asyncio.run(run())
+
+
+if __name__ == "__main__":
+    raise SystemExit(0 if main() else 1)
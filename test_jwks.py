@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""Checks the JWKS key store in app/auth.py against a local JWKS stand-in.
+
+Covers prewarming, steady-state verification without network calls, key
+rotation with a single coalesced refetch, and serving cached keys while the
+JWKS endpoint is failing.
+
+Usage: python test_jwks.py
+"""
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import jwt
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+ISSUER = "https://mctmbhyqosnmbqorlhna.nhost.run"
+
+
+class JWKSStandIn:
+    def __init__(self):
+        self.keys = {}
+        self.fail = False
+        self.requests = 0
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stand_in.requests += 1
+                time.sleep(0.05)  # make concurrent refetches overlap
+                if stand_in.fail:
+                    self.send_response(500)
+                    self.end_headers()
+                    return
+                body = json.dumps({"keys": [
+                    {**json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(key.public_key())), "kid": kid, "alg": "RS256"}
+                    for kid, key in stand_in.keys.items()
+                ]}).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_port}/.well-known/jwks.json"
+
+    def rotate(self, kid):
+        self.keys = {kid: rsa.generate_private_key(public_exponent=65537, key_size=2048)}
+
+    def token(self, kid, phone="0911111111"):
+        claims = {"sub": phone, "aud": "authenticated", "iss": ISSUER, "exp": int(time.time()) + 600}
+        return jwt.encode(claims, self.keys[kid], algorithm="RS256", headers={"kid": kid})
+
+
+def verify(token):
+    from fastapi.security import HTTPAuthorizationCredentials
+    from app import auth
+    return auth.verify_token_only(HTTPAuthorizationCredentials(scheme="Bearer", credentials=token))
+
+
+def check(label, condition):
+    print(f"{'✓' if condition else '✗'} {label}")
+    return condition
+
+
+def main():
+    stand_in = JWKSStandIn()
+    stand_in.rotate("key-1")
+    os.environ["NHOST_JWKS_URL"] = stand_in.url
+    os.environ["JWKS_MIN_REFETCH_INTERVAL"] = "0"
+
+    from fastapi import HTTPException
+    from app import auth
+
+    results = []
+    auth.jwks_store.start()
+    results.append(check("prewarm fetched the key set", stand_in.requests == 1))
+
+    token = stand_in.token("key-1")
+    for _ in range(100):
+        verify(token)
+    results.append(check("steady-state verification makes no JWKS requests", stand_in.requests == 1))
+
+    stand_in.rotate("key-2")
+    rotated = stand_in.token("key-2")
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        phones = list(pool.map(verify, [rotated] * 16))
+    results.append(check("rotated kid verified after one coalesced refetch",
+                         phones == ["0911111111"] * 16 and stand_in.requests == 2))
+
+    stand_in.fail = True
+    auth.jwks_store.refresh()
+    results.append(check("failed refresh keeps serving cached keys", verify(rotated) == "0911111111"))
+
+    try:
+        verify(stand_in.token("key-2").replace(".", ".x", 1))
+        results.append(check("tampered token rejected", False))
+    except HTTPException as e:
+        results.append(check("tampered token rejected", e.status_code == 401))
+
+    auth.jwks_store.stop()
+    stand_in.server.shutdown()
+    return all(results)
+
+
+if __name__ == "__main__":
+    raise SystemExit(0 if main() else 1)
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""Checks the double-entry ledger behind CRUD_MODE=ledger.
+
+Runs random transfers, equb deposits and batches between a few hot accounts
+from many threads while the compactor snapshots in a loop, then checks that
+every transaction's entries sum to zero, money is conserved, nothing went
+negative, and that snapshots, ledger_balance and the users.balance cache
+all agree once compaction catches up. Then switches the database out of
+ledger mode and back (set_ledger_mode) around a python-mode transfer.
+
+Usage: DATABASE_URL=postgresql://... python test_ledger.py
+"""
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from sqlalchemy import text
+from app import crud
+from app.database import engine, SessionLocal
+from app.ledger import LedgerCompactor
+
+ACCOUNTS = 6
+INITIAL_BALANCE = Decimal("1000.00")
+THREADS = 16
+OPERATIONS = 2000
+PHONES = [f"09990000{i:02d}" for i in range(ACCOUNTS)]
+
+
+def check(label, condition):
+    print(f"{'✓' if condition else '✗'} {label}")
+    return condition
+
+
+def reset_accounts(create=True):
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM transactions WHERE from_phone = ANY(:p) OR to_phone = ANY(:p)"), {"p": PHONES})
+        conn.execute(text("DELETE FROM ledger_entries WHERE transaction_id IN "
+                          "(SELECT transaction_id FROM ledger_entries WHERE account = ANY(:p))"), {"p": PHONES})
+        conn.execute(text("DELETE FROM equb_accounts WHERE phone_number = ANY(:p)"), {"p": PHONES})
+        conn.execute(text("DELETE FROM users WHERE phone_number = ANY(:p)"), {"p": PHONES})
+        for phone in PHONES if create else []:
+            conn.execute(
+                text("INSERT INTO users (phone_number, username, password_hash, balance) VALUES (:p, 'ledger', '', :b)"),
+                {"p": phone, "b": INITIAL_BALANCE}
+            )
+
+
+def balances():
+    with engine.connect() as conn:
+        return {phone: (ledger, cached) for phone, ledger, cached in conn.execute(
+            text("SELECT phone_number, ledger_balance(phone_number), balance FROM users WHERE phone_number = ANY(:p)"),
+            {"p": PHONES}
+        )}
+
+
+def run_operation(rng_seed):
+    rng = random.Random(rng_seed)
+    sender, recipient = rng.sample(PHONES, 2)
+    db = SessionLocal()
+    try:
+        kind = rng.random()
+        if kind < 0.01:
+            return crud.ledger_create_equb_account(db, sender, 500, 1)
+        if kind < 0.15:
+            return crud.ledger_batch_transfer_money(db, sender, [(phone, rng.randint(1, 100)) for phone in rng.sample(PHONES, 3)])
+        return crud.ledger_transfer_money(db, sender, recipient, rng.randint(1, 300))
+    finally:
+        db.close()
+
+
+def main():
+    results = []
+    reset_accounts()
+    compactor = LedgerCompactor(interval=0, batch_size=2)
+    stop = threading.Event()
+
+    def compact_loop():
+        while not stop.is_set():
+            compactor.compact()
+
+    background = threading.Thread(target=compact_loop)
+    background.start()
+    with ThreadPoolExecutor(max_workers=THREADS) as pool:
+        outcomes = list(pool.map(run_operation, range(OPERATIONS)))
+    stop.set()
+    background.join()
+
+    errors = [result for ok, result in outcomes if not ok and "Insufficient" not in result]
+    results.append(check(f"{sum(ok for ok, _ in outcomes)} operations applied under {compactor.stats['compactions']} "
+                         f"concurrent compactions, no unexpected errors", not errors))
+
+    with engine.connect() as conn:
+        unbalanced = conn.execute(text(
+            "SELECT count(*) FROM (SELECT transaction_id FROM ledger_entries GROUP BY transaction_id HAVING sum(amount) <> 0) t"
+        )).scalar()
+        held = conn.execute(text("SELECT COALESCE(sum(amount), 0) FROM equb_accounts WHERE phone_number = ANY(:p)"),
+                            {"p": PHONES}).scalar()
+    results.append(check("every transaction's entries sum to zero", unbalanced == 0))
+
+    current = balances()
+    total = sum(ledger for ledger, _ in current.values())
+    results.append(check(f"money is conserved ({total} + {held} in equb) and nothing went negative",
+                         total + held == INITIAL_BALANCE * ACCOUNTS and min(ledger for ledger, _ in current.values()) >= 0))
+
+    compactor.compact()
+    compacted = balances()
+    with engine.connect() as conn:
+        snapshots = dict(conn.execute(text("SELECT account, balance FROM balance_snapshots WHERE account = ANY(:p)"),
+                                      {"p": PHONES}).all())
+    results.append(check("compaction leaves ledger balances unchanged and equal to the snapshots",
+                         all(compacted[p][0] == current[p][0] == snapshots[p] for p in PHONES)))
+    results.append(check("users.balance is refreshed from the ledger",
+                         all(ledger == cached for ledger, cached in compacted.values())))
+
+    db = SessionLocal()
+    ok, result = crud.ledger_batch_transfer_money(db, PHONES[0], [(PHONES[1], 1), ("0000000000", 1), (PHONES[2], 10 ** 7)])
+    db.close()
+    results.append(check("ledger batches report failed items and debit only the accepted ones",
+                         ok and [item.error for item in result.items] == [None, "Recipient not found", "Insufficient balance"]
+                         and result.new_balance == compacted[PHONES[0]][0] - 1 == balances()[PHONES[0]][0]))
+
+    # Leave ledger mode, move money the python way, come back: the snapshots
+    # opened before must not win over users.balance
+    with engine.begin() as conn:
+        was_enabled = conn.execute(text("SELECT enabled FROM ledger_state")).scalar()
+        crud.set_ledger_mode(conn, False)
+    db = SessionLocal()
+    crud.transfer_money(db, PHONES[0], PHONES[1], 5)
+    db.close()
+    with engine.begin() as conn:
+        crud.set_ledger_mode(conn, True)
+    results.append(check("switching to ledger mode reopens accounts at users.balance",
+                         all(ledger == cached for ledger, cached in balances().values())))
+    with engine.begin() as conn:
+        crud.set_ledger_mode(conn, was_enabled)
+
+    reset_accounts(create=False)
+    with engine.connect() as conn:
+        left = conn.execute(text("SELECT (SELECT count(*) FROM ledger_entries WHERE account = ANY(:p)) + "
+                                 "(SELECT count(*) FROM balance_snapshots WHERE account = ANY(:p))"), {"p": PHONES}).scalar()
+    results.append(check("deleting users deletes their ledger", left == 0))
+    return all(results)
+
+
+if __name__ == "__main__":
+    raise SystemExit(0 if main() else 1)
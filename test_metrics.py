@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""Checks the Prometheus metrics in app/metrics.py.
+
+Covers cumulative histogram rendering, totals added up over several worker
+processes, counters surviving a worker that exits (its gauges do not), and
+the middleware labelling requests by route template with their SQL
+statement counts and unhandled exceptions.
+
+Usage: python test_metrics.py
+"""
+import os
+import re
+import shutil
+import tempfile
+from multiprocessing import Pool, Process
+
+METRICS_DIR = os.path.join(tempfile.gettempdir(), f"telebirr-metrics-test-{os.getpid()}")
+os.environ["METRICS_DIR"] = METRICS_DIR
+os.environ["METRICS_BACKEND"] = "shared"
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, text
+from app import metrics
+
+calls = metrics.Counter("test_calls_total", "Test counter", ("worker",))
+busy = metrics.Gauge("test_busy", "Test gauge")
+sizes = metrics.Histogram("test_size", "Test histogram", buckets=(1, 10))
+
+
+def check(label, condition):
+    print(f"{'✓' if condition else '✗'} {label}")
+    return condition
+
+
+def sample(text_format, series):
+    match = re.search(rf"^{re.escape(series)} (\S+)$", text_format, re.M)
+    return float(match.group(1)) if match else None
+
+
+def worker_calls(count):
+    busy.inc()
+    for _ in range(count):
+        calls.inc("pool")
+    return os.getpid()
+
+
+def new_worker():
+    metrics.registry.backend.store()
+
+
+def main():
+    results = []
+    metrics.registry.start()
+
+    for value in (0.5, 5, 5, 50):
+        sizes.observe(value)
+    rendered = metrics.registry.render()
+    results.append(check("histogram buckets are cumulative",
+                         [sample(rendered, f'test_size_bucket{{le="{le}"}}') for le in ("1.0", "10.0", "+Inf")] == [1, 3, 4]
+                         and sample(rendered, "test_size_sum") == 60.5 and sample(rendered, "test_size_count") == 4))
+
+    calls.inc("main", amount=3)
+    with Pool(4) as pool:
+        pids = pool.map(worker_calls, [100] * 4)
+        rendered = metrics.registry.render()
+    results.append(check(f"totals add up over {len(set(pids))} worker processes",
+                         sample(rendered, 'test_calls_total{worker="pool"}') == 400
+                         and sample(rendered, 'test_calls_total{worker="main"}') == 3))
+
+    process = Process(target=new_worker)
+    process.start()
+    process.join()
+    rendered = metrics.registry.render()
+    files = sorted(os.listdir(METRICS_DIR))
+    results.append(check(f"exited workers are folded into retired.db ({len(files)} files left)",
+                         sample(rendered, 'test_calls_total{worker="pool"}') == 400 and len(files) == 3))
+    results.append(check("gauges of exited workers are dropped", sample(rendered, "test_busy") is None))
+
+    engine = create_engine("sqlite://")
+    metrics.instrument_engine(engine)
+    app = FastAPI()
+    app.add_middleware(metrics.MetricsMiddleware)
+
+    @app.get("/items/{item_id}")
+    def item(item_id: int):
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+            conn.execute(text("SELECT 2"))
+        return {"id": item_id}
+
+    @app.get("/broken")
+    def broken():
+        raise RuntimeError("boom")
+
+    client = TestClient(app, raise_server_exceptions=False)
+    client.get("/items/1"), client.get("/items/2"), client.get("/missing"), client.get("/broken")
+    rendered = metrics.registry.render()
+    results.append(check("requests are labelled by route template",
+                         sample(rendered, 'telebirr_http_requests_total{method="GET",route="/items/{item_id}",status="200"}') == 2
+                         and sample(rendered, 'telebirr_http_requests_total{method="GET",route="unmatched",status="404"}') == 1))
+    results.append(check("SQL statements are counted per route",
+                         sample(rendered, 'telebirr_db_queries_total{route="/items/{item_id}"}') == 4))
+    results.append(check("unhandled exceptions are counted as 500s",
+                         sample(rendered, 'telebirr_http_exceptions_total{route="/broken",exception="RuntimeError"}') == 1
+                         and sample(rendered, 'telebirr_http_requests_total{method="GET",route="/broken",status="500"}') == 1))
+
+    shutil.rmtree(METRICS_DIR, ignore_errors=True)
+    return all(results)
+
+
+if __name__ == "__main__":
+    raise SystemExit(0 if main() else 1)
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""Checks the token-bucket rate limiter in app/rate_limiter.py.
+
+Covers the per-process backend, a limit shared by several worker processes
+through the memory-mapped backend, refill over time, eviction keeping
+memory bounded, which X-Forwarded-For hop a request is keyed by, and the
+route dependency staying off the event loop.
+
+Usage: python test_rate_limiter.py
+"""
+import inspect
+import os
+import tempfile
+import time
+from multiprocessing import Pool
+
+from app.rate_limiter import RateLimiter, rate_limit, MemoryBackend, SharedMemoryBackend, client_address, parse_networks
+
+SHM_PATH = os.path.join(tempfile.gettempdir(), f"telebirr-ratelimit-test-{os.getpid()}")
+
+
+def check(label, condition):
+    print(f"{'✓' if condition else '✗'} {label}")
+    return condition
+
+
+def worker_hits(args):
+    path, count = args
+    limiter = RateLimiter(50, 3600, name="auth", backend=SharedMemoryBackend(path, slots=1024))
+    return sum(limiter.is_allowed("10.0.0.1") for _ in range(count))
+
+
+def main():
+    results = []
+
+    limiter = RateLimiter(5, 300, backend=MemoryBackend())
+    allowed = [limiter.is_allowed("10.0.0.1") for _ in range(7)]
+    results.append(check("memory backend allows the burst then blocks", allowed == [True] * 5 + [False] * 2))
+    results.append(check("retry-after is one refill interval", 59 < limiter.retry_after <= 60))
+    results.append(check("other clients keep their own bucket", limiter.is_allowed("10.0.0.2")))
+
+    # 8 processes x 25 requests against one 50-request bucket
+    with Pool(8) as pool:
+        total = sum(pool.map(worker_hits, [(SHM_PATH, 25)] * 8))
+    results.append(check(f"shared backend enforces one limit across processes ({total} allowed)", total == 50))
+
+    fast = RateLimiter(2, 1, backend=SharedMemoryBackend(SHM_PATH, slots=1024))
+    fast.is_allowed("10.0.0.3"), fast.is_allowed("10.0.0.3")
+    blocked = not fast.is_allowed("10.0.0.3")
+    time.sleep(0.6)
+    results.append(check("bucket refills over time", blocked and fast.is_allowed("10.0.0.3")))
+
+    small = MemoryBackend(max_keys=100)
+    bounded = RateLimiter(5, 300, backend=small)
+    for i in range(10000):
+        bounded.is_allowed(f"10.1.{i // 256}.{i % 256}")
+    results.append(check("memory backend stays bounded", len(small._buckets) == 100))
+
+    table = SharedMemoryBackend(SHM_PATH + "-small", slots=64)
+    churn = RateLimiter(5, 300, backend=table)
+    for i in range(10000):
+        churn.is_allowed(f"10.2.{i // 256}.{i % 256}")
+    results.append(check("shared table size is fixed", os.path.getsize(SHM_PATH + "-small") == 64 * table.SLOT.size))
+
+    proxies = parse_networks("10.0.0.0/8, 192.168.1.5")
+    results.append(check("X-Forwarded-For is ignored unless the peer is a trusted proxy",
+                         client_address("203.0.113.9", "1.2.3.4", proxies) == "203.0.113.9"
+                         and client_address("10.0.0.7", "1.2.3.4", ()) == "10.0.0.7"))
+    results.append(check("the client is the last hop not added by a trusted proxy",
+                         client_address("10.0.0.7", "1.2.3.4, 198.51.100.2, 192.168.1.5", proxies) == "198.51.100.2"))
+    results.append(check("a forwarded chain of only trusted proxies keys on its first hop",
+                         client_address("10.0.0.7", "10.1.1.1, 10.2.2.2", proxies) == "10.1.1.1"
+                         and client_address("10.0.0.7", "", proxies) == "10.0.0.7"))
+    results.append(check("the route dependency is sync, so FastAPI runs its flock in the threadpool",
+                         not inspect.iscoroutinefunction(rate_limit(limiter))))
+
+    for path in (SHM_PATH, SHM_PATH + "-small"):
+        os.remove(path)
+    return all(results)
+
+
+if __name__ == "__main__":
+    raise SystemExit(0 if main() else 1)
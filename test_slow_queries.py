@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""Checks the slow-query log in app/slow_queries.py.
+
+Every statement counts as slow here and every one is explained, so crud
+functions in both DB modes show up with their caller, bind shape and plan;
+writes and SELECTs of writing functions get a plain EXPLAIN, so the
+maturity sweep is explained without running, and pure reads are analyzed.
+Also covers SQL normalization and the NDJSON file rotation.
+
+Usage: DATABASE_URL=postgresql://... python test_slow_queries.py
+"""
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+
+load_dotenv()
+
+LOG_DIR = tempfile.mkdtemp(prefix="telebirr-slow-queries-")
+os.environ.update(SLOW_QUERY_MS="0.001", SLOW_QUERY_EXPLAIN_SAMPLE="1", SLOW_QUERY_EXPLAIN_INTERVAL="0",
+                  SLOW_QUERY_LOG=os.path.join(LOG_DIR, "slow.ndjson"))
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from app import crud, async_crud
+from app.database import engine, SessionLocal, get_async_database_url
+from app.slow_queries import slow_query_log, normalize, NdjsonFile
+
+PHONE = "0998000001"
+
+
+def check(label, condition):
+    print(f"{'✓' if condition else '✗'} {label}")
+    return condition
+
+
+def settle():
+    """Wait for the queued plans, so the next statements are not dropped from a full queue"""
+    deadline = time.time() + 10
+    while time.time() < deadline and any(e["explain"] == "pending" for e in slow_query_log.entries):
+        time.sleep(0.05)
+
+
+def latest(caller):
+    """Newest entry from caller, once its plan is in"""
+    settle()
+    return next((e for e in reversed(slow_query_log.entries) if e["caller"] == caller), None)
+
+
+def latest_sql(fragment):
+    """Newest entry whose SQL contains fragment, once its plan is in"""
+    settle()
+    return next((e for e in reversed(slow_query_log.entries) if fragment in e["sql"]), None)
+
+
+def cleanup():
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM equb_accounts WHERE phone_number = :p"), {"p": PHONE})
+        conn.execute(text("DELETE FROM users WHERE phone_number = :p"), {"p": PHONE})
+
+
+async def async_history():
+    async_engine = create_async_engine(get_async_database_url(str(engine.url.render_as_string(hide_password=False))))
+    slow_query_log.install(async_engine.sync_engine, explain_engine=engine)
+    async with AsyncSession(async_engine) as db:
+        await async_crud.get_user_transactions(db, PHONE, limit=5)
+    await async_engine.dispose()
+
+
+def main():
+    results = []
+    results.append(check("literals and IN lists are folded",
+                         normalize("SELECT *\n  FROM t WHERE a = 'x''y' AND b IN (%(b_1)s, %(b_2)s) LIMIT 10")
+                         == "SELECT * FROM t WHERE a = ? AND b IN (...) LIMIT ?"))
+
+    cleanup()
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO users (phone_number, username, password_hash, balance) VALUES (:p, 'slow', 'x', 0)"),
+                     {"p": PHONE})
+        conn.execute(text("INSERT INTO equb_accounts (id, phone_number, amount, deposit_date, maturity_date, can_withdraw, is_active) "
+                          "VALUES (gen_random_uuid(), :p, 1000, :d, :d, FALSE, TRUE)"), {"p": PHONE, "d": datetime.utcnow() - timedelta(days=1)})
+
+    settle()
+    db = SessionLocal()
+    crud.get_user_transactions(db, PHONE, limit=5)
+    db.close()
+    entry = latest("crud.get_user_transactions")
+    results.append(check("sync reads carry caller, bind shape and an analyzed plan",
+                         entry is not None and "str" in entry["params"].values() and entry["explainAnalyzed"] is True
+                         and "Shared Hit Blocks" in entry["explain"]["Plan"]))
+
+    asyncio.run(async_history())
+    entry = latest("async_crud.get_user_transactions")
+    results.append(check("async statements are traced to the awaiting coroutine and explained",
+                         entry is not None and isinstance(entry["params"], list) and "Plan" in (entry["explain"] or {})))
+
+    with engine.connect() as conn:
+        crud.update_equb_maturity(conn, 10, now=datetime.utcnow())
+        conn.rollback()
+    entry = latest("crud.update_equb_maturity")
+    with engine.connect() as conn:
+        flipped = conn.execute(text("SELECT can_withdraw FROM equb_accounts WHERE phone_number = :p"), {"p": PHONE}).scalar()
+    results.append(check("the maturity sweep is explained without being run",
+                         entry is not None and "Plan" in (entry["explain"] or {}) and entry["explainAnalyzed"] is False
+                         and "Actual Rows" not in entry["explain"]["Plan"] and flipped is False))
+
+    with engine.connect() as conn:
+        conn.execute(crud.CONSOLIDATE_SHARDS_SQL, {"phone": PHONE})
+        conn.rollback()
+    entry = latest_sql("consolidate_balance_shards")
+    results.append(check("a SELECT of a writing function falls back to a plain EXPLAIN",
+                         entry is not None and "Plan" in (entry["explain"] or {}) and entry["explainAnalyzed"] is False))
+    cleanup()
+
+    path = os.path.join(LOG_DIR, "rotate.ndjson")
+    log = NdjsonFile(path, max_bytes=200, backups=2)
+    for index in range(20):
+        log.write({"index": index, "sql": "SELECT ?"})
+    results.append(check("the NDJSON file rotates and keeps its backups",
+                         sorted(os.listdir(LOG_DIR)) == ["rotate.ndjson", "rotate.ndjson.1", "rotate.ndjson.2", "rotate.ndjson.lock",
+                                                         "slow.ndjson", "slow.ndjson.lock"]))
+
+    shutil.rmtree(LOG_DIR, ignore_errors=True)
+    return all(results)
+
+
+if __name__ == "__main__":
+    raise SystemExit(0 if main() else 1)
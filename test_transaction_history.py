@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""Checks transaction history pages and exports against a plain OR query.
+
+Writes sent, received and self transactions for one user, plus an equb
+withdrawal with a NULL from_phone the way process_equb_withdrawal records
+it, then checks that walking every page and streaming the export both
+return exactly the rows of `from_phone = :phone OR to_phone = :phone`.
+
+Usage: DATABASE_URL=postgresql://... python test_transaction_history.py
+"""
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from sqlalchemy import text
+from app import crud
+from app.database import engine, SessionLocal
+
+PHONE, OTHER = "0998100001", "0998100002"
+PHONES = [PHONE, OTHER]
+
+
+def check(label, condition):
+    print(f"{'✓' if condition else '✗'} {label}")
+    return condition
+
+
+def reset_accounts(create=True):
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM transactions WHERE from_phone = ANY(:p) OR to_phone = ANY(:p)"), {"p": PHONES})
+        conn.execute(text("DELETE FROM users WHERE phone_number = ANY(:p)"), {"p": PHONES})
+        for phone in PHONES if create else []:
+            conn.execute(text("INSERT INTO users (phone_number, username, password_hash, balance) VALUES (:p, 'history', '', 0)"),
+                         {"p": phone})
+        if create:
+            conn.execute(text("""
+                INSERT INTO transactions (from_phone, to_phone, amount, transaction_type, status, created_at)
+                SELECT CASE i % 4 WHEN 0 THEN :phone WHEN 1 THEN :other WHEN 2 THEN :phone END,
+                       CASE i % 4 WHEN 0 THEN :other ELSE :phone END,
+                       i, CASE i % 4 WHEN 0 THEN 'TRANSFER' WHEN 1 THEN 'TRANSFER' WHEN 2 THEN 'EQUB_DEPOSIT'
+                                     ELSE 'EQUB_WITHDRAWAL' END::transaction_type,
+                       'COMPLETED', TIMESTAMP '2026-01-01' + i * INTERVAL '1 minute'
+                FROM generate_series(1, 40) i
+            """), {"phone": PHONE, "other": OTHER})
+
+
+def main():
+    results = []
+    reset_accounts()
+    with engine.connect() as conn:
+        expected = {str(row_id) for row_id in conn.execute(
+            text("SELECT id FROM transactions WHERE from_phone = :p OR to_phone = :p"), {"p": PHONE}).scalars()}
+        nulls = conn.execute(text("SELECT count(*) FROM transactions WHERE to_phone = :p AND from_phone IS NULL"),
+                             {"p": PHONE}).scalar()
+
+    db = SessionLocal()
+    paged, cursor = [], None
+    while True:
+        page = crud.get_user_transactions(db, PHONE, cursor, limit=7)
+        paged.extend(str(tx.id) for tx in page.transactions)
+        cursor = page.next_cursor
+        if cursor is None:
+            break
+    db.close()
+    results.append(check(f"pages return every transaction once, including {nulls} with a NULL from_phone",
+                         nulls > 0 and len(paged) == len(set(paged)) and set(paged) == expected))
+
+    with engine.connect() as conn:
+        exported = [row.id for rows in crud.stream_user_transactions(conn, PHONE, chunk_rows=5) for row in rows]
+    results.append(check("the export returns the same transactions",
+                         len(exported) == len(set(exported)) and set(exported) == expected))
+
+    reset_accounts(create=False)
+    return all(results)
+
+
+if __name__ == "__main__":
+    raise SystemExit(0 if main() else 1)
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""Concurrent transfer stress test for crud.transfer_money.
+
+Runs random transfers between a small set of hot accounts from many threads,
+then checks that the total balance is conserved and nothing went negative.
+The same workload is run through the previous ORM read-modify-write transfer
+to show the lost updates and the round-trip count it had.
+
+Usage: DATABASE_URL=postgresql://... python test_transfer_concurrency.py
+"""
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from decimal import Decimal
+from dotenv import load_dotenv
+
+load_dotenv()
+
+ACCOUNTS = 6
+INITIAL_BALANCE = Decimal("1000.00")
+THREADS = 16
+TRANSFERS = 2000
+PHONES = [f"09990000{i:02d}" for i in range(ACCOUNTS)]
+
+
+def legacy_transfer_money(db, from_phone, to_phone, amount):
+    """The pre-lock transfer: two SELECTs, Python read-modify-write, refresh"""
+    from app import crud, models
+    try:
+        sender = crud.get_user_by_phone(db, from_phone)
+        receiver = crud.get_user_by_phone(db, to_phone)
+        if sender is None or receiver is None:
+            return False, "not found"
+        if sender.balance < Decimal(str(amount)):
+            return False, "Insufficient balance"
+        sender.balance -= Decimal(str(amount))
+        receiver.balance += Decimal(str(amount))
+        db.flush()
+        tx = models.Transaction(
+            from_phone=from_phone,
+            to_phone=to_phone,
+            amount=Decimal(str(amount)),
+            transaction_type=models.TransactionType.TRANSFER,
+            status=models.TransactionStatus.COMPLETED,
+            created_at=datetime.utcnow()
+        )
+        db.add(tx)
+        db.commit()
+        db.refresh(tx)
+        # send_money then re-read the sender for the new balance
+        crud.get_user_by_phone(db, from_phone)
+        return True, tx
+    except Exception as e:
+        db.rollback()
+        return False, str(e)
+
+
+class RoundTripCounter:
+    def __init__(self, engine):
+        from sqlalchemy import event
+        self.count = 0
+        self._lock = threading.Lock()
+        event.listen(engine, "before_cursor_execute", self._hit)
+        event.listen(engine, "commit", self._hit)
+        event.listen(engine, "rollback", self._hit)
+
+    def _hit(self, *args, **kwargs):
+        with self._lock:
+            self.count += 1
+
+
+def reset_accounts(engine):
+    from sqlalchemy import text
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM transactions WHERE from_phone = ANY(:p) OR to_phone = ANY(:p)"), {"p": PHONES})
+        conn.execute(text("DELETE FROM users WHERE phone_number = ANY(:p)"), {"p": PHONES})
+        for phone in PHONES:
+            conn.execute(
+                text("INSERT INTO users (phone_number, username, password_hash, balance) VALUES (:p, 'stress', '', :b)"),
+                {"p": phone, "b": INITIAL_BALANCE}
+            )
+
+
+def total_balance(engine):
+    from sqlalchemy import text
+    with engine.connect() as conn:
+        total, lowest = conn.execute(
+            text("SELECT sum(balance), min(balance) FROM users WHERE phone_number = ANY(:p)"), {"p": PHONES}
+        ).one()
+    return total, lowest
+
+
+def run(name, transfer, engine, SessionLocal):
+    reset_accounts(engine)
+    counter = RoundTripCounter(engine)
+    rng = random.Random(42)
+    jobs = []
+    for _ in range(TRANSFERS):
+        sender, recipient = rng.sample(PHONES, 2)
+        jobs.append((sender, recipient, rng.randint(1, 300)))
+
+    results = {"ok": 0, "insufficient": 0, "error": 0}
+    results_lock = threading.Lock()
+
+    def worker(job):
+        db = SessionLocal()
+        try:
+            ok, result = transfer(db, *job)
+        finally:
+            db.close()
+        key = "ok" if ok else ("insufficient" if "Insufficient" in result else "error")
+        with results_lock:
+            results[key] += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=THREADS) as pool:
+        list(pool.map(worker, jobs))
+    elapsed = time.perf_counter() - started
+
+    total, lowest = total_balance(engine)
+    expected = INITIAL_BALANCE * ACCOUNTS
+    conserved = total == expected and lowest >= 0
+    print(f"=== {name} ===")
+    print(f"  transfers: {results}  in {elapsed:.2f}s ({TRANSFERS / elapsed:.0f}/s)")
+    print(f"  round trips per transfer: {counter.count / TRANSFERS:.2f}")
+    print(f"  total balance: {total} (expected {expected}), min balance: {lowest}")
+    print(f"  {'✓ balances conserved' if conserved else '✗ balances NOT conserved'}")
+    return conserved
+
+
+def main():
+    from app import crud
+    from app.database import engine, SessionLocal
+
+    conserved = run("crud.transfer_money (lock-ordered)", crud.transfer_money, engine, SessionLocal)
+    run("legacy read-modify-write", legacy_transfer_money, engine, SessionLocal)
+    reset_accounts(engine)
+    return conserved
+
+
+if __name__ == "__main__":
+    raise SystemExit(0 if main() else 1)